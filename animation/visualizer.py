@@ -1,121 +1,294 @@
-import numpy as np
-import sys
+import argparse
+import glob
+import multiprocessing
 import os
+import subprocess
+import sys
+import numpy as np
+import matplotlib
+
+matplotlib.use("Agg")
 import matplotlib.pyplot as plt
-import matplotlib.animation as animation
-
-#### Simulation inputs
-rowpts = 257
-colpts = 257
-length = 4
-breadth = 4
-
-# Go to the Result directory
-cwdir = os.getcwd()
-dir_path = os.path.join(cwdir, "Result")
-os.chdir(dir_path)
-# Go through files in the directory and store filenames
-filenames = []
-iterations = []
-for root, dirs, files in os.walk(dir_path):
-    for datafile in files:
-        if "PUV" in datafile:
-            filenames.append(datafile)
-            no_ext_file = datafile.replace(".txt", "").strip()
-            iter_no = int(no_ext_file.split("V")[-1])
-            iterations.append(iter_no)
-# Discern the final iteration and interval
-initial_iter = np.amin(iterations)
-final_iter = np.amax(iterations)
-inter = (final_iter - initial_iter) / (len(iterations) - 1)
-number_of_frames = len(iterations)
-sorted_iterations = np.sort(iterations)
-
-
-def read_datafile(iteration):
-    # Set filename and path according to given iteration
-    filename = "PUV{0}.txt".format(iteration)
-    filepath = os.path.join(dir_path, filename)
-    # Load text file as numpy array
-    arr = np.loadtxt(filepath, delimiter="\t")
-    rows, cols = arr.shape
-    # Define empty arrays for pressure and velocities
-    p_p = np.zeros((rowpts, colpts))
-    u_p = np.zeros((rowpts, colpts))
-    v_p = np.zeros((rowpts, colpts))
-    # Organize imported array into variables
-    p_arr = arr[:, 0]
-    u_arr = arr[:, 1]
-    v_arr = arr[:, 2]
-
-    # Reshape 1D data into 2D
-    p_p = p_arr.reshape((rowpts, colpts))
-    u_p = u_arr.reshape((rowpts, colpts))
-    v_p = v_arr.reshape((rowpts, colpts))
-
-    return p_p, u_p, v_p
-
-
-# Create mesh for X and Y inputs to the figure
-x = np.linspace(0, length, colpts)
-y = np.linspace(0, breadth, rowpts)
-[X, Y] = np.meshgrid(x, y)
-# Determine indexing for stream plot (10 points only)
-index_cut_x = int(colpts / 10)
-index_cut_y = int(rowpts / 10)
-# Create blank figure
-fig = plt.figure(figsize=(16, 8))
-ax = plt.axes(xlim=(0, length), ylim=(0, breadth))
-# Create initial contour and stream plot as well as color bar
-p_p, u_p, v_p = read_datafile(0)
-ax.set_xlim([0, length])
-ax.set_ylim([0, breadth])
-ax.set_xlabel("$x$", fontsize=12)
-ax.set_ylabel("$y$", fontsize=12)
-ax.set_title("Frame No: 0")
-cont = ax.contourf(X, Y, p_p)
-stream = ax.streamplot(
-    X[::index_cut_y, ::index_cut_x],
-    Y[::index_cut_y, ::index_cut_x],
-    u_p[::index_cut_y, ::index_cut_x],
-    v_p[::index_cut_y, ::index_cut_x],
-    color="k",
-)
-fig.colorbar(cont)
-fig.tight_layout()
-
-
-def animate(i):
-    # Print frames left to be added to the animation
-    sys.stdout.write("\rFrames remaining: {0:03d}".format(len(sorted_iterations) - i))
-    sys.stdout.flush()
-    # Get iterations in a sequential manner through sorted_iterations
-    iteration = sorted_iterations[i]
-    # Use the read_datafile function to get pressure and velocities
-    p_p, u_p, v_p = read_datafile(iteration)
-    # Clear previous plot and make contour and stream plots for current iteration
-    ax.clear()
-    ax.set_xlim([0, length])
-    ax.set_ylim([0, breadth])
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin"))
+import results
+
+
+# Frames of a result directory, read from PUV.bin when the run wrote binary output and from the
+# PUV{iteration}.txt files otherwise. The mesh size and domain come from the binary header; for
+# text files they are given, or a square mesh is inferred from the first file and the domain
+# defaults to 4
+class ResultFrames:
+    def __init__(self, dir_path, rowpts=None, colpts=None, length=None, breadth=None):
+        binary = os.path.join(dir_path, results.BINARY_FILENAME)
+        if os.path.isfile(binary):
+            header, self.frames = results.ReadResults(binary)
+            self.rowpts = header["rowpts"]
+            self.colpts = header["colpts"]
+            metadata = header["metadata"]
+            self.length = length or metadata.get("length", 4)
+            self.breadth = breadth or metadata.get("breadth", 4)
+            self.iterations = [int(iteration) for iteration in self.frames["iteration"]]
+            self.paths = None
+        else:
+            self.frames = None
+            paths = glob.glob(os.path.join(dir_path, "PUV*.txt"))
+            if not paths:
+                raise FileNotFoundError("No PUV.bin or PUV*.txt files in {0}".format(dir_path))
+            paths.sort(key=lambda path: int(os.path.basename(path)[3:-4]))
+            self.paths = paths
+            self.iterations = [int(os.path.basename(path)[3:-4]) for path in paths]
+            if rowpts is None or colpts is None:
+                points = self.ReadText(paths[0]).size // 3
+                side = int(round(np.sqrt(points)))
+                if side * side != points:
+                    raise ValueError("Give rowpts and colpts for a mesh that is not square")
+                rowpts = colpts = side
+            self.rowpts = rowpts
+            self.colpts = colpts
+            self.length = length or 4
+            self.breadth = breadth or 4
+
+    def __len__(self):
+        return len(self.iterations)
+
+    # Whitespace separated p, u and v of every point, parsed in one pass
+    def ReadText(self, path):
+        return np.fromfile(path, sep=" ")
+
+    # Pressure and velocities of frame k
+    def Read(self, k):
+        if self.paths is None:
+            frame = self.frames[k]
+            return np.asarray(frame["p"]), np.asarray(frame["u"]), np.asarray(frame["v"])
+        arr = self.ReadText(self.paths[k]).reshape((self.rowpts, self.colpts, 3))
+        return arr[:, :, 0], arr[:, :, 1], arr[:, :, 2]
+
+
+# Mesh coordinates and the subsampled points of the stream and quiver plots, computed once
+class Geometry:
+    def __init__(self, rowpts, colpts, length, breadth, arrows=10):
+        x = np.linspace(0, length, colpts)
+        y = np.linspace(0, breadth, rowpts)
+        self.X, self.Y = np.meshgrid(x, y)
+        self.cut = (
+            slice(None, None, max(rowpts // arrows, 1)),
+            slice(None, None, max(colpts // arrows, 1)),
+        )
+        self.X_cut = self.X[self.cut]
+        self.Y_cut = self.Y[self.cut]
+        self.length = length
+        self.breadth = breadth
+
+
+def CreateFigure(geometry, figsize=(16, 8), dpi=100):
+    fig = plt.figure(figsize=figsize, dpi=dpi)
+    ax = plt.axes(xlim=(0, geometry.length), ylim=(0, geometry.breadth))
     ax.set_xlabel("$x$", fontsize=12)
     ax.set_ylabel("$y$", fontsize=12)
-    ax.set_title("Frame No: {0}".format(i))
-    cont = ax.contourf(X, Y, p_p)
-    stream = ax.streamplot(
-        X[::index_cut_y, ::index_cut_x],
-        Y[::index_cut_y, ::index_cut_x],
-        u_p[::index_cut_y, ::index_cut_x],
-        v_p[::index_cut_y, ::index_cut_x],
-        color="k",
-    )
-    return cont, stream
+    return fig, ax
+
+
+# Contour and stream plot of a frame. The figure, axes, colour bar and layout are made once, so all
+# workers produce the same layout; for every frame only the contour and stream plot artists of the
+# previous frame are replaced
+class FullRenderer:
+    def __init__(self, geometry, figsize=(16, 8), dpi=100):
+        self.geometry = geometry
+        self.fig, self.ax = CreateFigure(geometry, figsize, dpi)
+        self.colorbar = self.fig.colorbar(matplotlib.cm.ScalarMappable(), ax=self.ax)
+        self.fig.tight_layout()
+        self.artists = []
+
+    def Render(self, p, u, v, title):
+        g = self.geometry
+        for artist in self.artists:
+            artist.remove()
+        before = set(self.ax.get_children())
+        cont = self.ax.contourf(g.X, g.Y, p)
+        self.ax.streamplot(g.X_cut, g.Y_cut, u[g.cut], v[g.cut], color="k")
+        self.artists = [artist for artist in self.ax.get_children() if artist not in before]
+        self.colorbar.update_normal(cont)
+        self.ax.set_title(title)
+        self.fig.canvas.draw()
+        return bytes(self.fig.canvas.buffer_rgba())
+
+    def Size(self):
+        return self.fig.canvas.get_width_height()
+
 
+# Fast preview: the pressure as an image and the velocity as arrows, updated in place
+class PreviewRenderer:
+    def __init__(self, geometry, figsize=(16, 8), dpi=100):
+        g = geometry
+        self.geometry = g
+        self.fig, self.ax = CreateFigure(g, figsize, dpi)
+        blank = np.zeros(g.X.shape)
+        self.image = self.ax.imshow(
+            blank, origin="lower", extent=(0, g.length, 0, g.breadth), aspect="auto"
+        )
+        self.quiver = self.ax.quiver(g.X_cut, g.Y_cut, blank[g.cut], blank[g.cut])
+        self.fig.colorbar(self.image)
+        self.fig.tight_layout()
 
-print("######## Making FlowPy Animation ########")
-print("#########################################")
-anim = animation.FuncAnimation(
-    fig, animate, frames=number_of_frames, interval=50, blit=False
-)
-movie_path = os.path.join(dir_path, "FluidFlowAnimation.mp4")
-anim.save(r"{0}".format(movie_path))
-print("\nAnimation saved as FluidFlowAnimation.mp4 in Result")
+    def Render(self, p, u, v, title):
+        cut = self.geometry.cut
+        self.image.set_data(p)
+        self.image.set_clim(np.amin(p), np.amax(p))
+        self.quiver.set_UVC(u[cut], v[cut])
+        self.ax.set_title(title)
+        self.fig.canvas.draw()
+        return bytes(self.fig.canvas.buffer_rgba())
+
+    def Size(self):
+        return self.fig.canvas.get_width_height()
+
+
+# Pipes raw RGBA frames to ffmpeg, which encodes them to a video file
+class Encoder:
+    def __init__(self, path, size, fps=20, ffmpeg=None):
+        width, height = size
+        command = [
+            ffmpeg or matplotlib.rcParams["animation.ffmpeg_path"],
+            "-y",
+            "-loglevel",
+            "error",
+            "-f",
+            "rawvideo",
+            "-pix_fmt",
+            "rgba",
+            "-s",
+            "{0}x{1}".format(width, height),
+            "-r",
+            str(fps),
+            "-i",
+            "-",
+            "-vcodec",
+            "libx264",
+            "-pix_fmt",
+            "yuv420p",
+            path,
+        ]
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    def Write(self, frame):
+        self.process.stdin.write(frame)
+
+    def Close(self):
+        self.process.stdin.close()
+        if self.process.wait() != 0:
+            raise RuntimeError("ffmpeg exited with code {0}".format(self.process.returncode))
+
+
+#### Rendering in worker processes. Each worker opens the results and makes its figure once
+WORKER = None
+
+
+def InitWorker(dir_path, mesh, figsize, dpi):
+    global WORKER
+    frames = ResultFrames(dir_path, *mesh)
+    geometry = Geometry(frames.rowpts, frames.colpts, frames.length, frames.breadth)
+    WORKER = (frames, FullRenderer(geometry, figsize, dpi))
+
+
+def RenderFrame(k):
+    frames, renderer = WORKER
+    return renderer.Render(*frames.Read(k), "Frame No: {0}".format(k))
+
+
+def Progress(k, count):
+    sys.stdout.write("\rFrames remaining: {0:03d}".format(count - k))
+    sys.stdout.flush()
+
+
+# Render every frame of a result directory to a video. Full frames are rendered by a pool of worker
+# processes; at most two frames per worker are in flight and they are encoded in order. The preview
+# renders in this process by updating its artists
+def RenderAnimation(
+    dir_path,
+    output=None,
+    preview=False,
+    workers=None,
+    mesh=(None, None, None, None),
+    fps=20,
+    figsize=(16, 8),
+    dpi=100,
+):
+    frames = ResultFrames(dir_path, *mesh)
+    count = len(frames)
+    geometry = Geometry(frames.rowpts, frames.colpts, frames.length, frames.breadth)
+    output = output or os.path.join(dir_path, "FluidFlowAnimation.mp4")
+    print("######## Making FlowPy Animation ########")
+    print("#########################################")
+    print("# Frames: {0}\tMesh: {1} x {2}".format(count, frames.colpts, frames.rowpts))
+
+    if preview:
+        renderer = PreviewRenderer(geometry, figsize, dpi)
+        encoder = Encoder(output, renderer.Size(), fps)
+        try:
+            for k in range(count):
+                Progress(k, count)
+                encoder.Write(renderer.Render(*frames.Read(k), "Frame No: {0}".format(k)))
+        finally:
+            encoder.Close()
+    else:
+        # The video size is that of the figure every worker makes
+        size = FullRenderer(geometry, figsize, dpi).Size()
+        workers = workers or os.cpu_count()
+        encoder = Encoder(output, size, fps)
+        try:
+            with multiprocessing.Pool(workers, InitWorker, (dir_path, mesh, figsize, dpi)) as pool:
+                pending = []
+                submitted = 0
+                for k in range(count):
+                    while submitted < count and submitted < k + 2 * workers:
+                        pending.append(pool.apply_async(RenderFrame, (submitted,)))
+                        submitted += 1
+                    Progress(k, count)
+                    encoder.Write(pending.pop(0).get())
+        finally:
+            encoder.Close()
+    print("\nAnimation saved as {0}".format(output))
+    return output
+
+
+# Encode frames from a live stream (streaming.FrameStream, or streaming.Stream) with the preview
+# renderer as they arrive. Run it on a consumer thread or process while the solver publishes frames
+def RenderStream(frames, output, fps=20, figsize=(16, 8), dpi=100):
+    renderer = None
+    encoder = None
+    try:
+        for frame in frames:
+            if renderer is None:
+                rows, cols = frame.p.shape
+                geometry = Geometry(rows, cols, (cols - 1) * frame.dx, (rows - 1) * frame.dy)
+                renderer = PreviewRenderer(geometry, figsize, dpi)
+                encoder = Encoder(output, renderer.Size(), fps)
+            title = "Step {0}, t = {1:.3f}".format(frame.iteration, frame.time)
+            encoder.Write(renderer.Render(frame.p, frame.u, frame.v, title))
+    finally:
+        if encoder is not None:
+            encoder.Close()
+    return output
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Make an animation of FlowPy results")
+    parser.add_argument("dir_path", nargs="?", default="results")
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--preview", action="store_true", help="fast imshow/quiver rendering")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--rowpts", type=int, default=None)
+    parser.add_argument("--colpts", type=int, default=None)
+    parser.add_argument("--length", type=float, default=None)
+    parser.add_argument("--breadth", type=float, default=None)
+    parser.add_argument("--fps", type=int, default=20)
+    args = parser.parse_args()
+    RenderAnimation(
+        os.path.abspath(args.dir_path),
+        args.output,
+        args.preview,
+        args.workers,
+        (args.rowpts, args.colpts, args.length, args.breadth),
+        args.fps,
+    )
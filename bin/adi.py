@@ -0,0 +1,140 @@
+import numpy as np
+import utils
+
+
+# Semi-implicit predictor. Advection and the source term stay explicit, while the viscous term is
+# integrated with the alternating direction implicit (Peaceman-Rachford) scheme in two half steps:
+#   (1 - r Dxx) u_half = u + dt / 2 * (S - advection) + r Dyy u
+#   (1 - r Dyy) u_star = u_half + dt / 2 * (S - advection) + r Dxx u_half
+# with r = dt / 2 * mu / rho. Each half step is a tridiagonal system along one axis, the same for
+# every row (or column), solved for all of them at once. The diffusion term then no longer limits
+# the time-step. The ghost cells set by SetUBoundary/SetVBoundary are written as
+# ghost = coefficient * neighbour + constant, following the boundary plan of the field, and the
+# coefficient is folded into the first and last row of each system
+
+
+# Second difference weights (east, west) along x and (north, south) along y of the interior points
+def AxisWeights(space):
+    grid = getattr(space, "grid", None)
+    if grid is not None:
+        return grid.xe, grid.xw, grid.yn[:, 0], grid.ys[:, 0]
+    rows = int(space.rowpts)
+    cols = int(space.colpts)
+    x = np.full(cols, 1 / float(space.dx) ** 2)
+    y = np.full(rows, 1 / float(space.dy) ** 2)
+    return x, x, y, y
+
+
+# Coefficient of the interior neighbour in the ghost cells of each side of a boundary plan
+def GhostCoefficients(plan):
+    return [0.0 if segment[2] is None else float(segment[2]) for segment in plan.segments]
+
+
+# Factors of the Thomas algorithm for the system (1 - r D2) x = d along one axis with the weights
+# (up, down) of the second difference and the ghost coefficients (first, last): the ratio of the
+# upper diagonal to the pivot, the inverse pivot and the lower diagonal of every row
+def ThomasFactors(r, up, down, first, last):
+    n = len(up)
+    lower = -r * np.asarray(down, dtype=float)
+    upper = -r * np.asarray(up, dtype=float)
+    diagonal = 1 + r * (np.asarray(up, dtype=float) + np.asarray(down, dtype=float))
+    diagonal[0] += lower[0] * first
+    diagonal[-1] += upper[-1] * last
+    ratio = np.zeros(n)
+    inverse = np.zeros(n)
+    pivot = diagonal[0]
+    for i in range(n):
+        if i > 0:
+            pivot = diagonal[i] - lower[i] * ratio[i - 1]
+        inverse[i] = 1 / pivot
+        ratio[i] = upper[i] / pivot
+    return ratio, inverse, lower
+
+
+# Solve the tridiagonal systems in place along the last axis of d, one system per row of d
+def SolveRows(d, ratio, inverse, lower):
+    n = d.shape[-1]
+    d[..., 0] *= inverse[0]
+    for i in range(1, n):
+        d[..., i] -= lower[i] * d[..., i - 1]
+        d[..., i] *= inverse[i]
+    for i in range(n - 2, -1, -1):
+        d[..., i] -= ratio[i] * d[..., i + 1]
+
+
+# Solve the tridiagonal systems in place along the second last axis of d, one system per column
+def SolveColumns(d, ratio, inverse, lower):
+    n = d.shape[-2]
+    d[..., 0, :] *= inverse[0]
+    for i in range(1, n):
+        d[..., i, :] -= lower[i] * d[..., i - 1, :]
+        d[..., i, :] *= inverse[i]
+    for i in range(n - 2, -1, -1):
+        d[..., i, :] -= ratio[i] * d[..., i + 1, :]
+
+
+# Viscous half steps of one velocity component f, with the explicit part dt / 2 * (S - advection)
+# in explicit. The result is written to out, the interior of the starred velocity
+def ViscousStep(space, f, plan, weights, r, explicit, out):
+    rows = int(space.rowpts)
+    cols = int(space.colpts)
+    east, west, north, south = weights
+    left, right, top, bottom = GhostCoefficients(plan)
+    w = space.workspace
+    f_c = f[..., 1 : rows + 1, 1 : cols + 1]
+
+    # Implicit along x: the right hand side with the explicit second difference along y
+    np.multiply(f[..., 2:, 1 : cols + 1], north[:, np.newaxis], out=w.t3)
+    np.multiply(f[..., 0:rows, 1 : cols + 1], south[:, np.newaxis], out=w.t4)
+    w.t3 += w.t4
+    np.multiply(f_c, (north + south)[:, np.newaxis], out=w.t4)
+    w.t3 -= w.t4
+    w.t3 *= r
+    w.t3 += f_c
+    w.t3 += explicit
+    # Constant part of the ghost cells on the left and right
+    np.copyto(out, w.t3)
+    out[..., :, 0] += r * west[0] * (f[..., 1 : rows + 1, 0] - left * f[..., 1 : rows + 1, 1])
+    out[..., :, -1] += r * east[-1] * (
+        f[..., 1 : rows + 1, cols + 1] - right * f[..., 1 : rows + 1, cols]
+    )
+    SolveRows(out, *ThomasFactors(r, east, west, left, right))
+
+    # Implicit along y: r Dxx u_half, ghost cells included, is u_half minus the right hand side
+    # of the first half step without the ghost cells
+    np.multiply(out, 2, out=w.t4)
+    w.t4 -= w.t3
+    w.t4 += explicit
+    # Constant part of the ghost cells at the bottom (row 0) and top
+    w.t4[..., 0, :] += r * south[0] * (f[..., 0, 1 : cols + 1] - bottom * f[..., 1, 1 : cols + 1])
+    w.t4[..., -1, :] += r * north[-1] * (
+        f[..., rows + 1, 1 : cols + 1] - top * f[..., rows, 1 : cols + 1]
+    )
+    SolveColumns(w.t4, *ThomasFactors(r, north, south, bottom, top))
+    np.copyto(out, w.t4)
+
+
+# Starred velocities with implicit viscous terms, in place of utils.GetStarredVelocities. The
+# boundary plans of u and v are those of the last SetUBoundary and SetVBoundary calls
+def GetStarredVelocities(space, fluid):
+    rows = int(space.rowpts)
+    cols = int(space.colpts)
+    u = space.u
+    v = space.v
+    dt = space.dt
+    w = space.workspace
+    r = dt / 2 * float(fluid.mu) / float(fluid.rho)
+    weights = AxisWeights(space)
+    plans = space.boundary_plans
+    u_star_c = space.u_star[..., 1 : rows + 1, 1 : cols + 1]
+    v_star_c = space.v_star[..., 1 : rows + 1, 1 : cols + 1]
+    utils.SetStarredBoundaries(space)
+
+    # The explicit predictor without viscosity gives u + dt * (S - advection) in the interior of the
+    # starred velocities, which is turned into the explicit part of each half step
+    utils.GetStarredVelocities(space, utils.Fluid(fluid.rho, 0.0), copy_boundaries=False)
+    for field, star_c, name in ((u, u_star_c, "u"), (v, v_star_c, "v")):
+        explicit = w.t1
+        np.subtract(star_c, field[..., 1 : rows + 1, 1 : cols + 1], out=explicit)
+        explicit *= 1 / 2
+        ViscousStep(space, field, plans[name], weights, r, explicit, star_c)
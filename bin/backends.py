@@ -0,0 +1,254 @@
+import argparse
+import numpy as np
+import utils
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Loops marked with prange run multithreaded when a kernel is compiled with parallel=True
+prange = numba.prange if numba is not None else range
+
+
+# Kernel backend for the projection step: the predictor, the Jacobi pressure iteration and the
+# corrector, each with the same signature as its utils counterpart
+class Backend:
+    def __init__(self, name, starred, pressure, momentum):
+        self.name = name
+        self.GetStarredVelocities = starred
+        self.SolvePressurePoisson = pressure
+        self.SolveMomentumEquation = momentum
+
+
+# The NumPy kernels in utils are the reference implementation and the fallback
+NUMPY_BACKEND = Backend(
+    "numpy",
+    utils.GetStarredVelocities,
+    utils.SolvePressurePoisson,
+    utils.SolveMomentumEquation,
+)
+
+
+#### Fused stencil loops. Each kernel makes a single pass over the grid and evaluates the same
+#### finite difference expressions as the NumPy kernels in utils
+def StarredVelocitiesLoop(u, v, u_star, v_star, dx, dy, dt, nu, S_x, S_y):
+    rows = u.shape[0] - 2
+    cols = u.shape[1] - 2
+    for i in prange(rows + 2):
+        if i == 0 or i == rows + 1:
+            for j in range(cols + 2):
+                u_star[i, j] = u[i, j]
+                v_star[i, j] = v[i, j]
+            continue
+        u_star[i, 0] = u[i, 0]
+        v_star[i, 0] = v[i, 0]
+        u_star[i, cols + 1] = u[i, cols + 1]
+        v_star[i, cols + 1] = v[i, cols + 1]
+        for j in range(1, cols + 1):
+            u1_y = (u[i + 1, j] - u[i - 1, j]) / (2 * dy)
+            u1_x = (u[i, j + 1] - u[i, j - 1]) / (2 * dx)
+            u2_y = (u[i + 1, j] - 2 * u[i, j] + u[i - 1, j]) / (dy**2)
+            u2_x = (u[i, j + 1] - 2 * u[i, j] + u[i, j - 1]) / (dx**2)
+            v_face = (v[i, j] + v[i, j - 1] + v[i + 1, j] + v[i + 1, j - 1]) / 4
+            u_star[i, j] = (
+                u[i, j]
+                - dt * (u[i, j] * u1_x + v_face * u1_y)
+                + (dt * nu * (u2_x + u2_y))
+                + (dt * S_x)
+            )
+
+            v1_y = (v[i + 1, j] - v[i - 1, j]) / (2 * dy)
+            v1_x = (v[i, j + 1] - v[i, j - 1]) / (2 * dx)
+            v2_y = (v[i + 1, j] - 2 * v[i, j] + v[i - 1, j]) / (dy**2)
+            v2_x = (v[i, j + 1] - 2 * v[i, j] + v[i, j - 1]) / (dx**2)
+            u_face = (u[i, j] + u[i, j + 1] + u[i - 1, j] + u[i - 1, j + 1]) / 4
+            v_star[i, j] = (
+                v[i, j]
+                - dt * (u_face * v1_x + v[i, j] * v1_y)
+                + (dt * nu * (v2_x + v2_y))
+                + (dt * S_y)
+            )
+
+
+def PressureSourceLoop(u_star, v_star, source, dx, dy, scale):
+    rows, cols = source.shape
+    for i in prange(rows):
+        for j in range(cols):
+            ustar1_x = (u_star[i + 1, j + 2] - u_star[i + 1, j]) / (2 * dx)
+            vstar1_y = (v_star[i + 2, j + 1] - v_star[i, j + 1]) / (2 * dy)
+            source[i, j] = scale * (ustar1_x + vstar1_y)
+
+
+# One Jacobi sweep from p_old into p, returning the maximum change
+def JacobiSweepLoop(p, p_old, source, row_error, dx, dy, factor):
+    rows, cols = source.shape
+    p_old[:, :] = p
+    for i in prange(rows):
+        error = 0.0
+        for j in range(cols):
+            p2_xy = (p_old[i + 2, j + 1] + p_old[i, j + 1]) / dy**2 + (
+                p_old[i + 1, j + 2] + p_old[i + 1, j]
+            ) / dx**2
+            value = p2_xy * factor - source[i, j]
+            error = max(error, abs(value - p_old[i + 1, j + 1]))
+            p[i + 1, j + 1] = value
+        row_error[i] = error
+    return row_error.max()
+
+
+def MomentumLoop(u, v, u_star, v_star, p, dx, dy, dt_rho):
+    rows = u.shape[0] - 2
+    cols = u.shape[1] - 2
+    for i in prange(1, rows + 1):
+        for j in range(1, cols + 1):
+            p1_x = (p[i, j + 1] - p[i, j - 1]) / (2 * dx)
+            u[i, j] = u_star[i, j] - dt_rho * p1_x
+            p1_y = (p[i + 1, j] - p[i - 1, j]) / (2 * dy)
+            v[i, j] = v_star[i, j] - dt_rho * p1_y
+
+
+# Build a backend from the loops above, compiled with numba (optionally multithreaded)
+def CreateLoopBackend(name, jit):
+    starred_loop = jit(StarredVelocitiesLoop)
+    source_loop = jit(PressureSourceLoop)
+    sweep_loop = jit(JacobiSweepLoop)
+    momentum_loop = jit(MomentumLoop)
+
+    def GetStarredVelocities(space, fluid):
+        starred_loop(
+            space.u,
+            space.v,
+            space.u_star,
+            space.v_star,
+            float(space.dx),
+            float(space.dy),
+            float(space.dt),
+            float(fluid.mu) / float(fluid.rho),
+            float(space.S_x),
+            float(space.S_y),
+        )
+
+    def SolvePressurePoisson(space, fluid, left, right, top, bottom):
+        dx = float(space.dx)
+        dy = float(space.dy)
+        factor = 1 / (2 / dx**2 + 2 / dy**2)
+        w = space.workspace
+        source_loop(
+            space.u_star,
+            space.v_star,
+            w.t1,
+            dx,
+            dy,
+            float(fluid.rho) * factor / float(space.dt),
+        )
+        row_error = w.t2[:, 0]
+        boundary_plan = utils.GetBoundaryPlan(space, "p", left, right, top, bottom)
+
+        # Same convergence control as utils.SolvePressurePoisson
+        error = 1
+        tol = 1e-3
+        i = 0
+        while error > tol:
+            i += 1
+            error = sweep_loop(space.p, w.p_old, w.t1, row_error, dx, dy, factor)
+            boundary_plan.Apply(space.p)
+            if i > 500:
+                tol *= 10
+        space.p_iterations = i
+        space.p_residual = error
+
+    def SolveMomentumEquation(space, fluid):
+        momentum_loop(
+            space.u,
+            space.v,
+            space.u_star,
+            space.v_star,
+            space.p,
+            float(space.dx),
+            float(space.dy),
+            float(space.dt) / float(fluid.rho),
+        )
+
+    return Backend(name, GetStarredVelocities, SolvePressurePoisson, SolveMomentumEquation)
+
+
+BACKENDS = {"numpy": NUMPY_BACKEND}
+if numba is not None:
+    BACKENDS["numba"] = CreateLoopBackend("numba", lambda loop: numba.njit(loop, cache=True))
+    BACKENDS["numba-parallel"] = CreateLoopBackend(
+        "numba-parallel", lambda loop: numba.njit(loop, cache=True, parallel=True)
+    )
+
+
+# Return the kernel backend selected through the "backend" entry of sim_params. Without numba the
+# numba backends fall back to the NumPy kernels
+def GetBackend(name="numpy"):
+    if name in BACKENDS:
+        return BACKENDS[name]
+    if name in ("numba", "numba-parallel"):
+        print("# numba is not installed, using the numpy backend instead of {0}".format(name))
+        return NUMPY_BACKEND
+    raise ValueError("Unknown kernel backend: {0}".format(name))
+
+
+# Advance the lid-driven cavity with a backend and with the NumPy reference for a few steps and
+# return the largest difference of u, v and p between them
+def CompareWithNumpy(backend, rowpts=33, colpts=33, steps=20, CFL=0.8):
+    noslip = utils.Boundary("D", 0)
+    flow = utils.Boundary("D", 1)
+    zeroflux = utils.Boundary("N", 0)
+    pressureatm = utils.Boundary("D", 0)
+    fluid = utils.Fluid(1, 0.01)
+    spaces = []
+    for kernels in (NUMPY_BACKEND, backend):
+        space = utils.Space()
+        space.CreateMesh(rowpts, colpts)
+        space.SetDeltas(1, 1)
+        for _ in range(steps):
+            utils.SetTimeStep(CFL, space, fluid)
+            utils.SetUBoundary(space, noslip, noslip, flow, noslip)
+            utils.SetVBoundary(space, noslip, noslip, noslip, noslip)
+            utils.SetPBoundary(space, zeroflux, zeroflux, pressureatm, zeroflux)
+            kernels.GetStarredVelocities(space, fluid)
+            kernels.SolvePressurePoisson(space, fluid, zeroflux, zeroflux, pressureatm, zeroflux)
+            kernels.SolveMomentumEquation(space, fluid)
+        spaces.append(space)
+    reference, result = spaces
+    return max(
+        np.amax(np.abs(result.u - reference.u)),
+        np.amax(np.abs(result.v - reference.v)),
+        np.amax(np.abs(result.p - reference.p)),
+    )
+
+
+# Check that every available backend reproduces the NumPy kernels to within tolerance, raising an
+# error that lists the backends that do not. Returns the largest difference of each backend
+def CheckBackends(tolerance=1e-10):
+    differences = {}
+    for name, backend in BACKENDS.items():
+        if backend is NUMPY_BACKEND:
+            continue
+        differences[name] = CompareWithNumpy(backend)
+        print(
+            "# {0}: largest difference from the numpy kernels {1:.3e}".format(
+                name, differences[name]
+            )
+        )
+    mismatches = [name for name, difference in differences.items() if not difference <= tolerance]
+    if mismatches:
+        raise RuntimeError(
+            "Backends differ from the numpy kernels by more than {0:.0e}: {1}".format(
+                tolerance, ", ".join(mismatches)
+            )
+        )
+    return differences
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Check that the kernel backends reproduce the numpy kernels"
+    )
+    parser.add_argument("--tolerance", type=float, default=1e-10)
+    args = parser.parse_args()
+    CheckBackends(args.tolerance)
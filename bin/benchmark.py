@@ -0,0 +1,281 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time as clock
+import tracemalloc
+import numpy as np
+import utils
+import backends
+import grids
+import poisson
+import cfd
+
+
+# Benchmarks and validation for the solver kernels. The benchmark times the predictor, the pressure
+# solve and the corrector, and whole time steps, on lid-driven cavity meshes of increasing size,
+# reporting the throughput in cell updates per second and the peak memory of a step. Results are
+# stored as JSON so that a later run can be compared with them and regressions flagged. The
+# validation runs the Re = 100 cavity to steady state and compares the centreline velocity profiles
+# with the reference solution of Ghia, Ghia and Shin (1982)
+SIZES = (65, 129, 257, 513, 1025)
+KERNELS = ("predictor", "pressure", "corrector", "step")
+FLUID = utils.Fluid(1, 0.01)
+
+# Ghia et al. (1982), Re = 100: u along the vertical centreline and v along the horizontal one
+GHIA_Y = np.array(
+    [0.0, 0.0547, 0.0625, 0.0703, 0.1016, 0.1719, 0.2813, 0.4531, 0.5, 0.6172, 0.7344, 0.8516,
+     0.9531, 0.9609, 0.9688, 0.9766, 1.0]
+)
+GHIA_U = np.array(
+    [0.0, -0.03717, -0.04192, -0.04775, -0.06434, -0.10150, -0.15662, -0.21090, -0.20581,
+     -0.13641, 0.00332, 0.23151, 0.68717, 0.73722, 0.78871, 0.84123, 1.0]
+)
+GHIA_X = np.array(
+    [0.0, 0.0625, 0.0703, 0.0781, 0.0938, 0.1563, 0.2266, 0.2344, 0.5, 0.8047, 0.8594, 0.9063,
+     0.9453, 0.9531, 0.9609, 0.9688, 1.0]
+)
+GHIA_V = np.array(
+    [0.0, 0.09233, 0.10091, 0.10890, 0.12317, 0.16077, 0.17507, 0.17527, 0.05454, -0.24533,
+     -0.22445, -0.16914, -0.10313, -0.08864, -0.07391, -0.05906, 0.0]
+)
+
+
+# The lid-driven cavity boundaries of cfd.run
+def CavityBoundaries(u_in=1):
+    noslip = utils.Boundary("D", 0)
+    zeroflux = utils.Boundary("N", 0)
+    pressureatm = utils.Boundary("D", 0)
+    return {
+        "u": (noslip, noslip, utils.Boundary("D", u_in), noslip),
+        "v": (noslip, noslip, noslip, noslip),
+        "p": (zeroflux, zeroflux, pressureatm, zeroflux),
+    }
+
+
+def CreateCavity(size, length=1):
+    space = utils.Space()
+    space.CreateMesh(size, size)
+    space.SetDeltas(length, length)
+    return space
+
+
+def SetBoundaries(space, boundaries):
+    utils.SetTimeStep(0.8, space, FLUID)
+    utils.SetUBoundary(space, *boundaries["u"])
+    utils.SetVBoundary(space, *boundaries["v"])
+    utils.SetPBoundary(space, *boundaries["p"])
+
+
+# Time one call of each kernel and of a whole step, averaged over steps steps that follow warmup
+# steps from rest. Every kernel counts one update per cell per call, so the pressure throughput is
+# that of a whole solve and stays comparable between solvers whose iterations differ in cost; the
+# mean number of iterations (or cycles) per solve is reported next to it
+def TimeKernels(size, kernels, SolvePressure, steps=5, warmup=3):
+    space = CreateCavity(size)
+    boundaries = CavityBoundaries()
+    totals = dict.fromkeys(KERNELS, 0.0)
+    iterations = 0
+    for step in range(warmup + steps):
+        start = clock.perf_counter()
+        SetBoundaries(space, boundaries)
+        marks = [clock.perf_counter()]
+        kernels.GetStarredVelocities(space, FLUID)
+        marks.append(clock.perf_counter())
+        SolvePressure(space, FLUID, *boundaries["p"])
+        marks.append(clock.perf_counter())
+        kernels.SolveMomentumEquation(space, FLUID)
+        marks.append(clock.perf_counter())
+        if step >= warmup:
+            totals["predictor"] += marks[1] - marks[0]
+            totals["pressure"] += marks[2] - marks[1]
+            totals["corrector"] += marks[3] - marks[2]
+            totals["step"] += marks[3] - start
+            iterations += space.p_iterations
+    cells = size * size
+    results = {}
+    for kernel in KERNELS:
+        seconds = totals[kernel] / steps
+        results[kernel] = {"seconds": seconds, "cell_updates_per_s": cells / seconds}
+    results["pressure"]["iterations"] = iterations / steps
+    return results
+
+
+# Peak memory traced by tracemalloc while creating a cavity and advancing it one step
+def PeakMemory(size, kernels, SolvePressure):
+    tracemalloc.start()
+    space = CreateCavity(size)
+    boundaries = CavityBoundaries()
+    SetBoundaries(space, boundaries)
+    kernels.GetStarredVelocities(space, FLUID)
+    SolvePressure(space, FLUID, *boundaries["p"])
+    kernels.SolveMomentumEquation(space, FLUID)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def RunBenchmarks(sizes=SIZES, backend="numpy", solver="jacobi", steps=5):
+    kernels = backends.GetBackend(backend)
+    SolvePressure = poisson.GetPressureSolver({"poisson_solver": solver}, kernels)
+    report = {
+        "backend": kernels.name,
+        "solver": solver,
+        "machine": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "processor": platform.processor() or platform.machine(),
+            "cpus": os.cpu_count(),
+        },
+        "results": {},
+    }
+    for size in sizes:
+        results = TimeKernels(size, kernels, SolvePressure, steps)
+        peak = PeakMemory(size, kernels, SolvePressure)
+        for kernel, result in results.items():
+            result["peak_bytes"] = peak
+            report["results"]["{0}@{1}".format(kernel, size)] = result
+        print(
+            "# {0}x{0}\tstep {1:.4f} s\t{2:.3e} cell updates/s\tpeak {3:.1f} MB".format(
+                size,
+                results["step"]["seconds"],
+                results["step"]["cell_updates_per_s"],
+                peak / 2**20,
+            )
+        )
+    return report
+
+
+# Compare a report with a baseline report and return the entries whose throughput dropped or whose
+# peak memory grew by more than threshold. Only reports of the same backend and solver compare
+def CompareReports(report, baseline, threshold=0.1):
+    for name in ("backend", "solver"):
+        if report[name] != baseline[name]:
+            raise ValueError(
+                "Cannot compare a report of {0} {1} with a baseline of {0} {2}".format(
+                    name, report[name], baseline[name]
+                )
+            )
+    regressions = []
+    for key, result in report["results"].items():
+        if key not in baseline["results"]:
+            continue
+        reference = baseline["results"][key]
+        speed = result["cell_updates_per_s"] / reference["cell_updates_per_s"]
+        memory = result["peak_bytes"] / max(reference["peak_bytes"], 1)
+        if speed < 1 - threshold:
+            regressions.append("{0}: throughput {1:.1%} of the baseline".format(key, speed))
+        if memory > 1 + threshold:
+            regressions.append("{0}: peak memory {1:.1%} of the baseline".format(key, memory))
+    return regressions
+
+
+# Run the Re = 100 cavity on a size x size mesh to steady state and return the largest differences
+# of the centreline profiles from the reference. Interior point k lies at (k + 1/2) / size of the
+# cavity, as the velocity boundaries put the walls halfway between the ghost and the first interior
+# points. On a stretched grid (see grids) the points are the cell centres of the grid
+def ValidateGhia(
+    size=65,
+    solver="multigrid",
+    time=100.0,
+    tol=0.05,
+    grid="uniform",
+    stretch=None,
+    predictor="explicit",
+):
+    with tempfile.TemporaryDirectory() as dir_path:
+        space = cfd.run(
+            {
+                "time": time,
+                "CFL_number": 0.8,
+                "file_flag": 0,
+                "interval": 1000,
+                "length": 1,
+                "breadth": 1,
+                "colpts": size,
+                "rowpts": size,
+                "rho": 1,
+                "mu": 0.01,
+                "poisson_solver": solver,
+                "steady_state": True,
+                "steady_u_tol": 1e-4,
+                "steady_p_tol": None,
+                "grid": grid,
+                "grid_stretch": stretch,
+                "predictor": predictor,
+                "output_dir": dir_path,
+            }
+        )
+    position = (np.arange(size) + 0.5) / size
+    if space.grid is not None:
+        position = space.grid.x
+    centre = size // 2
+    if size % 2 == 1:
+        u_profile = space.u_c[:, centre]
+        v_profile = space.v_c[centre, :]
+    else:
+        u_profile = (space.u_c[:, centre - 1] + space.u_c[:, centre]) / 2
+        v_profile = (space.v_c[centre - 1, :] + space.v_c[centre, :]) / 2
+    # Add the wall values at both ends before interpolating to the reference points
+    position = np.concatenate(([0.0], position, [1.0]))
+    u_profile = np.concatenate(([0.0], u_profile, [1.0]))
+    v_profile = np.concatenate(([0.0], v_profile, [0.0]))
+    u_error = float(np.amax(np.abs(np.interp(GHIA_Y, position, u_profile) - GHIA_U)))
+    v_error = float(np.amax(np.abs(np.interp(GHIA_X, position, v_profile) - GHIA_V)))
+    passed = u_error < tol and v_error < tol
+    print(
+        "\n# Ghia Re = 100 on {0}x{0} ({1}): max u error {2:.4f}, max v error {3:.4f}: {4}".format(
+            size, grid, u_error, v_error, "passed" if passed else "FAILED"
+        )
+    )
+    return {
+        "size": size,
+        "grid": grid,
+        "predictor": predictor,
+        "u_error": u_error,
+        "v_error": v_error,
+        "passed": passed,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark and validate the FlowPy kernels")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES))
+    parser.add_argument("--backend", default="numpy")
+    parser.add_argument("--solver", default="jacobi")
+    parser.add_argument("--steps", type=int, default=5)
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--threshold", type=float, default=0.1)
+    parser.add_argument("--validate", type=int, default=0, help="mesh size of the Ghia check")
+    parser.add_argument("--grid", default="uniform", choices=grids.KINDS)
+    parser.add_argument("--stretch", type=float, default=None)
+    parser.add_argument("--predictor", default="explicit", choices=("explicit", "adi"))
+    args = parser.parse_args()
+
+    report = RunBenchmarks(args.sizes, args.backend, args.solver, args.steps)
+    failed = False
+    # A faster backend is only acceptable if it reproduces the numpy kernels
+    if args.backend != "numpy":
+        difference = backends.CompareWithNumpy(backends.GetBackend(args.backend))
+        report["difference_from_numpy"] = difference
+        print("# Largest difference from the numpy kernels: {0:.3e}".format(difference))
+        failed = difference > 1e-10
+    if args.validate:
+        # Only the direct solver handles stretched grids among the steady state solvers
+        solver = "multigrid" if args.grid == "uniform" else "direct"
+        report["validation"] = ValidateGhia(
+            args.validate, solver, grid=args.grid, stretch=args.stretch, predictor=args.predictor
+        )
+        failed = failed or not report["validation"]["passed"]
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions = CompareReports(report, json.load(f), args.threshold)
+        for regression in regressions:
+            print("# Regression: {0}".format(regression))
+        failed = failed or bool(regressions)
+    sys.exit(1 if failed else 0)
@@ -1,10 +1,25 @@
+import os
 import sys
 import utils
+import adi
+import backends
+import checkpoint
+import decomposition
+import grids
+import poisson
+import reduction
+import results
+import runcache
+import sequencing
+import steady
+import streaming
+import telemetry
+import timestepping
 
 
 def run(sim_params):
     #### BOUNDARY SPECIFICATIONS
-    u_in = 1  # Lid velocity
+    u_in = sim_params.get("u_in", 1)  # Lid velocity
     v_wall = 0  # Velocity of fluid at the walls
     p_out = 0  # Gauge pressure at the boundaries
 
@@ -16,6 +31,13 @@ def run(sim_params):
         "pressureatm": utils.Boundary("D", p_out),
     }
 
+    # The run cache returns the final state of an identical earlier run, see runcache.py
+    if sim_params.get("cache_dir", None) is not None:
+        return runcache.CachedRun(run, sim_params, boundary_params)
+    # With grid sequencing the case is run on coarser meshes first, see sequencing.py
+    if sim_params.get("sequence_levels", 1) > 1:
+        return sequencing.RunSequence(run, sim_params)
+
     ####  Unpack simulation parameter dictionary
     time = sim_params["time"]
     CFL_number = sim_params["CFL_number"]
@@ -27,62 +49,327 @@ def run(sim_params):
     rowpts = sim_params["rowpts"]
     rho = sim_params["rho"]
     mu = sim_params["mu"]
+    poisson_solver = sim_params.get("poisson_solver", "jacobi")
+    output_format = sim_params.get("output_format", "text")
+    async_output = sim_params.get("async_output", False)
+    backend = sim_params.get("backend", "numpy")
+    workers = sim_params.get("workers", 1)
+    adaptive_dt = sim_params.get("adaptive_dt", False)
+    precision = sim_params.get("precision", "float64")
+    residual_precision = sim_params.get("residual_precision", None)
+    profiler = telemetry.CreateProfiler(sim_params.get("telemetry", None))
+    stream = sim_params.get("stream", None)
+    frame_callback = sim_params.get("frame_callback", None)
+    steady_state = sim_params.get("steady_state", False)
+    steady_interval = sim_params.get("steady_interval", 10)
+    output_dir = os.path.abspath(sim_params.get("output_dir", "results"))
+    checkpoint_interval = sim_params.get("checkpoint_interval", 0)
+    checkpoint_dir = os.path.abspath(
+        sim_params.get("checkpoint_dir", os.path.join(output_dir, "checkpoints"))
+    )
+    resume = sim_params.get("resume", False)
+    initial_state = sim_params.get("initial_state", None)
+    initial_space = sim_params.get("initial_space", None)
+    obstacle = sim_params.get("obstacle", None)
+    grid = sim_params.get("grid", "uniform")
+    predictor = sim_params.get("predictor", "explicit")
+    statistics = sim_params.get("statistics", False)
+    statistics_interval = sim_params.get("statistics_interval", 0)
 
-    #### Unpack boundary condition dictionary
-    noslip = boundary_params["noslip"]
-    flow = boundary_params["flow"]
-    zeroflux = boundary_params["zeroflux"]
-    pressureatm = boundary_params["pressureatm"]
-
-    # Create an object of the class Fluid called water
-    water = utils.Fluid(rho, mu)
-
-    # Create an object of the class Space called cavity
-    cavity = utils.Space()
-    cavity.CreateMesh(rowpts, colpts)
-    cavity.SetDeltas(breadth, length)
-
-    #### RUN SIMULATION
-    # Print general simulation information
-    print("######## Beginning FlowPy Simulation ########")
-    print("#############################################")
-    print("# Simulation time: {0:.2f}".format(time))
-    print("# Mesh: {0} x {1}".format(colpts, rowpts))
-    print("# Re/u: {0:.2f}\tRe/v:{1:.2f}".format(rho * length / mu, rho * breadth / mu))
-    print("# Save outputs to text file: {0}".format(bool(file_flag)))
-    ## Initialization
-    # Make directory to store results
-    utils.MakeResultDirectory(wipe=True)
-    # Initialize counters
-    t = 0
-    i = 0
-    ## Run
-    while t < time:
-        # Print time left
-        sys.stdout.write("\rSimulation time left: {0:.2f}".format(time - t))
-        sys.stdout.flush()
-        # Set the time-step
-        utils.SetTimeStep(CFL_number, cavity, water)
-        timestep = cavity.dt
-
-        # Set boundary conditions
-        utils.SetUBoundary(cavity, noslip, noslip, flow, noslip)
-        utils.SetVBoundary(cavity, noslip, noslip, noslip, noslip)
-        utils.SetPBoundary(cavity, zeroflux, zeroflux, pressureatm, zeroflux)
-
-        # Calculate starred velocities
-        utils.GetStarredVelocities(cavity, water)
-
-        # Solve the pressure Poisson equation
-        utils.SolvePressurePoisson(
-            cavity, water, zeroflux, zeroflux, pressureatm, zeroflux
-        )
-        # Solve the momentum equation
-        utils.SolveMomentumEquation(cavity, water)
-        # Save variables and write to file
-        utils.SetCentrePUV(cavity)
+    # The frame stream, the worker processes and the result writer are always closed, so that no
+    # consumer or worker is left behind and queued snapshots are flushed even if the setup or the
+    # run fails
+    kernels = None
+    writer = None
+    consumer = None
+    try:
+        # Frames are streamed to a streaming.FrameStream, or to a callback on a consumer thread
+        if frame_callback is not None:
+            stream = streaming.FrameStream(
+                sim_params.get("stream_interval", interval),
+                sim_params.get("stream_decimate", 1),
+                sim_params.get("stream_queue_size", 2),
+            )
+            consumer = streaming.StartConsumer(stream, frame_callback)
+
+        # A resumed run continues from a checkpoint (the latest one in checkpoint_dir for "resume":
+        # True, or the given path) with the fluid and boundaries stored in it. "initial_state" only
+        # takes the fields of a checkpoint as the initial condition of a new run
+        state = None
+        if resume:
+            path = checkpoint.LatestCheckpoint(checkpoint_dir) if resume is True else resume
+            if path is None:
+                raise FileNotFoundError(
+                    "No checkpoint to resume from in {0}".format(checkpoint_dir)
+                )
+            state = checkpoint.ReadCheckpoint(path)
+            boundary_params = state[0]["boundaries"]
+            rho = state[0]["rho"]
+            mu = state[0]["mu"]
+        elif initial_state is not None:
+            state = checkpoint.ReadCheckpoint(initial_state)
+
+        #### Unpack boundary condition dictionary
+        noslip = boundary_params["noslip"]
+        flow = boundary_params["flow"]
+        zeroflux = boundary_params["zeroflux"]
+        pressureatm = boundary_params["pressureatm"]
+
+        # Create an object of the class Fluid called water
+        water = utils.Fluid(rho, mu)
+
+        # Create an object of the class Space called cavity
+        cavity = utils.Space()
+        cavity.CreateMesh(rowpts, colpts, dtype=precision, residual_dtype=residual_precision)
+        # A stretched grid clusters the points toward the walls. Its stencils are implemented in the
+        # NumPy kernels with the jacobi and direct pressure solvers
+        if grid == "uniform":
+            cavity.SetDeltas(breadth, length)
+        else:
+            if poisson_solver not in ("jacobi", "direct") or backend != "numpy" or workers > 1:
+                raise ValueError(
+                    "Stretched grids need the jacobi or direct pressure solver, the numpy backend "
+                    "and a single worker"
+                )
+            stretch = sim_params.get("grid_stretch", None)
+            cavity.SetGrid(
+                grids.Faces(colpts, length, grid, stretch),
+                grids.Faces(rowpts, breadth, grid, stretch),
+            )
+        # Solid cells inside the cavity, e.g. a bluff body or a step, given as a boolean mask of the
+        # interior points. Only the NumPy Jacobi iteration of a single process keeps their pressure
+        # condition
+        if obstacle is not None:
+            if poisson_solver != "jacobi" or backend != "numpy" or workers > 1:
+                raise ValueError(
+                    "Obstacles need the jacobi pressure solver, the numpy backend and a single "
+                    "worker"
+                )
+            cavity.SetObstacle(obstacle)
+        # "initial_space" interpolates the final fields of a run on another mesh, e.g. a coarser one
+        if initial_space is not None and not resume:
+            state = sequencing.ProlongState(initial_space, cavity)
+        if state is not None:
+            checkpoint.RestoreSpace(cavity, *state)
+
+        # Kernel backend and pressure Poisson solver selected through sim_params
+        kernels = backends.GetBackend(backend)
+        # With more than one worker the mesh is split into row strips solved by worker processes
+        if workers > 1:
+            kernels = decomposition.DecomposedBackend(cavity, workers)
+        # The semi-implicit predictor treats the viscous term with ADI solves, so that the time-step
+        # is only limited by the convective CFL condition
+        if predictor == "adi":
+            if backend != "numpy" or workers > 1:
+                raise ValueError("The adi predictor needs the numpy backend and a single worker")
+            # The line solves treat every interior cell as fluid
+            if obstacle is not None:
+                raise ValueError("The adi predictor does not support obstacles")
+            kernels = backends.Backend(
+                "numpy, adi predictor",
+                adi.GetStarredVelocities,
+                kernels.SolvePressurePoisson,
+                kernels.SolveMomentumEquation,
+            )
+        elif predictor != "explicit":
+            raise ValueError("Unknown predictor: {0}".format(predictor))
+        SolvePressure = poisson.GetPressureSolver(sim_params, kernels)
+
+        # The adaptive controller replaces utils.SetTimeStep and retries steps that diverge
+        if adaptive_dt:
+            controller = timestepping.TimeStepController(
+                cavity,
+                CFL_number,
+                diffusion_number=sim_params.get("diffusion_number", 0.8),
+                growth=sim_params.get("dt_growth", 1.1),
+                dt_min=sim_params.get("dt_min", 0.0),
+                dt_max=sim_params.get("dt_max", float("inf")),
+                diffusion=predictor == "explicit",
+            )
+            if resume:
+                controller.dt = state[0]["dt"]
+
+        # Stored with binary results; the points of a stretched grid are listed in them
+        metadata = {"length": length, "breadth": breadth, "interval": interval}
+        if cavity.grid is not None:
+            metadata["x"] = cavity.grid.x.tolist()
+            metadata["y"] = cavity.grid.y.tolist()
+
+        #### RUN SIMULATION
+        # Print general simulation information
+        print("######## Beginning FlowPy Simulation ########")
+        print("#############################################")
+        print("# Simulation time: {0:.2f}".format(time))
+        print("# Mesh: {0} x {1}".format(colpts, rowpts))
+        if grid != "uniform":
+            print(
+                "# Grid: {0}, smallest spacing {1:.3e} x {2:.3e}".format(grid, cavity.dx, cavity.dy)
+            )
+        print("# Re/u: {0:.2f}\tRe/v:{1:.2f}".format(rho * length / mu, rho * breadth / mu))
+        print("# Kernel backend: {0}".format(kernels.name))
+        print("# Precision: {0}".format(cavity.dtype))
+        print("# Pressure solver: {0}".format(poisson_solver))
+        if obstacle is not None:
+            print("# Obstacle: {0} solid cells".format(len(cavity.obstacle_cells)))
+        print("# Save outputs to {0} file: {1}".format(output_format, bool(file_flag)))
+        print("# Output directory: {0}".format(output_dir))
+        if resume:
+            print("# Resuming from {0} at step {1}".format(path, state[0]["iteration"]))
+        elif initial_state is not None:
+            print("# Initial state: {0}".format(initial_state))
+        elif initial_space is not None:
+            print(
+                "# Initial state: interpolated from a {0} x {1} mesh".format(
+                    initial_space.colpts, initial_space.rowpts
+                )
+            )
+        if checkpoint_interval:
+            print("# Checkpoint every {0} steps to {1}".format(checkpoint_interval, checkpoint_dir))
+            checkpoints = checkpoint.CheckpointManager(
+                checkpoint_dir, sim_params.get("checkpoint_keep", 3), wipe=not resume
+            )
+        # Steady-state mode stops the run once the flow no longer changes
+        if steady_state:
+            monitor = steady.SteadyStateMonitor(
+                cavity,
+                u_tol=sim_params.get("steady_u_tol", 1e-5),
+                p_tol=sim_params.get("steady_p_tol", 1e-4),
+                continuity_tol=sim_params.get("continuity_tol", None),
+            )
+            print("# Steady-state check every {0} steps".format(steady_interval))
+        # Running statistics replace the snapshots for time averages and derived fields. They are
+        # written at the end of the run and every statistics_interval steps; a resumed run starts
+        # anew
+        if statistics:
+            reducer = reduction.OnlineStatistics(
+                cavity, start=sim_params.get("statistics_start", 0.0)
+            )
+            statistics_path = os.path.join(output_dir, reduction.STATISTICS_FILENAME)
+            print(
+                "# Online statistics from t = {0:.2f} to {1}".format(reducer.start, statistics_path)
+            )
+        ## Initialization
+        # Make directory to store results and open the result writer
+        utils.MakeResultDirectory(wipe=not resume, dir_path=output_dir)
         if file_flag == 1:
-            utils.WriteToFile(cavity, i, interval)
-        # Advance time-step and counter
-        t += timestep
-        i += 1
+            writer = results.CreateWriter(
+                output_format,
+                output_dir,
+                cavity,
+                metadata=metadata,
+                asynchronous=async_output,
+                queue_size=sim_params.get("output_queue_size", 4),
+                before=state[0]["iteration"] if resume else None,
+            )
+        # Initialize counters
+        t = state[0]["t"] if resume else 0
+        i = state[0]["iteration"] if resume else 0
+        stop_reason = "simulation time reached"
+        ## Run
+        while t < time:
+            # Print time left
+            sys.stdout.write("\rSimulation time left: {0:.2f}".format(time - t))
+            sys.stdout.flush()
+            profiler.Start()
+            # Set the time-step
+            if not adaptive_dt:
+                utils.SetTimeStep(CFL_number, cavity, water, diffusion=predictor == "explicit")
+
+            # Set boundary conditions
+            utils.SetUBoundary(cavity, noslip, noslip, flow, noslip)
+            utils.SetVBoundary(cavity, noslip, noslip, noslip, noslip)
+            utils.SetPBoundary(cavity, zeroflux, zeroflux, pressureatm, zeroflux)
+            # The adaptive time-step also sees the boundary values, so the lid counts from the start
+            if adaptive_dt:
+                controller.SetTimeStep(cavity, water)
+                controller.Save(cavity)
+            timestep = cavity.dt
+            profiler.Mark("boundaries")
+
+            # Calculate starred velocities
+            kernels.GetStarredVelocities(cavity, water)
+            utils.SetObstacleVelocities(cavity, cavity.u_star, cavity.v_star)
+            profiler.Mark("predictor")
+
+            # Solve the pressure Poisson equation
+            SolvePressure(cavity, water, zeroflux, zeroflux, pressureatm, zeroflux)
+            profiler.Mark("pressure")
+            # Solve the momentum equation
+            kernels.SolveMomentumEquation(cavity, water)
+            utils.SetObstacleVelocities(cavity, cavity.u, cavity.v)
+            profiler.Mark("corrector")
+            # Retry a diverging step with a smaller time-step
+            if adaptive_dt and not controller.Accept(cavity):
+                continue
+            # Save variables and write to file
+            utils.SetCentrePUV(cavity)
+            if file_flag == 1 and i % interval == 0:
+                writer.Write(cavity, i, t + timestep)
+            if stream is not None:
+                stream.Publish(cavity, i, t + timestep)
+            if statistics:
+                reducer.Update(cavity, t + timestep, timestep)
+            # Advance time-step and counter
+            t += timestep
+            i += 1
+            # Checkpoint after everything written so far has reached the disk
+            if checkpoint_interval and i % checkpoint_interval == 0:
+                if file_flag == 1:
+                    writer.Flush()
+                checkpoints.Write(cavity, water, boundary_params, t, i)
+            if statistics and statistics_interval and i % statistics_interval == 0:
+                reducer.Write(cavity, statistics_path)
+            profiler.Mark("output")
+            profiler.EndStep(cavity, i - 1, t, writer.bytes_written if file_flag == 1 else 0)
+            # Stop once the steady state is reached, making sure the final state is written
+            if steady_state and i % steady_interval == 0 and monitor.Check(cavity, t):
+                stop_reason = "steady state reached"
+                break
+        if steady_state and file_flag == 1 and i > 0 and (i - 1) % interval != 0:
+            writer.Write(cavity, i - 1, t)
+        # The final state is always checkpointed, e.g. to warm-start a nearby case from it
+        if checkpoint_interval and i % checkpoint_interval != 0:
+            checkpoints.Write(cavity, water, boundary_params, t, i)
+        if statistics:
+            reducer.Write(cavity, statistics_path)
+    finally:
+        # An error of the writer thread must not hide the one that stops the run, so it is only
+        # reported here and raised below once everything is closed
+        if writer is not None:
+            writer.Close(raise_error=False)
+            if getattr(writer, "error", None) is not None:
+                print("\n# Result writer failed: {0!r}".format(writer.error))
+        if isinstance(kernels, decomposition.DecomposedBackend):
+            kernels.Close()
+        profiler.Close()
+        if stream is not None:
+            stream.Close()
+        if consumer is not None:
+            consumer.join()
+
+    if getattr(writer, "error", None) is not None:
+        raise writer.error
+
+    print("\n# Stopped after {0} steps at t = {1:.4f}: {2}".format(i, t, stop_reason))
+    if steady_state:
+        print("# {0}".format(monitor.Report()))
+    if profiler.enabled:
+        print(profiler.Summary())
+    if stream is not None:
+        print("# Frames streamed: {0}\tdropped: {1}".format(stream.published, stream.dropped))
+    if statistics:
+        print("# Statistics of {0} steps written to {1}".format(reducer.steps, statistics_path))
+    if adaptive_dt:
+        print(
+            "# Rejected steps: {0}\tLast time-step: {1:.3e}".format(
+                controller.rejected, controller.dt
+            )
+        )
+
+    # Return the final state together with the simulated time, number of steps and stop reason
+    cavity.t = t
+    cavity.iteration = i
+    cavity.stop_reason = stop_reason
+    cavity.telemetry = profiler
+    cavity.statistics = reducer if statistics else None
+    return cavity
@@ -0,0 +1,134 @@
+import glob
+import json
+import os
+import numpy as np
+import utils
+
+
+# Checkpoints hold the complete state needed to continue a run: the full u, v and p arrays with
+# their ghost cells, the time, step count and last time-step, the mesh, and the fluid and boundary
+# setup. Each checkpoint is a .npz file written to a temporary file and renamed into place, so a run
+# killed while writing leaves the previous checkpoints intact
+CHECKPOINT_PATTERN = "checkpoint_{0:08d}.npz"
+FIELDS = ("u", "v", "p")
+
+
+def WriteCheckpoint(path, space, fluid, boundaries, t, iteration):
+    # The faces of a stretched grid, None for a uniform mesh
+    grid = None
+    if space.grid is not None:
+        grid = {"x_faces": space.grid.x_faces.tolist(), "y_faces": space.grid.y_faces.tolist()}
+    header = {
+        "t": t,
+        "iteration": iteration,
+        "dt": float(space.dt),
+        "rowpts": int(space.rowpts),
+        "colpts": int(space.colpts),
+        "dx": float(space.dx),
+        "dy": float(space.dy),
+        "grid": grid,
+        "S_x": float(space.S_x),
+        "S_y": float(space.S_y),
+        "rho": float(fluid.rho),
+        "mu": float(fluid.mu),
+        "boundaries": {
+            name: [boundary.type, float(boundary.value)] for name, boundary in boundaries.items()
+        },
+    }
+    fields = {name: np.asarray(getattr(space, name)) for name in FIELDS}
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as f:
+        np.savez(f, header=np.array(json.dumps(header)), **fields)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+
+
+# Read a checkpoint and return its header, with the fluid and boundaries as objects, and its fields
+def ReadCheckpoint(path):
+    with np.load(path) as data:
+        header = json.loads(str(data["header"]))
+        fields = {name: data[name] for name in FIELDS}
+    header["fluid"] = utils.Fluid(header["rho"], header["mu"])
+    header["boundaries"] = {
+        name: utils.Boundary(boundary_type, value)
+        for name, (boundary_type, value) in header["boundaries"].items()
+    }
+    return header, fields
+
+
+# Copy the state of a checkpoint into a space created with the same mesh. The spacing and the
+# stretched grid (if any) of a checkpoint must match those of the space as well
+def RestoreSpace(space, header, fields):
+    if "dx" in header:
+        CheckGeometry(space, header)
+    for name in FIELDS:
+        target = getattr(space, name)
+        if target.shape != fields[name].shape:
+            raise ValueError(
+                "Checkpoint mesh {0} does not match the mesh {1}".format(
+                    fields[name].shape, target.shape
+                )
+            )
+        np.copyto(target, fields[name])
+    space.dt = header["dt"]
+    space.SetSourceTerm(header["S_x"], header["S_y"])
+    utils.SetCentrePUV(space)
+
+
+def CheckGeometry(space, header):
+    spacing = (float(space.dx), float(space.dy))
+    if not np.allclose((header["dx"], header["dy"]), spacing, rtol=1e-9, atol=0):
+        raise ValueError(
+            "Checkpoint spacing {0} x {1} does not match the spacing {2} x {3}".format(
+                header["dx"], header["dy"], *spacing
+            )
+        )
+    # Checkpoints written before stretched grids have no grid entry and are uniform
+    grid = header.get("grid", None)
+    if (grid is None) != (space.grid is None):
+        raise ValueError(
+            "Checkpoint grid is {0} but the run uses a {1} grid".format(
+                "uniform" if grid is None else "stretched",
+                "uniform" if space.grid is None else "stretched",
+            )
+        )
+    if grid is not None:
+        for name in ("x_faces", "y_faces"):
+            faces = getattr(space.grid, name)
+            if len(grid[name]) != len(faces) or not np.allclose(
+                grid[name], faces, rtol=1e-9, atol=0
+            ):
+                raise ValueError("Checkpoint grid {0} does not match the grid".format(name))
+
+
+# Checkpoints of a run in dir_path, of which only the keep most recent are kept
+# A new run (wipe=True) first removes the checkpoints of an earlier run
+class CheckpointManager:
+    def __init__(self, dir_path, keep=3, wipe=False):
+        if keep < 1:
+            raise ValueError("checkpoint_keep must be at least 1, got {0}".format(keep))
+        self.dir_path = dir_path
+        self.keep = keep
+        os.makedirs(dir_path, exist_ok=True)
+        if wipe:
+            for old in ListCheckpoints(dir_path):
+                os.remove(old)
+
+    def Write(self, space, fluid, boundaries, t, iteration):
+        path = os.path.join(self.dir_path, CHECKPOINT_PATTERN.format(iteration))
+        WriteCheckpoint(path, space, fluid, boundaries, t, iteration)
+        for old in ListCheckpoints(self.dir_path)[: -self.keep]:
+            os.remove(old)
+        return path
+
+
+# Checkpoints in dir_path, oldest first
+def ListCheckpoints(dir_path):
+    return sorted(glob.glob(os.path.join(dir_path, CHECKPOINT_PATTERN.replace("{0:08d}", "*"))))
+
+
+# Path of the most recent checkpoint in dir_path, or None
+def LatestCheckpoint(dir_path):
+    checkpoints = ListCheckpoints(dir_path)
+    return checkpoints[-1] if checkpoints else None
@@ -0,0 +1,274 @@
+import multiprocessing
+import threading
+from multiprocessing import shared_memory
+import numpy as np
+import utils
+import backends
+
+
+# Domain decomposition: the interior rows of a space are split into strips, each owned by a worker
+# process. u, v, u_star, v_star and p live in shared memory, so the one-cell ghost rows of a strip
+# are the neighbouring rows of the other strips and the ghost layer exchange is a barrier between
+# sweeps. The predictor and the corrector run the utils kernels on each strip; the Jacobi pressure
+# iteration alternates between p and a second shared pressure array and reduces the maximum change
+# over all strips every sweep. Every arithmetic operation is the same as in the serial kernels, so
+# the results are identical to the numpy backend
+FIELDS = ("u", "v", "u_star", "v_star", "p", "p_next")
+
+# Commands sent to the workers
+STARRED = 0
+PRESSURE = 1
+MOMENTUM = 2
+EXIT = 3
+
+
+def AttachSharedMemory(name):
+    # Only the process that created a block unlinks it (the workers share its resource tracker)
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+# Split the interior rows 1..rowpts into count strips of nearly equal size and return the first
+# row of every strip followed by rowpts + 1
+def StripBounds(rowpts, count):
+    return [1 + (rowpts * k) // count for k in range(count + 1)]
+
+
+# A space holding the rows first - 1 to last of the shared fields, so that the utils kernels
+# update rows first to last - 1 and read the rows on either side as ghost rows
+def CreateStrip(fields, first, last, colpts, dx, dy, S_x, S_y, residual_dtype):
+    strip = utils.Space()
+    strip.rowpts = last - first
+    strip.colpts = colpts
+    strip.batch = ()
+    for name in ("u", "v", "u_star", "v_star", "p"):
+        setattr(strip, name, fields[name][first - 1 : last + 1])
+    strip.dx = dx
+    strip.dy = dy
+    strip.SetSourceTerm(S_x, S_y)
+    strip.workspace = utils.Workspace(strip.rowpts, colpts, (), strip.u.dtype, residual_dtype)
+    strip.boundary_plans = {}
+    return strip
+
+
+# The part of the pressure boundary plan of the whole grid that writes to the rows first to last - 1
+# of p. The owner of the first interior row also sets the bottom ghost row and the owner of the last
+# interior row the top ghost row. The plan is compiled once per set of boundaries
+def GetStripPlan(strip, shape, dtype, first, last, boundaries):
+    key = utils.BoundaryKey(boundaries)
+    plans = strip.boundary_plans
+    if key not in plans:
+        plan = utils.BoundaryPlan("p", shape, dtype, float(strip.dx), float(strip.dy), boundaries)
+        start = 0 if first == 1 else first
+        stop = shape[0] if last == shape[0] - 1 else last
+        plans[key] = plan.Rows(start, stop)
+    return plans[key]
+
+
+# Jacobi iteration of utils.SolvePressurePoisson on the rows first to last - 1. errors has one row
+# per parity of the iteration count, so a worker that starts the next sweep does not overwrite an
+# error that the others are still reading
+def SolveStripPressure(strip, fields, errors, stats, index, first, last, sync, command):
+    _, dt, fluid, boundaries = command
+    rows = int(strip.rowpts)
+    cols = int(strip.colpts)
+    dx = float(strip.dx)
+    dy = float(strip.dy)
+    rho = fluid.rho
+    factor = 1 / (2 / dx**2 + 2 / dy**2)
+    w = strip.workspace
+    u_star = strip.u_star
+    v_star = strip.v_star
+
+    # Source term of the rows of the strip
+    source = w.t1
+    np.subtract(u_star[1 : rows + 1, 2:], u_star[1 : rows + 1, 0:cols], out=source)
+    source *= 1 / (2 * dx)
+    np.subtract(v_star[2:, 1 : cols + 1], v_star[0:rows, 1 : cols + 1], out=w.t2)
+    w.t2 *= 1 / (2 * dy)
+    source += w.t2
+    source *= rho * factor / dt
+
+    p_old = fields["p"]
+    p_new = fields["p_next"]
+    boundary_plan = GetStripPlan(strip, p_old.shape, p_old.dtype, first, last, boundaries)
+    error = 1
+    tol = 1e-3
+    i = 0
+    while error > tol:
+        i += 1
+        # New pressure of the strip from the previous iterate
+        p2_xy = w.t2
+        np.add(
+            p_old[first + 1 : last + 1, 1 : cols + 1],
+            p_old[first - 1 : last - 1, 1 : cols + 1],
+            out=p2_xy,
+        )
+        p2_xy *= 1 / dy**2
+        np.add(p_old[first:last, 2:], p_old[first:last, 0:cols], out=w.t3)
+        w.t3 *= 1 / dx**2
+        p2_xy += w.t3
+        p2_xy *= factor
+        np.subtract(p2_xy, source, out=p_new[first:last, 1 : cols + 1])
+
+        # Maximum change of the strip, then of the whole domain once every strip is done
+        change = w.p_diff[1:-1, 1:-1]
+        np.subtract(
+            p_new[first:last, 1 : cols + 1],
+            p_old[first:last, 1 : cols + 1],
+            out=change,
+            dtype=change.dtype,
+        )
+        np.abs(change, out=change)
+        errors[i % 2, index] = np.amax(change)
+        boundary_plan.Apply(p_new)
+        sync.wait()
+        error = np.amax(errors[i % 2])
+
+        if i > 500:
+            tol *= 10
+        p_old, p_new = p_new, p_old
+
+    # Leave the result in p
+    p = fields["p"]
+    if p_old is not p:
+        p[first:last] = p_old[first:last]
+        if first == 1:
+            p[0] = p_old[0]
+        if last == p.shape[0] - 1:
+            p[-1] = p_old[-1]
+    if index == 0:
+        stats[0] = i
+        stats[1] = error
+    sync.wait()
+
+
+def Worker(index, names, shape, dtypes, bounds, deltas, source_term, commands, sync, finished):
+    blocks = {name: AttachSharedMemory(names[name]) for name in FIELDS + ("errors", "stats")}
+    fields = {name: np.ndarray(shape, dtype=dtypes[0], buffer=blocks[name].buf) for name in FIELDS}
+    errors = np.ndarray((2, len(bounds) - 1), buffer=blocks["errors"].buf)
+    stats = np.ndarray(2, buffer=blocks["stats"].buf)
+    first, last = bounds[index], bounds[index + 1]
+    strip = CreateStrip(fields, first, last, shape[1] - 2, *deltas, *source_term, dtypes[1])
+    try:
+        while True:
+            command = commands.get()
+            if command[0] == EXIT:
+                break
+            strip.dt = command[1]
+            if command[0] == STARRED:
+                utils.GetStarredVelocities(strip, command[2], copy_boundaries=False)
+            elif command[0] == PRESSURE:
+                SolveStripPressure(strip, fields, errors, stats, index, first, last, sync, command)
+            elif command[0] == MOMENTUM:
+                utils.SolveMomentumEquation(strip, command[2])
+            finished.wait()
+    except threading.BrokenBarrierError:
+        pass
+    except BaseException:
+        # Release the other workers and the main process, which would wait on the barriers forever
+        sync.abort()
+        finished.abort()
+        raise
+    finally:
+        fields = errors = stats = strip = None
+        for block in blocks.values():
+            block.close()
+
+
+# Kernel backend that runs the projection step of a space on count worker processes. The fields of
+# the space are moved into shared memory; Close() copies them back and stops the workers
+class DecomposedBackend(backends.Backend):
+    def __init__(self, space, count):
+        super().__init__(
+            "decomposed ({0} workers)".format(count),
+            self.GetStarredVelocities,
+            self.SolvePressurePoisson,
+            self.SolveMomentumEquation,
+        )
+        rows = int(space.rowpts)
+        count = max(1, min(count, rows))
+        shape = (rows + 2, int(space.colpts) + 2)
+        dtypes = (space.p.dtype, space.workspace.p_diff.dtype)
+        sizes = dict.fromkeys(FIELDS, int(np.prod(shape)) * dtypes[0].itemsize)
+        sizes["errors"] = 2 * count * 8
+        sizes["stats"] = 2 * 8
+        self.space = space
+        self.blocks = {
+            name: shared_memory.SharedMemory(create=True, size=size) for name, size in sizes.items()
+        }
+        for name in ("u", "v", "u_star", "v_star", "p"):
+            shared = np.ndarray(shape, dtype=dtypes[0], buffer=self.blocks[name].buf)
+            np.copyto(shared, getattr(space, name))
+            setattr(space, name, shared)
+        self.p_next = np.ndarray(shape, dtype=dtypes[0], buffer=self.blocks["p_next"].buf)
+        np.copyto(self.p_next, space.p)
+        self.stats = np.ndarray(2, buffer=self.blocks["stats"].buf)
+
+        context = multiprocessing.get_context()
+        self.sync = context.Barrier(count)
+        self.finished = context.Barrier(count + 1)
+        self.commands = [context.Queue() for _ in range(count)]
+        names = {name: block.name for name, block in self.blocks.items()}
+        bounds = StripBounds(rows, count)
+        self.workers = [
+            context.Process(
+                target=Worker,
+                args=(
+                    index,
+                    names,
+                    shape,
+                    dtypes,
+                    bounds,
+                    (float(space.dx), float(space.dy)),
+                    (space.S_x, space.S_y),
+                    self.commands[index],
+                    self.sync,
+                    self.finished,
+                ),
+                daemon=True,
+            )
+            for index in range(count)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    # Send a command to every worker and wait until all of them have finished it
+    def Run(self, command):
+        for queue in self.commands:
+            queue.put(command)
+        try:
+            self.finished.wait()
+        except threading.BrokenBarrierError:
+            raise RuntimeError("A worker of the decomposed solver failed") from None
+
+    def GetStarredVelocities(self, space, fluid):
+        utils.SetStarredBoundaries(space)
+        self.Run((STARRED, space.dt, fluid))
+
+    def SolvePressurePoisson(self, space, fluid, left, right, top, bottom):
+        self.Run((PRESSURE, space.dt, fluid, (left, right, top, bottom)))
+        space.p_iterations = int(self.stats[0])
+        space.p_residual = float(self.stats[1])
+
+    def SolveMomentumEquation(self, space, fluid):
+        self.Run((MOMENTUM, space.dt, fluid))
+
+    def Close(self):
+        if self.blocks is None:
+            return
+        for queue in self.commands:
+            queue.put((EXIT,))
+        for worker in self.workers:
+            worker.join()
+        # Give the space its own copies of the fields before the shared memory is released
+        for name in ("u", "v", "u_star", "v_star", "p"):
+            setattr(self.space, name, np.array(getattr(self.space, name)))
+        utils.SetCentrePUV(self.space)
+        self.p_next = self.stats = None
+        for block in self.blocks.values():
+            block.close()
+            block.unlink()
+        self.blocks = None
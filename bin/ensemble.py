@@ -0,0 +1,165 @@
+import os
+import sys
+import numpy as np
+import utils
+import results
+
+
+# Ensemble mode: several lid-driven cavity cases on the same mesh advanced together by the utils
+# kernels, with a leading case dimension on every field. Each case may override the sim_params
+# entries below; rho, mu and the time-step are then arrays of shape (cases, 1, 1) that broadcast
+# against the fields
+CASE_PARAMETERS = ("rho", "mu", "CFL_number", "u_in")
+
+
+# The fields of one case of an ensemble, in the form the result writers expect
+class CaseView:
+    def __init__(self, space, case):
+        self.space = space
+        self.case = case
+        self.rowpts = space.rowpts
+        self.colpts = space.colpts
+
+    @property
+    def p_c(self):
+        return self.space.p_c[self.case]
+
+    @property
+    def u_c(self):
+        return self.space.u_c[self.case]
+
+    @property
+    def v_c(self):
+        return self.space.v_c[self.case]
+
+    @property
+    def dt(self):
+        return float(self.space.dt[self.case, 0, 0])
+
+
+def run(sim_params, cases):
+    #### Unpack simulation parameter dictionary
+    time = sim_params["time"]
+    file_flag = sim_params["file_flag"]
+    interval = sim_params["interval"]
+    length = sim_params["length"]
+    breadth = sim_params["breadth"]
+    colpts = sim_params["colpts"]
+    rowpts = sim_params["rowpts"]
+    poisson_solver = sim_params.get("poisson_solver", "jacobi")
+    if poisson_solver != "jacobi":
+        raise ValueError("The ensemble mode only supports the jacobi pressure solver")
+
+    # Per-case parameters, taken from sim_params unless a case overrides them
+    count = len(cases)
+    defaults = {"u_in": 1}
+    defaults.update(sim_params)
+    values = {
+        name: np.array([float(case.get(name, defaults[name])) for case in cases])
+        for name in CASE_PARAMETERS
+    }
+
+    #### BOUNDARY SPECIFICATIONS
+    flow = utils.Boundary("D", values["u_in"][:, np.newaxis])
+    noslip = utils.Boundary("D", 0)
+    zeroflux = utils.Boundary("N", 0)
+    pressureatm = utils.Boundary("D", 0)
+
+    # Fluid properties of every case and a space with one set of fields per case
+    water = utils.Fluid(
+        values["rho"][:, np.newaxis, np.newaxis], values["mu"][:, np.newaxis, np.newaxis]
+    )
+    cavity = utils.Space()
+    cavity.CreateMesh(
+        rowpts,
+        colpts,
+        cases=count,
+        dtype=sim_params.get("precision", "float64"),
+        residual_dtype=sim_params.get("residual_precision", None),
+    )
+    cavity.SetDeltas(breadth, length)
+
+    #### RUN SIMULATION
+    print("######## Beginning FlowPy Ensemble ########")
+    print("###########################################")
+    print("# Simulation time: {0:.2f}".format(time))
+    print("# Mesh: {0} x {1}".format(colpts, rowpts))
+    print("# Cases: {0}".format(count))
+    print("# Save outputs to binary files: {0}".format(bool(file_flag)))
+    dir_path = utils.MakeResultDirectory(
+        wipe=True, dir_path=os.path.abspath(sim_params.get("output_dir", "results"))
+    )
+    writers = []
+    if file_flag == 1:
+        for case in range(count):
+            writers.append(
+                results.BinaryWriter(
+                    os.path.join(dir_path, "PUV_case{0}.bin".format(case)),
+                    CaseView(cavity, case),
+                    metadata={"length": length, "breadth": breadth, "interval": interval},
+                )
+            )
+
+    # Time, step count and total Poisson iterations of every case. A case that has reached the
+    # simulation time is frozen: it is still part of the batch, but its fields are restored after
+    # each step
+    t = np.zeros(count)
+    steps = np.zeros(count, dtype=int)
+    poisson_iterations = np.zeros(count, dtype=int)
+    active = t < time
+    i = 0
+    try:
+        while np.any(active):
+            sys.stdout.write(
+                "\rSimulation time left: {0:.2f}\tActive cases: {1}".format(
+                    time - np.amin(t), np.count_nonzero(active)
+                )
+            )
+            sys.stdout.flush()
+            frozen = ~active
+            if np.any(frozen):
+                saved = (cavity.u[frozen], cavity.v[frozen], cavity.p[frozen])
+
+            utils.SetTimeStep(values["CFL_number"], cavity, water)
+            utils.SetUBoundary(cavity, noslip, noslip, flow, noslip)
+            utils.SetVBoundary(cavity, noslip, noslip, noslip, noslip)
+            utils.SetPBoundary(cavity, zeroflux, zeroflux, pressureatm, zeroflux)
+            utils.GetStarredVelocities(cavity, water)
+            utils.SolvePressurePoisson(cavity, water, zeroflux, zeroflux, pressureatm, zeroflux)
+            utils.SolveMomentumEquation(cavity, water)
+
+            if np.any(frozen):
+                cavity.u[frozen], cavity.v[frozen], cavity.p[frozen] = saved
+            utils.SetCentrePUV(cavity)
+            if writers and i % interval == 0:
+                for case in np.flatnonzero(active):
+                    writers[case].Write(
+                        CaseView(cavity, case), i, t[case] + cavity.dt[case, 0, 0]
+                    )
+
+            # Advance time-step and counters of the active cases
+            t[active] += cavity.dt[active, 0, 0]
+            steps[active] += 1
+            poisson_iterations[active] += cavity.p_iterations[active]
+            active = t < time
+            i += 1
+    finally:
+        for writer in writers:
+            writer.Close()
+
+    # Summary of every case
+    print("\n# Case\trho\tmu\tCFL\tu_in\tRe\tSteps\tPoisson iterations/step")
+    for case in range(count):
+        print(
+            "# {0}\t{1:g}\t{2:g}\t{3:g}\t{4:g}\t{5:.1f}\t{6}\t{7:.1f}".format(
+                case,
+                values["rho"][case],
+                values["mu"][case],
+                values["CFL_number"][case],
+                values["u_in"][case],
+                values["rho"][case] * values["u_in"][case] * length / values["mu"][case],
+                steps[case],
+                poisson_iterations[case] / max(steps[case], 1),
+            )
+        )
+    return cavity
@@ -0,0 +1,237 @@
+import numpy as np
+
+
+# Stretched meshes that cluster points toward the walls. A mesh is given by the faces of its cells
+# along each axis; the points of the fields are the cell centres, and the ghost points are the
+# mirror images of the first and last points about the walls, so that a wall lies halfway between
+# a ghost point and its neighbour. The kernels below evaluate the stencils of the uniform kernels in
+# utils with the spacing of every row and column:
+#   df/dx   = (f_E - f_W) / (h_e + h_w)
+#   d2f/dx2 = 2 / (h_e + h_w) * ((f_E - f_C) / h_e - (f_C - f_W) / h_w)
+# where h_e and h_w are the distances from a point to its east and west neighbours
+KINDS = ("uniform", "tanh", "geometric")
+
+
+# Faces of points cells over [0, extent]. tanh clusters the faces toward both ends with the
+# stretching factor beta = stretch (default 2); geometric grows the cell widths by the ratio
+# stretch (default 1.1) from both ends toward the middle
+def Faces(points, extent, kind="tanh", stretch=None):
+    s = np.linspace(0, 1, points + 1)
+    if kind == "uniform":
+        faces = s
+    elif kind == "tanh":
+        beta = 2.0 if stretch is None else stretch
+        faces = (1 + np.tanh(beta * (2 * s - 1)) / np.tanh(beta)) / 2
+    elif kind == "geometric":
+        ratio = 1.1 if stretch is None else stretch
+        k = np.arange(points)
+        faces = np.concatenate(([0.0], np.cumsum(ratio ** np.minimum(k, points - 1 - k))))
+        faces /= faces[-1]
+    else:
+        raise ValueError("Unknown grid: {0}".format(kind))
+    return extent * faces
+
+
+# Cell centres of faces with a ghost point mirrored about each wall
+def PaddedCentres(faces):
+    centres = (faces[1:] + faces[:-1]) / 2
+    return np.concatenate(([2 * faces[0] - centres[0]], centres, [2 * faces[-1] - centres[-1]]))
+
+
+# Stencil coefficients of one axis: first derivative, second derivative (east and west weights),
+# local spacing of every padded point and the distance from each wall ghost to its neighbour
+def AxisCoefficients(faces):
+    points = PaddedCentres(faces)
+    h_e = points[2:] - points[1:-1]
+    h_w = points[1:-1] - points[:-2]
+    first = 1 / (h_e + h_w)
+    east = 2 / (h_e * (h_e + h_w))
+    west = 2 / (h_w * (h_e + h_w))
+    spacing = np.concatenate(([h_w[0]], (h_e + h_w) / 2, [h_e[-1]]))
+    return points[1:-1], first, east, west, spacing, (h_w[0], h_e[-1])
+
+
+class StretchedGrid:
+    def __init__(self, x_faces, y_faces, dtype=np.float64):
+        x_faces = np.asarray(x_faces, dtype=float)
+        y_faces = np.asarray(y_faces, dtype=float)
+        if np.any(np.diff(x_faces) <= 0) or np.any(np.diff(y_faces) <= 0):
+            raise ValueError("The faces of a grid must be increasing")
+        self.x_faces = x_faces
+        self.y_faces = y_faces
+        self.x, ddx, xe, xw, hx, self.x_deltas = AxisCoefficients(x_faces)
+        self.y, ddy, yn, ys, hy, self.y_deltas = AxisCoefficients(y_faces)
+        # Coefficients along x vary by column, those along y by row
+        self.ddx = ddx.astype(dtype)
+        self.xe = xe.astype(dtype)
+        self.xw = xw.astype(dtype)
+        self.ddy = ddy[:, np.newaxis].astype(dtype)
+        self.yn = yn[:, np.newaxis].astype(dtype)
+        self.ys = ys[:, np.newaxis].astype(dtype)
+        self.diag = (xe + xw + yn[:, np.newaxis] + ys[:, np.newaxis]).astype(dtype)
+        self.inverse_diag = 1 / self.diag
+        self.inverse_hx = 1 / hx
+        self.inverse_hy = 1 / hy[:, np.newaxis]
+        self.inverse_h2 = float(np.amax(1 / hx**2)) + float(np.amax(1 / hy**2))
+        # Smallest distance between neighbouring points
+        self.dx = float(np.amin(np.diff(PaddedCentres(x_faces))))
+        self.dy = float(np.amin(np.diff(PaddedCentres(y_faces))))
+
+
+# Starred velocities of the interior, as in utils.GetStarredVelocities
+def StarredVelocities(space, fluid):
+    rows = int(space.rowpts)
+    cols = int(space.colpts)
+    g = space.grid
+    u = space.u
+    v = space.v
+    dt = space.dt
+    nu = fluid.mu / fluid.rho
+    w = space.workspace
+
+    u_c = u[..., 1 : rows + 1, 1 : cols + 1]
+    u_e = u[..., 1 : rows + 1, 2:]
+    u_w = u[..., 1 : rows + 1, 0:cols]
+    u_n = u[..., 2:, 1 : cols + 1]
+    u_s = u[..., 0:rows, 1 : cols + 1]
+    v_c = v[..., 1 : rows + 1, 1 : cols + 1]
+    v_e = v[..., 1 : rows + 1, 2:]
+    v_w = v[..., 1 : rows + 1, 0:cols]
+    v_n = v[..., 2:, 1 : cols + 1]
+    v_s = v[..., 0:rows, 1 : cols + 1]
+
+    # Advection term u * u1_x + v_face * u1_y
+    np.subtract(u_e, u_w, out=w.t1)
+    w.t1 *= u_c
+    w.t1 *= g.ddx
+    np.add(v_c, v_w, out=w.t2)
+    w.t2 += v_n
+    w.t2 += v[..., 2:, 0:cols]
+    w.t2 *= 1 / 4
+    np.subtract(u_n, u_s, out=w.t3)
+    w.t3 *= g.ddy
+    w.t3 *= w.t2
+    w.t1 += w.t3
+    # Diffusion term u2_x + u2_y
+    Laplacian(g, u_c, u_e, u_w, u_n, u_s, w.t2, w.t3)
+    u_star_c = space.u_star[..., 1 : rows + 1, 1 : cols + 1]
+    w.t1 *= -dt
+    w.t2 *= dt * nu
+    np.add(u_c, w.t1, out=u_star_c)
+    u_star_c += w.t2
+    u_star_c += dt * space.S_x
+
+    # Advection term u_face * v1_x + v * v1_y
+    np.subtract(v_n, v_s, out=w.t1)
+    w.t1 *= v_c
+    w.t1 *= g.ddy
+    np.add(u_c, u_e, out=w.t2)
+    w.t2 += u_s
+    w.t2 += u[..., 0:rows, 2:]
+    w.t2 *= 1 / 4
+    np.subtract(v_e, v_w, out=w.t3)
+    w.t3 *= g.ddx
+    w.t3 *= w.t2
+    w.t1 += w.t3
+    # Diffusion term v2_x + v2_y
+    Laplacian(g, v_c, v_e, v_w, v_n, v_s, w.t2, w.t3)
+    v_star_c = space.v_star[..., 1 : rows + 1, 1 : cols + 1]
+    w.t1 *= -dt
+    w.t2 *= dt * nu
+    np.add(v_c, w.t1, out=v_star_c)
+    v_star_c += w.t2
+    v_star_c += dt * space.S_y
+
+
+# Five point Laplacian of the centre points f_c from their neighbours, written to out
+def Laplacian(g, f_c, f_e, f_w, f_n, f_s, out, scratch):
+    np.multiply(f_e, g.xe, out=out)
+    np.multiply(f_w, g.xw, out=scratch)
+    out += scratch
+    np.multiply(f_n, g.yn, out=scratch)
+    out += scratch
+    np.multiply(f_s, g.ys, out=scratch)
+    out += scratch
+    np.multiply(f_c, g.diag, out=scratch)
+    out -= scratch
+
+
+# Divergence of the starred velocities over the interior, written to out
+def Divergence(space, out, scratch):
+    rows = int(space.rowpts)
+    cols = int(space.colpts)
+    g = space.grid
+    u_star = space.u_star
+    v_star = space.v_star
+    np.subtract(u_star[..., 1 : rows + 1, 2:], u_star[..., 1 : rows + 1, 0:cols], out=out)
+    out *= g.ddx
+    np.subtract(v_star[..., 2:, 1 : cols + 1], v_star[..., 0:rows, 1 : cols + 1], out=scratch)
+    scratch *= g.ddy
+    out += scratch
+    return out
+
+
+# Source term of the Jacobi iteration, rho / dt * div(u_star) divided by the diagonal
+def JacobiSource(space, fluid, out):
+    Divergence(space, out, space.workspace.t2)
+    out *= space.grid.inverse_diag
+    out *= fluid.rho / space.dt
+    return out
+
+
+# One Jacobi sweep: the new interior pressure from the current one
+def JacobiSweep(space, source):
+    rows = int(space.rowpts)
+    cols = int(space.colpts)
+    g = space.grid
+    p = space.p
+    w = space.workspace
+    np.multiply(p[..., 1 : rows + 1, 2:], g.xe, out=w.t2)
+    np.multiply(p[..., 1 : rows + 1, 0:cols], g.xw, out=w.t3)
+    w.t2 += w.t3
+    np.multiply(p[..., 2:, 1 : cols + 1], g.yn, out=w.t3)
+    w.t2 += w.t3
+    np.multiply(p[..., 0:rows, 1 : cols + 1], g.ys, out=w.t3)
+    w.t2 += w.t3
+    w.t2 *= g.inverse_diag
+    np.subtract(w.t2, source, out=p[..., 1 : rows + 1, 1 : cols + 1])
+
+
+# Velocities at the next time step from the pressure gradient, as in utils.SolveMomentumEquation
+def CorrectVelocities(space, fluid):
+    rows = int(space.rowpts)
+    cols = int(space.colpts)
+    g = space.grid
+    p = space.p
+    w = space.workspace
+    scale = space.dt / fluid.rho
+    np.subtract(p[..., 1 : rows + 1, 2:], p[..., 1 : rows + 1, 0:cols], out=w.t1)
+    w.t1 *= g.ddx
+    w.t1 *= scale
+    np.subtract(
+        space.u_star[..., 1 : rows + 1, 1 : cols + 1],
+        w.t1,
+        out=space.u[..., 1 : rows + 1, 1 : cols + 1],
+    )
+    np.subtract(p[..., 2:, 1 : cols + 1], p[..., 0:rows, 1 : cols + 1], out=w.t1)
+    w.t1 *= g.ddy
+    w.t1 *= scale
+    np.subtract(
+        space.v_star[..., 1 : rows + 1, 1 : cols + 1],
+        w.t1,
+        out=space.v[..., 1 : rows + 1, 1 : cols + 1],
+    )
+
+
+# Largest stable time-step: the convective CFL limit of utils.SetTimeStep with the local spacing,
+# together with the explicit diffusion limit, which the smallest cells make the stricter one. The
+# rates are formed in workspace.p_old, which the pressure solve only uses later in the step
+def TimeStep(CFL, space, fluid, diffusion=True):
+    g = space.grid
+    nu = fluid.mu / fluid.rho if diffusion else 0
+    rate = space.workspace.p_old
+    np.multiply(space.u, g.inverse_hx, out=rate)
+    u_rate = np.amax(rate, axis=(-2, -1))
+    np.multiply(space.v, g.inverse_hy, out=rate)
+    v_rate = np.amax(rate, axis=(-2, -1))
+    return CFL / (u_rate + v_rate + 2 * nu * g.inverse_h2)
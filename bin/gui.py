@@ -1,6 +1,6 @@
+import os
 import tkinter as tk
-from tkinter import messagebox
-import cfd
+import jobs
 
 
 #### SIMULATION RUN BUTTON COMMAND ----------------------------------------------------------------
@@ -19,79 +19,135 @@ def run_simulation():
         "mu": float(mu_entry.get()),
     }
 
-    # You can now pass sim_params and boundary_params to your simulation function
-    # For now, just showing a message box
-    messagebox.showinfo("Simulation", "Simulation started with the given parameters.")
-    cfd.run(sim_params)
-
-
-#### Create GUI ----------------------------
-app = tk.Tk()
-app.title("Fluid Dynamics Simulation")
-
-#### Widgets--------------------------------
-# Simulation time
-tk.Label(app, text="Time").pack()
-time_entry = tk.Entry(app)
-time_entry.insert(0, 150)
-time_entry.pack()
-
-# Reduce this if solution diverges
-tk.Label(app, text="CFL Number").pack()
-cfl_entry = tk.Entry(app)
-cfl_entry.insert(0, 0.8)
-cfl_entry.pack()
-
-# Keep 1 to print results to file
-tk.Label(app, text="File flag").pack()
-file_flag_entry = tk.Entry(app)
-file_flag_entry.insert(0, 1)
-file_flag_entry.pack()
-
-# Record values in file per interval number of iterations
-tk.Label(app, text="Interval").pack()
-interval_entry = tk.Entry(app)
-interval_entry.insert(0, 100)
-interval_entry.pack()
-
-# Length of computational domain in the x-direction
-tk.Label(app, text="Length").pack()
-length_entry = tk.Entry(app)
-length_entry.insert(0, 4)
-length_entry.pack()
-
-# Breadth of computational domain in the y-direction
-tk.Label(app, text="Breadth").pack()
-breadth_entry = tk.Entry(app)
-breadth_entry.insert(0, 4)
-breadth_entry.pack()
-
-# Number of grid points in the x-direction #KEEP ODD
-tk.Label(app, text="Points along y").pack()
-colpts_entry = tk.Entry(app)
-colpts_entry.insert(0, 257)
-colpts_entry.pack()
-
-# Number of grid points in the y-direction #KEEP ODD
-tk.Label(app, text="Points along x").pack()
-rowpts_entry = tk.Entry(app)
-rowpts_entry.insert(0, 257)
-rowpts_entry.pack()
-
-# Density of fluid
-tk.Label(app, text="Fluid density").pack()
-rho_entry = tk.Entry(app)
-rho_entry.insert(0, 1)
-rho_entry.pack()
-
-# Dynamic viscosity of fluid
-tk.Label(app, text="Fluid dynamic viscosity").pack()
-mu_entry = tk.Entry(app)
-mu_entry.insert(0, 0.01)
-mu_entry.pack()
-
-#### Start Simulation button
-start_button = tk.Button(app, text="Start Simulation", command=run_simulation)
-start_button.pack()
-
-app.mainloop()
+    # The job runs in a worker process, so the window stays responsive
+    job_id = manager.Submit(sim_params)
+    jobs_list.insert(tk.END, describe_job(manager.jobs[job_id]))
+
+
+#### JOB LIST ------------------------------------------------------------------------------------
+def describe_job(job):
+    text = "Job {0}: {1}".format(job.id, job.status)
+    progress = job.progress
+    if job.status == "running" and "time" in progress:
+        text += "  t = {0:.3f}  dt = {1:.2e}  {2:.1f} steps/s  {3} Poisson iterations".format(
+            progress["time"], progress["dt"], progress["steps_per_s"], progress["p_iterations"]
+        )
+    elif job.status == "finished":
+        text += "  t = {0:.3f} after {1} steps ({2})".format(
+            progress["time"], progress["step"], progress["stop_reason"]
+        )
+        if progress.get("cache") is not None:
+            text += "  cache: {0}".format(progress["cache"])
+    elif job.status == "failed":
+        text += "  {0}".format(progress["error"])
+    return text
+
+
+# Receive the events of the workers and update their lines, then poll again
+def poll_jobs():
+    manager.Poll()
+    for job in manager.jobs.values():
+        text = describe_job(job)
+        if jobs_list.get(job.id) != text:
+            selected = jobs_list.selection_includes(job.id)
+            jobs_list.delete(job.id)
+            jobs_list.insert(job.id, text)
+            if selected:
+                jobs_list.selection_set(job.id)
+    app.after(200, poll_jobs)
+
+
+def cancel_jobs():
+    for index in jobs_list.curselection():
+        manager.Cancel(index)
+
+
+def close():
+    manager.Shutdown()
+    app.destroy()
+
+
+if __name__ == "__main__":
+    # Jobs beyond the number of processors wait until one finishes. Repeated runs come from the
+    # run cache in results/cache
+    manager = jobs.JobManager(cache_dir=os.path.join("results", "cache"))
+
+    #### Create GUI ----------------------------
+    app = tk.Tk()
+    app.title("Fluid Dynamics Simulation")
+
+    #### Widgets--------------------------------
+    # Simulation time
+    tk.Label(app, text="Time").pack()
+    time_entry = tk.Entry(app)
+    time_entry.insert(0, 150)
+    time_entry.pack()
+
+    # Reduce this if solution diverges
+    tk.Label(app, text="CFL Number").pack()
+    cfl_entry = tk.Entry(app)
+    cfl_entry.insert(0, 0.8)
+    cfl_entry.pack()
+
+    # Keep 1 to print results to file
+    tk.Label(app, text="File flag").pack()
+    file_flag_entry = tk.Entry(app)
+    file_flag_entry.insert(0, 1)
+    file_flag_entry.pack()
+
+    # Record values in file per interval number of iterations
+    tk.Label(app, text="Interval").pack()
+    interval_entry = tk.Entry(app)
+    interval_entry.insert(0, 100)
+    interval_entry.pack()
+
+    # Length of computational domain in the x-direction
+    tk.Label(app, text="Length").pack()
+    length_entry = tk.Entry(app)
+    length_entry.insert(0, 4)
+    length_entry.pack()
+
+    # Breadth of computational domain in the y-direction
+    tk.Label(app, text="Breadth").pack()
+    breadth_entry = tk.Entry(app)
+    breadth_entry.insert(0, 4)
+    breadth_entry.pack()
+
+    # Number of grid points in the x-direction #KEEP ODD
+    tk.Label(app, text="Points along y").pack()
+    colpts_entry = tk.Entry(app)
+    colpts_entry.insert(0, 257)
+    colpts_entry.pack()
+
+    # Number of grid points in the y-direction #KEEP ODD
+    tk.Label(app, text="Points along x").pack()
+    rowpts_entry = tk.Entry(app)
+    rowpts_entry.insert(0, 257)
+    rowpts_entry.pack()
+
+    # Density of fluid
+    tk.Label(app, text="Fluid density").pack()
+    rho_entry = tk.Entry(app)
+    rho_entry.insert(0, 1)
+    rho_entry.pack()
+
+    # Dynamic viscosity of fluid
+    tk.Label(app, text="Fluid dynamic viscosity").pack()
+    mu_entry = tk.Entry(app)
+    mu_entry.insert(0, 0.01)
+    mu_entry.pack()
+
+    #### Start Simulation button
+    start_button = tk.Button(app, text="Start Simulation", command=run_simulation)
+    start_button.pack()
+
+    # Submitted jobs, their progress and the button to cancel the selected ones
+    tk.Label(app, text="Jobs").pack()
+    jobs_list = tk.Listbox(app, width=100, height=8, selectmode=tk.EXTENDED)
+    jobs_list.pack()
+    cancel_button = tk.Button(app, text="Cancel Selected", command=cancel_jobs)
+    cancel_button.pack()
+
+    app.protocol("WM_DELETE_WINDOW", close)
+    app.after(200, poll_jobs)
+    app.mainloop()
@@ -0,0 +1,154 @@
+import contextlib
+import multiprocessing
+import os
+import queue
+import time as clock
+import cfd
+
+
+# Background simulation jobs. Every job runs cfd.run in its own worker process and reports back
+# through an event queue as (job id, kind, data) tuples, where kind is "started", "progress",
+# "finished", "cancelled" or "failed". Progress comes from the telemetry callback of the run, which
+# is also where a cancelled job stops: the callback raises Cancelled, so the result writer is still
+# closed properly. Up to max_jobs jobs run at once and the others wait in submission order
+FINISHED = ("finished", "cancelled", "failed")
+
+
+class Cancelled(Exception):
+    pass
+
+
+def RunJob(job_id, sim_params, events, cancel, log_path, progress_interval=0.2):
+    start = clock.perf_counter()
+    state = {"last": 0.0, "steps": 0}
+
+    def Progress(record):
+        if cancel.is_set():
+            raise Cancelled()
+        state["steps"] += 1
+        now = clock.perf_counter()
+        if now - state["last"] >= progress_interval:
+            state["last"] = now
+            data = {
+                "time": record["time"],
+                "dt": record["dt"],
+                "step": record["step"],
+                "steps_per_s": state["steps"] / (now - start),
+                "p_iterations": record["p_iterations"],
+            }
+            events.put((job_id, "progress", data))
+
+    events.put((job_id, "started", {"pid": os.getpid()}))
+    try:
+        with open(log_path, "w") as log:
+            with contextlib.redirect_stdout(log):
+                space = cfd.run(dict(sim_params, telemetry=Progress))
+        data = {
+            "time": space.t,
+            "step": space.iteration,
+            "stop_reason": space.stop_reason,
+            "cache": getattr(space, "cache", None),
+        }
+        events.put((job_id, "finished", data))
+    except Cancelled:
+        events.put((job_id, "cancelled", {}))
+    except Exception as error:
+        events.put((job_id, "failed", {"error": "{0}: {1}".format(type(error).__name__, error)}))
+
+
+class Job:
+    def __init__(self, job_id, sim_params, log_path):
+        self.id = job_id
+        self.sim_params = sim_params
+        self.log_path = log_path
+        self.status = "queued"
+        self.progress = {}
+        self.process = None
+        self.cancel = None
+
+
+# Runs jobs in worker processes. Call Poll() regularly (e.g. from a Tk timer) to receive their
+# events; it returns the jobs whose state changed. Job k writes to output_dir/job{k} and logs its
+# console output to output_dir/job{k}.log. With a cache_dir the jobs share a run cache, so a job
+# that repeats an earlier one returns its result at once (see runcache)
+class JobManager:
+    def __init__(self, max_jobs=None, output_dir="results", cache_dir=None):
+        self.context = multiprocessing.get_context()
+        self.events = self.context.Queue()
+        self.max_jobs = max_jobs or os.cpu_count()
+        self.output_dir = os.path.abspath(output_dir)
+        self.cache_dir = None if cache_dir is None else os.path.abspath(cache_dir)
+        self.jobs = {}
+        self.next_id = 0
+
+    def Submit(self, sim_params):
+        job_id = self.next_id
+        self.next_id += 1
+        os.makedirs(self.output_dir, exist_ok=True)
+        job_dir = os.path.join(self.output_dir, "job{0}".format(job_id))
+        log_path = job_dir + ".log"
+        sim_params = dict(sim_params, output_dir=job_dir)
+        if self.cache_dir is not None:
+            sim_params.setdefault("cache_dir", self.cache_dir)
+        self.jobs[job_id] = Job(job_id, sim_params, log_path)
+        self.Schedule()
+        return job_id
+
+    def Cancel(self, job_id):
+        job = self.jobs[job_id]
+        if job.status == "queued":
+            job.status = "cancelled"
+        elif job.status == "running":
+            job.cancel.set()
+
+    # Start queued jobs while fewer than max_jobs are running
+    def Schedule(self):
+        running = sum(job.status == "running" for job in self.jobs.values())
+        for job in self.jobs.values():
+            if running >= self.max_jobs:
+                break
+            if job.status == "queued":
+                job.cancel = self.context.Event()
+                job.process = self.context.Process(
+                    target=RunJob,
+                    args=(job.id, job.sim_params, self.events, job.cancel, job.log_path),
+                    daemon=True,
+                )
+                job.process.start()
+                job.status = "running"
+                running += 1
+
+    def Poll(self):
+        changed = set()
+        while True:
+            try:
+                job_id, kind, data = self.events.get_nowait()
+            except queue.Empty:
+                break
+            job = self.jobs[job_id]
+            if kind == "progress":
+                job.progress.update(data)
+            elif kind in FINISHED:
+                job.status = kind
+                job.progress.update(data)
+                job.process.join()
+            changed.add(job_id)
+        # A worker that died without reporting, e.g. killed by the system
+        for job in self.jobs.values():
+            if job.status == "running" and job.process.exitcode is not None:
+                job.status = "failed"
+                job.progress["error"] = "worker exited with code {0}".format(job.process.exitcode)
+                changed.add(job.id)
+        self.Schedule()
+        return [self.jobs[job_id] for job_id in sorted(changed)]
+
+    # Cancel every job and wait for the workers to stop
+    def Shutdown(self, timeout=5):
+        for job in self.jobs.values():
+            if job.status in ("queued", "running"):
+                self.Cancel(job.id)
+        for job in self.jobs.values():
+            if job.process is not None and job.process.is_alive():
+                job.process.join(timeout)
+                if job.process.is_alive():
+                    job.process.terminate()
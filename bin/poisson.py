@@ -0,0 +1,636 @@
+import functools
+import warnings
+import numpy as np
+import grids
+import utils
+
+
+# Pressure solvers that can be used in place of the Jacobi iteration in utils.SolvePressurePoisson.
+# Every solver takes the same (space, fluid, left, right, top, bottom) arguments, leaves the
+# converged pressure in space.p with its boundary conditions applied and records the number of
+# iterations/cycles and the final relative residual in space.p_iterations and space.p_residual.
+
+
+# Split a boundary into the coefficients of ghost = a * interior + b for the pressure field
+def GetGhostCoefficients(boundary, delta, sign):
+    if boundary.type == "D":
+        return 0.0, float(boundary.value)
+    elif boundary.type == "N":
+        return 1.0, sign * float(boundary.value) * delta
+    raise ValueError("Unknown boundary type: {0}".format(boundary.type))
+
+
+# Ghost coefficients (left, right, top, bottom) of the pressure field on the grid of space
+def GetPressureGhosts(space, left, right, top, bottom):
+    dx = float(space.dx)
+    dy = float(space.dy)
+    a_left, b_left = GetGhostCoefficients(left, dx, -1)
+    a_right, b_right = GetGhostCoefficients(right, dx, 1)
+    a_top, b_top = GetGhostCoefficients(top, dy, -1)
+    a_bottom, b_bottom = GetGhostCoefficients(bottom, dy, 1)
+    return (a_left, a_right, a_top, a_bottom), (b_left, b_right, b_top, b_bottom)
+
+
+# Pressure unknowns of one grid, shared by the multigrid levels, the SOR iteration and the direct
+# solver. The Laplacian on the grid is written as
+#   (P_E + P_W) / hx^2 + (P_N + P_S) / hy^2 + diag * P = f
+# where the part of each ghost cell that depends on the interior has been folded into diag,
+# so the ghost cells of P only ever hold the constant part b and never need to be refreshed
+class PressureGrid:
+    def __init__(self, rowpts, colpts, hx, hy, a, b):
+        self.rowpts = rowpts
+        self.colpts = colpts
+        self.hx = hx
+        self.hy = hy
+        # Padded solution, right hand side, residual and scratch arrays
+        self.P = np.zeros((rowpts + 2, colpts + 2))
+        self.f = np.zeros((rowpts, colpts))
+        self.r = np.zeros((rowpts, colpts))
+        self.q = np.zeros((rowpts, colpts))
+        self.rhs = np.zeros((rowpts, colpts))
+        self.padded = np.zeros((rowpts + 2, colpts + 2))
+        self.SetGhosts(b)
+        # Diagonal of the operator including the folded ghost coefficients (left, right, top, bottom)
+        self.diag = np.full((rowpts, colpts), -2 / hx**2 - 2 / hy**2)
+        self.diag[:, 0] += a[0] / hx**2
+        self.diag[:, -1] += a[1] / hx**2
+        self.diag[-1, :] += a[2] / hy**2
+        self.diag[0, :] += a[3] / hy**2
+        self.inverse_diag = 1 / self.diag
+
+        # Views of the four sub-lattices of the red-black ordering with their scratch arrays.
+        # Red cells have an even (i + j), black cells an odd one
+        rows = rowpts
+        cols = colpts
+        P = self.P
+        self.colours = ([], [])
+        for r0 in (0, 1):
+            for c0 in (0, 1):
+                centre = P[1 + r0 : rows + 1 : 2, 1 + c0 : cols + 1 : 2]
+                self.colours[(r0 + c0) % 2].append(
+                    (
+                        centre,
+                        P[1 + r0 : rows + 1 : 2, 2 + c0 : cols + 2 : 2],
+                        P[1 + r0 : rows + 1 : 2, c0:cols:2],
+                        P[2 + r0 : rows + 2 : 2, 1 + c0 : cols + 1 : 2],
+                        P[r0:rows:2, 1 + c0 : cols + 1 : 2],
+                        self.f[r0::2, c0::2],
+                        self.inverse_diag[r0::2, c0::2],
+                        np.empty(centre.shape),
+                        np.empty(centre.shape),
+                    )
+                )
+
+    def SetGhosts(self, b):
+        self.b = b
+        self.P[1:-1, 0] = b[0]
+        self.P[1:-1, -1] = b[1]
+        self.P[-1, 1:-1] = b[2]
+        self.P[0, 1:-1] = b[3]
+
+    # Apply the operator to the interior of P and store f - L(P) in r
+    def Residual(self):
+        rows = self.rowpts
+        cols = self.colpts
+        P = self.P
+        r = self.r
+        q = self.q
+        np.add(P[1 : rows + 1, 2:], P[1 : rows + 1, 0:cols], out=r)
+        r *= 1 / self.hx**2
+        np.add(P[2:, 1 : cols + 1], P[0:rows, 1 : cols + 1], out=q)
+        q *= 1 / self.hy**2
+        r += q
+        np.multiply(self.diag, P[1 : rows + 1, 1 : cols + 1], out=q)
+        r += q
+        np.subtract(self.f, r, out=r)
+        return r
+
+    # Right hand side f with the constant ghost contributions moved to it
+    def EffectiveSource(self):
+        b = self.b
+        rhs = self.rhs
+        np.copyto(rhs, self.f)
+        rhs[:, 0] -= b[0] / self.hx**2
+        rhs[:, -1] -= b[1] / self.hx**2
+        rhs[-1, :] -= b[2] / self.hy**2
+        rhs[0, :] -= b[3] / self.hy**2
+        return rhs
+
+    # In-place red-black successive over-relaxation sweeps (Gauss-Seidel for omega = 1)
+    def Relax(self, sweeps, omega=1.0):
+        ihx2 = 1 / self.hx**2
+        ihy2 = 1 / self.hy**2
+        for _ in range(sweeps):
+            for colour in self.colours:
+                for centre, east, west, north, south, f, inverse_diag, t, s in colour:
+                    np.add(east, west, out=t)
+                    t *= ihx2
+                    np.add(north, south, out=s)
+                    s *= ihy2
+                    t += s
+                    np.subtract(f, t, out=t)
+                    t *= inverse_diag
+                    if omega != 1.0:
+                        t -= centre
+                        t *= omega
+                        centre += t
+                    else:
+                        centre[...] = t
+
+
+class MultigridHierarchy:
+    def __init__(self, space, left, right, top, bottom):
+        self.key = PressureOperatorKey(space, left, right, top, bottom)
+        rows = int(space.rowpts)
+        cols = int(space.colpts)
+        hx = float(space.dx)
+        hy = float(space.dy)
+        a, b = GetPressureGhosts(space, left, right, top, bottom)
+        types = (left.type, right.type, top.type, bottom.type)
+        self.levels = [PressureGrid(rows, cols, hx, hy, a, b)]
+        # Coarsen by a factor of two while the point counts stay odd (vertex-centred coarsening).
+        # On a level with spacing H = 2^l h a Dirichlet ghost is extrapolated so that the error still
+        # vanishes at the finest ghost cell, and a Neumann ghost mirrors the interior
+        level = 0
+        while rows % 2 == 1 and cols % 2 == 1 and min(rows, cols) >= 5:
+            level += 1
+            rows = (rows + 1) // 2
+            cols = (cols + 1) // 2
+            hx *= 2
+            hy *= 2
+            a = tuple(1.0 if kind == "N" else 1.0 - 2**level for kind in types)
+            self.levels.append(PressureGrid(rows, cols, hx, hy, a, (0.0, 0.0, 0.0, 0.0)))
+
+        # Factorize the coarsest operator once: small grids with a dense pseudo-inverse, larger ones
+        # (meshes with an even point count stop coarsening early) with a sparse LU factorization,
+        # pinning the first cell if the operator is singular
+        coarsest = self.levels[-1]
+        self.coarse_inverse = None
+        self.coarse_lu = None
+        if coarsest.rowpts * coarsest.colpts <= 1024:
+            self.coarse_inverse = np.linalg.pinv(AssembleOperator(coarsest))
+        else:
+            import scipy.sparse.linalg
+
+            warnings.warn(
+                "Multigrid: a {0} x {1} mesh only coarsens to {2} x {3}, which is solved with a "
+                "sparse LU factorization; use 2^k + 1 points for the full multigrid speed".format(
+                    int(space.colpts), int(space.rowpts), coarsest.colpts, coarsest.rowpts
+                )
+            )
+            A = AssembleSparseOperator(coarsest)
+            self.pinned = "D" not in types
+            if self.pinned:
+                A = A.tolil()
+                A[0, :] = 0
+                A[0, 0] = 1
+                A = A.tocsc()
+            self.coarse_lu = scipy.sparse.linalg.splu(A)
+
+    # Solve the coarsest level exactly, with the constant ghost contributions of the finest level
+    # when it is the only one
+    def SolveCoarsest(self):
+        coarsest = self.levels[-1]
+        rhs = coarsest.EffectiveSource()
+        if self.coarse_inverse is not None:
+            solution = self.coarse_inverse @ rhs.ravel()
+        else:
+            if self.pinned:
+                rhs[0, 0] = 0
+            solution = self.coarse_lu.solve(rhs.ravel())
+        coarsest.P[1:-1, 1:-1] = solution.reshape(rhs.shape)
+
+    def Cycle(self, level, gamma, pre_sweeps, post_sweeps):
+        if level == len(self.levels) - 1:
+            self.SolveCoarsest()
+            return
+        fine = self.levels[level]
+        coarse = self.levels[level + 1]
+        fine.Relax(pre_sweeps)
+        fine.Residual()
+        Restrict(fine, coarse)
+        coarse.P[1:-1, 1:-1] = 0
+        for _ in range(gamma):
+            self.Cycle(level + 1, gamma, pre_sweeps, post_sweeps)
+        ProlongAdd(coarse, fine)
+        fine.Relax(post_sweeps)
+
+
+# Everything the discrete pressure operator depends on, used to detect when a cached multigrid
+# hierarchy or factorization has to be rebuilt
+def PressureOperatorKey(space, left, right, top, bottom):
+    return (
+        int(space.rowpts),
+        int(space.colpts),
+        float(space.dx),
+        float(space.dy),
+        tuple((b.type, b.value) for b in (left, right, top, bottom)),
+        id(getattr(space, "grid", None)),
+    )
+
+
+# Return the object built by builder(space, left, right, top, bottom) that is cached on the space
+# under the given attribute name, rebuilding it if the pressure operator has changed since
+def GetCached(space, name, builder, left, right, top, bottom):
+    cached = getattr(space, name, None)
+    if cached is None or cached.key != PressureOperatorKey(space, left, right, top, bottom):
+        cached = builder(space, left, right, top, bottom)
+        setattr(space, name, cached)
+    return cached
+
+
+# Dense matrix of the operator of a (small) grid, used for the coarsest grid solve
+def AssembleOperator(grid):
+    rows = grid.rowpts
+    cols = grid.colpts
+    n = rows * cols
+    A = np.zeros((n, n))
+    index = np.arange(n).reshape(rows, cols)
+    A[index, index] = grid.diag
+    A[index[:, 1:], index[:, :-1]] = 1 / grid.hx**2
+    A[index[:, :-1], index[:, 1:]] = 1 / grid.hx**2
+    A[index[1:, :], index[:-1, :]] = 1 / grid.hy**2
+    A[index[:-1, :], index[1:, :]] = 1 / grid.hy**2
+    return A
+
+
+# Sparse matrix of the operator of a grid, used for the direct solver
+def AssembleSparseOperator(grid):
+    import scipy.sparse
+
+    rows = grid.rowpts
+    cols = grid.colpts
+    index = np.arange(rows * cols).reshape(rows, cols)
+    row_index = [index.ravel()]
+    col_index = [index.ravel()]
+    values = [grid.diag.ravel()]
+    for first, second, h in (
+        (index[:, 1:], index[:, :-1], grid.hx),
+        (index[:, :-1], index[:, 1:], grid.hx),
+        (index[1:, :], index[:-1, :], grid.hy),
+        (index[:-1, :], index[1:, :], grid.hy),
+    ):
+        row_index.append(first.ravel())
+        col_index.append(second.ravel())
+        values.append(np.full(first.size, 1 / h**2))
+    return scipy.sparse.csc_matrix(
+        (np.concatenate(values), (np.concatenate(row_index), np.concatenate(col_index))),
+        shape=(rows * cols, rows * cols),
+    )
+
+
+# Full-weighting restriction of the residual of a fine vertex grid of 2m-1 points to the right
+# hand side of a coarse grid of m points. Points outside the grid are weighted with zero
+def Restrict(fine, coarse):
+    rows = fine.rowpts
+    cols = fine.colpts
+    r = fine.padded
+    r[1:-1, 1:-1] = fine.r
+    f = coarse.f
+    t = coarse.q
+    # Corners
+    np.add(r[0:rows:2, 0:cols:2], r[0:rows:2, 2 : cols + 2 : 2], out=f)
+    f += r[2 : rows + 2 : 2, 0:cols:2]
+    f += r[2 : rows + 2 : 2, 2 : cols + 2 : 2]
+    # Edges
+    np.add(r[0:rows:2, 1 : cols + 1 : 2], r[2 : rows + 2 : 2, 1 : cols + 1 : 2], out=t)
+    t += r[1 : rows + 1 : 2, 0:cols:2]
+    t += r[1 : rows + 1 : 2, 2 : cols + 2 : 2]
+    t *= 2
+    f += t
+    # Centre
+    np.multiply(r[1 : rows + 1 : 2, 1 : cols + 1 : 2], 4, out=t)
+    f += t
+    f *= 1 / 16
+
+
+# Bilinear interpolation of the coarse correction, added to the fine grid values
+def ProlongAdd(coarse, fine):
+    e = coarse.P[1:-1, 1:-1]
+    p = fine.P[1:-1, 1:-1]
+    t = coarse.q
+    p[0::2, 0::2] += e
+    np.add(e[:-1, :], e[1:, :], out=t[:-1, :])
+    t[:-1, :] *= 0.5
+    p[1::2, 0::2] += t[:-1, :]
+    np.add(e[:, :-1], e[:, 1:], out=t[:, :-1])
+    t[:, :-1] *= 0.5
+    p[0::2, 1::2] += t[:, :-1]
+    np.add(e[:-1, :-1], e[1:, :-1], out=t[:-1, :-1])
+    t[:-1, :-1] += e[:-1, 1:]
+    t[:-1, :-1] += e[1:, 1:]
+    t[:-1, :-1] *= 0.25
+    p[1::2, 1::2] += t[:-1, :-1]
+
+
+# Right hand side rho/dt * div(u_star) of the pressure Poisson equation on the interior
+def PressureSource(space, fluid, out):
+    rows = int(space.rowpts)
+    cols = int(space.colpts)
+    u_star = space.u_star
+    v_star = space.v_star
+    dx = float(space.dx)
+    dy = float(space.dy)
+    t = space.workspace.t1
+    np.subtract(u_star[1 : rows + 1, 2:], u_star[1 : rows + 1, 0:cols], out=out)
+    out *= 1 / (2 * dx)
+    np.subtract(v_star[2:, 1 : cols + 1], v_star[0:rows, 1 : cols + 1], out=t)
+    t *= 1 / (2 * dy)
+    out += t
+    out *= float(fluid.rho) / float(space.dt)
+    return out
+
+
+# Geometric multigrid solution of the pressure Poisson equation. The iteration stops when the
+# residual norm has dropped below tol relative to the norm of the right hand side (including the
+# boundary contributions); the number of cycles needed is independent of the grid size
+def SolvePressureMultigrid(
+    space,
+    fluid,
+    left,
+    right,
+    top,
+    bottom,
+    tol=1e-6,
+    cycle="V",
+    max_cycles=100,
+    pre_sweeps=2,
+    post_sweeps=2,
+):
+    hierarchy = GetCached(space, "multigrid", MultigridHierarchy, left, right, top, bottom)
+    gamma = {"V": 1, "W": 2}[cycle]
+    fine = hierarchy.levels[0]
+
+    # Start from the current pressure and the right hand side of this time step
+    fine.P[1:-1, 1:-1] = space.p[1:-1, 1:-1]
+    PressureSource(space, fluid, out=fine.f)
+
+    # Norm of the right hand side with the constant ghost contributions moved to it
+    rhs = fine.EffectiveSource()
+    # With Neumann conditions on every side the problem is only solvable for a zero-mean source
+    if "D" not in (left.type, right.type, top.type, bottom.type):
+        fine.f -= rhs.mean()
+        rhs -= rhs.mean()
+    scale = np.linalg.norm(rhs)
+    if scale == 0:
+        scale = 1.0
+
+    residual = np.linalg.norm(fine.Residual()) / scale
+    cycles = 0
+    while residual > tol and cycles < max_cycles:
+        hierarchy.Cycle(0, gamma, pre_sweeps, post_sweeps)
+        residual = np.linalg.norm(fine.Residual()) / scale
+        cycles += 1
+    if residual > tol:
+        warnings.warn(
+            "Multigrid did not converge in {0} cycles: relative residual {1:.2e} > {2:.0e}".format(
+                max_cycles, residual, tol
+            )
+        )
+
+    space.p[1:-1, 1:-1] = fine.P[1:-1, 1:-1]
+    utils.SetPBoundary(space, left, right, top, bottom)
+    space.p_iterations = cycles
+    space.p_residual = residual
+
+
+# Sparse LU factorization of the pressure operator, built once per mesh and boundary set
+class DirectFactorization:
+    def __init__(self, space, left, right, top, bottom):
+        import scipy.sparse.linalg
+
+        self.key = PressureOperatorKey(space, left, right, top, bottom)
+        a, b = GetPressureGhosts(space, left, right, top, bottom)
+        self.grid = PressureGrid(
+            int(space.rowpts), int(space.colpts), float(space.dx), float(space.dy), a, b
+        )
+        A = AssembleSparseOperator(self.grid)
+        # With Neumann conditions on every side the pressure is only defined up to a constant,
+        # so the first cell is pinned to zero to make the factorization non-singular
+        self.pinned = "D" not in (left.type, right.type, top.type, bottom.type)
+        if self.pinned:
+            A = A.tolil()
+            A[0, :] = 0
+            A[0, 0] = 1
+            A = A.tocsc()
+        self.lu = scipy.sparse.linalg.splu(A)
+
+
+# Direct solution of the pressure Poisson equation with one back-substitution per time step.
+# The factorization is cached on the space and rebuilt automatically when the mesh or the
+# boundary conditions change
+def SolvePressureDirect(space, fluid, left, right, top, bottom):
+    if getattr(space, "grid", None) is not None:
+        return SolveStretchedPressureDirect(space, fluid, left, right, top, bottom)
+    factorization = GetCached(
+        space, "pressure_factorization", DirectFactorization, left, right, top, bottom
+    )
+    grid = factorization.grid
+
+    PressureSource(space, fluid, out=grid.f)
+    rhs = grid.EffectiveSource()
+    if factorization.pinned:
+        grid.f -= rhs.mean()
+        rhs -= rhs.mean()
+    scale = np.linalg.norm(rhs)
+    if scale == 0:
+        scale = 1.0
+    if factorization.pinned:
+        rhs.flat[0] = 0
+    grid.P[1:-1, 1:-1] = factorization.lu.solve(rhs.ravel()).reshape(rhs.shape)
+
+    space.p[1:-1, 1:-1] = grid.P[1:-1, 1:-1]
+    utils.SetPBoundary(space, left, right, top, bottom)
+    space.p_iterations = 1
+    space.p_residual = np.linalg.norm(grid.Residual()) / scale
+
+
+# Sparse LU factorization of the pressure operator of a stretched grid (see grids), with the part of
+# each ghost cell that depends on the interior folded into the diagonal and the constant part kept
+# to be moved to the right hand side
+class StretchedFactorization:
+    def __init__(self, space, left, right, top, bottom):
+        import scipy.sparse
+        import scipy.sparse.linalg
+
+        self.key = PressureOperatorKey(space, left, right, top, bottom)
+        g = space.grid
+        rows = int(space.rowpts)
+        cols = int(space.colpts)
+        shape = (rows, cols)
+        east = np.broadcast_to(g.xe.astype(float), shape)
+        west = np.broadcast_to(g.xw.astype(float), shape)
+        north = np.broadcast_to(g.yn.astype(float), shape)
+        south = np.broadcast_to(g.ys.astype(float), shape)
+        a_left, b_left = GetGhostCoefficients(left, g.x_deltas[0], -1)
+        a_right, b_right = GetGhostCoefficients(right, g.x_deltas[1], 1)
+        a_top, b_top = GetGhostCoefficients(top, g.y_deltas[1], -1)
+        a_bottom, b_bottom = GetGhostCoefficients(bottom, g.y_deltas[0], 1)
+        diag = -g.diag.astype(float)
+        diag[:, 0] += a_left * west[:, 0]
+        diag[:, -1] += a_right * east[:, -1]
+        diag[-1, :] += a_top * north[-1, :]
+        diag[0, :] += a_bottom * south[0, :]
+        self.constant = np.zeros(shape)
+        self.constant[:, 0] += b_left * west[:, 0]
+        self.constant[:, -1] += b_right * east[:, -1]
+        self.constant[-1, :] += b_top * north[-1, :]
+        self.constant[0, :] += b_bottom * south[0, :]
+
+        index = np.arange(rows * cols).reshape(shape)
+        row_index = [index.ravel()]
+        col_index = [index.ravel()]
+        values = [diag.ravel()]
+        for first, second, weights in (
+            (index[:, :-1], index[:, 1:], east[:, :-1]),
+            (index[:, 1:], index[:, :-1], west[:, 1:]),
+            (index[:-1, :], index[1:, :], north[:-1, :]),
+            (index[1:, :], index[:-1, :], south[1:, :]),
+        ):
+            row_index.append(first.ravel())
+            col_index.append(second.ravel())
+            values.append(weights.ravel())
+        self.A = scipy.sparse.csc_matrix(
+            (np.concatenate(values), (np.concatenate(row_index), np.concatenate(col_index))),
+            shape=(rows * cols, rows * cols),
+        )
+        A = self.A
+        # The same pinning of the first cell as DirectFactorization when every side is Neumann
+        self.pinned = "D" not in (left.type, right.type, top.type, bottom.type)
+        if self.pinned:
+            A = A.tolil()
+            A[0, :] = 0
+            A[0, 0] = 1
+            A = A.tocsc()
+        self.lu = scipy.sparse.linalg.splu(A)
+        self.rhs = np.zeros(shape)
+        self.scratch = np.zeros(shape)
+
+
+# Direct solution of the pressure Poisson equation on a stretched grid
+def SolveStretchedPressureDirect(space, fluid, left, right, top, bottom):
+    factorization = GetCached(
+        space, "pressure_factorization", StretchedFactorization, left, right, top, bottom
+    )
+    rhs = grids.Divergence(space, factorization.rhs, factorization.scratch)
+    rhs *= float(fluid.rho) / float(space.dt)
+    rhs -= factorization.constant
+    if factorization.pinned:
+        rhs -= rhs.mean()
+    scale = np.linalg.norm(rhs)
+    if scale == 0:
+        scale = 1.0
+    residual_rhs = rhs.ravel().copy()
+    if factorization.pinned:
+        rhs.flat[0] = 0
+    solution = factorization.lu.solve(rhs.ravel())
+
+    space.p[1:-1, 1:-1] = solution.reshape(rhs.shape)
+    utils.SetPBoundary(space, left, right, top, bottom)
+    space.p_iterations = 1
+    space.p_residual = np.linalg.norm(factorization.A @ solution - residual_rhs) / scale
+
+
+# Fine grid of the SOR iteration together with its relaxation factor
+class SORGrid:
+    def __init__(self, space, left, right, top, bottom):
+        self.key = PressureOperatorKey(space, left, right, top, bottom)
+        rows = int(space.rowpts)
+        cols = int(space.colpts)
+        dx = float(space.dx)
+        dy = float(space.dy)
+        a, b = GetPressureGhosts(space, left, right, top, bottom)
+        self.grid = PressureGrid(rows, cols, dx, dy, a, b)
+        # Optimal relaxation factor 2 / (1 + sqrt(1 - rho^2)) from the spectral radius rho of the
+        # Jacobi iteration. The slowest mode in each direction depends on how many of its two sides
+        # are Dirichlet; a Neumann-Neumann direction allows a constant mode unless every side is
+        # Neumann, when the constant mode is removed by the zero-mean projection
+        mode_x = {2: np.pi / (cols + 1), 1: np.pi / (2 * cols + 1), 0: 0.0}
+        mode_y = {2: np.pi / (rows + 1), 1: np.pi / (2 * rows + 1), 0: 0.0}
+        modes = [
+            (mode_x[(left.type, right.type).count("D")], mode_y[(top.type, bottom.type).count("D")])
+        ]
+        if modes[0] == (0.0, 0.0):
+            modes = [(np.pi / cols, 0.0), (0.0, np.pi / rows)]
+        rho = max(
+            (np.cos(theta_x) / dx**2 + np.cos(theta_y) / dy**2) / (1 / dx**2 + 1 / dy**2)
+            for theta_x, theta_y in modes
+        )
+        self.omega = 2 / (1 + np.sqrt(1 - rho**2))
+
+
+# In-place red-black SOR solution of the pressure Poisson equation. omega="auto" uses the optimal
+# relaxation factor for the grid and boundary types. The residual norm relative to the right hand
+# side is checked every check_interval sweeps
+def SolvePressureSOR(
+    space,
+    fluid,
+    left,
+    right,
+    top,
+    bottom,
+    tol=1e-6,
+    omega="auto",
+    max_iterations=10000,
+    check_interval=10,
+):
+    sor = GetCached(space, "sor", SORGrid, left, right, top, bottom)
+    grid = sor.grid
+    if omega == "auto":
+        omega = sor.omega
+
+    # Start from the current pressure and the right hand side of this time step
+    grid.P[1:-1, 1:-1] = space.p[1:-1, 1:-1]
+    PressureSource(space, fluid, out=grid.f)
+    rhs = grid.EffectiveSource()
+    if "D" not in (left.type, right.type, top.type, bottom.type):
+        grid.f -= rhs.mean()
+        rhs -= rhs.mean()
+    scale = np.linalg.norm(rhs)
+    if scale == 0:
+        scale = 1.0
+
+    residual = np.linalg.norm(grid.Residual()) / scale
+    iterations = 0
+    while residual > tol and iterations < max_iterations:
+        grid.Relax(check_interval, omega)
+        iterations += check_interval
+        residual = np.linalg.norm(grid.Residual()) / scale
+    if residual > tol:
+        warnings.warn(
+            "SOR did not converge in {0} iterations: relative residual {1:.2e} > {2:.0e}".format(
+                iterations, residual, tol
+            )
+        )
+
+    space.p[1:-1, 1:-1] = grid.P[1:-1, 1:-1]
+    utils.SetPBoundary(space, left, right, top, bottom)
+    space.p_iterations = iterations
+    space.p_residual = residual
+
+
+# Pressure solvers selectable through the "poisson_solver" entry of sim_params
+SOLVERS = {
+    "jacobi": utils.SolvePressurePoisson,
+    "multigrid": SolvePressureMultigrid,
+    "direct": SolvePressureDirect,
+    "sor": SolvePressureSOR,
+}
+
+
+# Return a solver with the (space, fluid, left, right, top, bottom) signature configured from sim_params.
+# The Jacobi iteration is taken from the kernel backend if one is given
+def GetPressureSolver(sim_params, backend=None):
+    method = sim_params.get("poisson_solver", "jacobi")
+    if method not in SOLVERS:
+        raise ValueError("Unknown pressure solver: {0}".format(method))
+    if method == "jacobi" and backend is not None:
+        return backend.SolvePressurePoisson
+    options = {}
+    if method == "multigrid":
+        options["tol"] = sim_params.get("poisson_tol", 1e-6)
+        options["cycle"] = sim_params.get("multigrid_cycle", "V")
+    elif method == "sor":
+        options["tol"] = sim_params.get("poisson_tol", 1e-6)
+        options["omega"] = sim_params.get("sor_omega", "auto")
+    return functools.partial(SOLVERS[method], **options)
@@ -0,0 +1,161 @@
+import os
+import numpy as np
+
+
+# Online statistics of a run, accumulated inside the cfd.run loop instead of from written
+# snapshots. Every accepted step updates
+#   - the time-weighted running mean and variance of u, v and p at every point (Welford's update
+#     with the time-step as weight, so steps of different size count by the time they cover)
+#   - the running minimum and maximum at every point
+#   - the kinetic energy and enstrophy of the flow as time series
+# Vorticity and stream function fields are only computed when the statistics are written, for the
+# last and the mean velocity. Statistics start once the time reaches start, e.g. to leave out the
+# spin-up of the flow. Everything is written to one compressed .npz file
+STATISTICS_FILENAME = "statistics.npz"
+FIELDS = ("u", "v", "p")
+
+
+class OnlineStatistics:
+    def __init__(self, space, start=0.0):
+        self.start = start
+        self.weight = 0.0
+        self.steps = 0
+        shape = space.u.shape
+        self.mean = {name: np.zeros(shape) for name in FIELDS}
+        self.m2 = {name: np.zeros(shape) for name in FIELDS}
+        self.minimum = {name: np.full(shape, np.inf) for name in FIELDS}
+        self.maximum = {name: np.full(shape, -np.inf) for name in FIELDS}
+        self.delta = np.zeros(shape)
+        self.scratch = np.zeros(shape)
+        self.vorticity = np.zeros((int(space.rowpts), int(space.colpts)))
+        self.times = []
+        self.kinetic_energy = []
+        self.enstrophy = []
+        # Area of the cell around every interior point
+        grid = space.grid
+        if grid is None:
+            self.area = float(space.dx) * float(space.dy)
+        else:
+            self.area = np.outer(np.diff(grid.y_faces), np.diff(grid.x_faces))
+        self.laplacian = None
+
+    # Add the fields of space at time t after a step of dt
+    def Update(self, space, t, dt):
+        if t < self.start:
+            return
+        self.steps += 1
+        self.weight += dt
+        fraction = dt / self.weight
+        for name in FIELDS:
+            field = getattr(space, name)
+            mean = self.mean[name]
+            # mean += dt / W * (x - mean); M2 += dt * (x - mean_old) * (x - mean_new)
+            np.subtract(field, mean, out=self.delta)
+            np.multiply(self.delta, fraction, out=self.scratch)
+            mean += self.scratch
+            np.subtract(field, mean, out=self.scratch)
+            self.scratch *= self.delta
+            self.scratch *= dt
+            self.m2[name] += self.scratch
+            np.minimum(self.minimum[name], field, out=self.minimum[name])
+            np.maximum(self.maximum[name], field, out=self.maximum[name])
+        self.times.append(t)
+        self.kinetic_energy.append(self.KineticEnergy(space.u_c, space.v_c))
+        self.enstrophy.append(self.Enstrophy(space, space.u, space.v))
+
+    def Integral(self, values):
+        return float(np.sum(values * self.area))
+
+    def KineticEnergy(self, u_c, v_c):
+        return 0.5 * (self.Integral(u_c * u_c) + self.Integral(v_c * v_c))
+
+    def Enstrophy(self, space, u, v):
+        omega = Vorticity(space, u, v, self.vorticity)
+        return 0.5 * self.Integral(omega * omega)
+
+    # Stream function psi of the interior with laplacian(psi) = -vorticity and psi = 0 on the walls,
+    # which lie halfway between the ghost and the first interior points. The sparse factorization
+    # is made on the first call
+    def StreamFunction(self, space, omega):
+        if self.laplacian is None:
+            self.laplacian = LaplacianFactorization(space)
+        return self.laplacian.solve(-omega.ravel()).reshape(omega.shape)
+
+    # The accumulated statistics of the interior points, with the vorticity and stream function of
+    # the current and the mean velocity of space
+    def Results(self, space):
+        interior = (slice(1, -1), slice(1, -1))
+        results = {
+            "start": self.start,
+            "steps": self.steps,
+            "weight": self.weight,
+            "time": np.array(self.times),
+            "kinetic_energy": np.array(self.kinetic_energy),
+            "enstrophy": np.array(self.enstrophy),
+        }
+        for name in FIELDS:
+            results["mean_" + name] = self.mean[name][interior]
+            results["rms_" + name] = np.sqrt(self.m2[name][interior] / max(self.weight, 1e-300))
+            results["min_" + name] = self.minimum[name][interior]
+            results["max_" + name] = self.maximum[name][interior]
+        for prefix, u, v in (("", space.u, space.v), ("mean_", self.mean["u"], self.mean["v"])):
+            omega = Vorticity(space, u, v, np.zeros(self.vorticity.shape))
+            results[prefix + "vorticity"] = omega
+            results[prefix + "stream_function"] = self.StreamFunction(space, omega)
+        return results
+
+    # Write the statistics to path, replacing an earlier file in one step
+    def Write(self, space, path):
+        temporary = path + ".tmp"
+        with open(temporary, "wb") as f:
+            np.savez_compressed(f, **self.Results(space))
+        os.replace(temporary, path)
+        return path
+
+
+# Vorticity dv/dx - du/dy of the interior from the padded velocities, with the central differences
+# of the kernels, written to out
+def Vorticity(space, u, v, out):
+    rows = int(space.rowpts)
+    cols = int(space.colpts)
+    grid = space.grid
+    if grid is None:
+        ddx = 1 / (2 * float(space.dx))
+        ddy = 1 / (2 * float(space.dy))
+    else:
+        ddx = grid.ddx
+        ddy = grid.ddy
+    np.subtract(v[1 : rows + 1, 2:], v[1 : rows + 1, 0:cols], out=out)
+    out *= ddx
+    out -= (u[2:, 1 : cols + 1] - u[0:rows, 1 : cols + 1]) * ddy
+    return out
+
+
+# Sparse LU factorization of the five point Laplacian of the interior points with a zero value on
+# the walls, i.e. ghost = -neighbour
+def LaplacianFactorization(space):
+    import scipy.sparse
+    import scipy.sparse.linalg
+
+    rows = int(space.rowpts)
+    cols = int(space.colpts)
+    grid = space.grid
+    if grid is None:
+        east = west = np.full(cols, 1 / float(space.dx) ** 2)
+        north = south = np.full(rows, 1 / float(space.dy) ** 2)
+    else:
+        east = np.asarray(grid.xe, dtype=float)
+        west = np.asarray(grid.xw, dtype=float)
+        north = np.asarray(grid.yn[:, 0], dtype=float)
+        south = np.asarray(grid.ys[:, 0], dtype=float)
+
+    def Axis(up, down):
+        diagonal = -(up + down)
+        diagonal[0] -= down[0]
+        diagonal[-1] -= up[-1]
+        return scipy.sparse.diags([down[1:], diagonal, up[:-1]], [-1, 0, 1])
+
+    A = scipy.sparse.kron(scipy.sparse.identity(rows), Axis(east, west)) + scipy.sparse.kron(
+        Axis(north, south), scipy.sparse.identity(cols)
+    )
+    return scipy.sparse.linalg.splu(A.tocsc())
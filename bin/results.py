@@ -0,0 +1,221 @@
+import json
+import os
+import queue
+import threading
+import numpy as np
+import utils
+
+
+# Binary result store. A single file holds a self-describing header followed by fixed-size frames,
+# one per snapshot, so any frame can be memory-mapped without reading the rest of the file:
+#   magic (8 bytes) | header length (uint64) | JSON header padded to a multiple of 64 bytes | frames
+# Every frame is a record of the iteration, time and time-step followed by p_c, u_c and v_c
+MAGIC = b"FLOWPY\x00\x01"
+BINARY_FILENAME = "PUV.bin"
+
+
+def FrameDtype(rowpts, colpts, dtype="<f8"):
+    return np.dtype(
+        [
+            ("iteration", "<i8"),
+            ("time", "<f8"),
+            ("dt", "<f8"),
+            ("p", dtype, (rowpts, colpts)),
+            ("u", dtype, (rowpts, colpts)),
+            ("v", dtype, (rowpts, colpts)),
+        ]
+    )
+
+
+def EncodeHeader(header):
+    text = json.dumps(header, sort_keys=True).encode()
+    text += b" " * (-(len(MAGIC) + 8 + len(text)) % 64)
+    return MAGIC + np.uint64(len(text)).tobytes() + text
+
+
+# Read the header of a binary result file and return it with the offset of the first frame
+def ReadHeader(f):
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a FlowPy binary result file")
+    length = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+    header = json.loads(f.read(length).decode())
+    return header, len(MAGIC) + 8 + length
+
+
+# Appends snapshots of space.p_c, space.u_c and space.v_c to a binary result file. When a run
+# resumes from step before, frames of an existing file from that step on are dropped
+class BinaryWriter:
+    def __init__(self, path, space, metadata=None, before=None):
+        self.path = path
+        header = {
+            "rowpts": int(space.rowpts),
+            "colpts": int(space.colpts),
+            "dtype": np.dtype(space.p_c.dtype).newbyteorder("<").str,
+            "fields": ["p", "u", "v"],
+            "metadata": metadata or {},
+        }
+        self.frame_dtype = FrameDtype(header["rowpts"], header["colpts"], header["dtype"])
+        # Preallocated record that each snapshot is copied into before one bulk write
+        self.record = np.zeros(1, dtype=self.frame_dtype)
+        self.bytes_written = 0
+
+        if os.path.isfile(path) and os.path.getsize(path) > 0:
+            # Append to an existing file with the same frame layout, dropping a partially written frame
+            with open(path, "rb") as f:
+                existing, offset = ReadHeader(f)
+            layout = FrameDtype(existing["rowpts"], existing["colpts"], existing["dtype"])
+            if layout != self.frame_dtype:
+                raise ValueError("Existing result file {0} has a different layout".format(path))
+            frames = (os.path.getsize(path) - offset) // self.frame_dtype.itemsize
+            if before is not None and frames > 0:
+                iterations = np.memmap(
+                    path, dtype=self.frame_dtype, mode="r", offset=offset, shape=(frames,)
+                )["iteration"]
+                frames = int(np.searchsorted(iterations, before))
+                del iterations
+            self.file = open(path, "r+b")
+            self.file.truncate(offset + frames * self.frame_dtype.itemsize)
+            self.file.seek(0, os.SEEK_END)
+        else:
+            self.file = open(path, "wb")
+            self.file.write(EncodeHeader(header))
+            self.file.flush()
+
+    def Write(self, space, iteration, time):
+        record = self.record[0]
+        record["iteration"] = iteration
+        record["time"] = time
+        record["dt"] = space.dt
+        record["p"] = space.p_c
+        record["u"] = space.u_c
+        record["v"] = space.v_c
+        self.record.tofile(self.file)
+        self.file.flush()
+        self.bytes_written += self.frame_dtype.itemsize
+
+    def Flush(self):
+        pass
+
+    def Close(self, raise_error=True):
+        self.file.close()
+
+
+# Writes each snapshot to its own PUV{iteration}.txt file through utils.WriteToFile
+class TextWriter:
+    def __init__(self, dir_path):
+        self.dir_path = dir_path
+        self.bytes_written = 0
+
+    def Write(self, space, iteration, time):
+        utils.WriteToFile(space, iteration, 1, self.dir_path)
+        path = os.path.join(self.dir_path, "PUV{0}.txt".format(iteration))
+        self.bytes_written += os.path.getsize(path)
+
+    def Flush(self):
+        pass
+
+    def Close(self, raise_error=True):
+        pass
+
+
+# Copy of the fields of a space that the writers read, taken at the end of a time step
+class Snapshot:
+    def __init__(self, rowpts, colpts, dtype=np.float64):
+        self.rowpts = rowpts
+        self.colpts = colpts
+        self.p_c = np.zeros((rowpts, colpts), dtype=dtype)
+        self.u_c = np.zeros((rowpts, colpts), dtype=dtype)
+        self.v_c = np.zeros((rowpts, colpts), dtype=dtype)
+        self.dt = 0.0
+
+    def CopyFrom(self, space):
+        np.copyto(self.p_c, space.p_c)
+        np.copyto(self.u_c, space.u_c)
+        np.copyto(self.v_c, space.v_c)
+        self.dt = space.dt
+
+
+# Runs another writer on a background thread. Write() copies the fields into one of queue_size
+# preallocated snapshots, so the solver can carry on with the next time step while the copy is
+# serialized, and blocks when every snapshot is still waiting to be written. Flush() waits until
+# everything queued is written. Close() writes everything that is queued, joins the thread and
+# re-raises any error of the writer thread; with raise_error=False, e.g. while another exception is
+# propagating, the error is only kept in error
+class AsyncWriter:
+    def __init__(self, writer, space, queue_size=4):
+        self.writer = writer
+        self.error = None
+        self.free = queue.Queue()
+        for _ in range(queue_size):
+            self.free.put(Snapshot(int(space.rowpts), int(space.colpts), space.p_c.dtype))
+        self.pending = queue.Queue()
+        self.thread = threading.Thread(target=self.Run, daemon=True)
+        self.thread.start()
+
+    # Bytes the wrapped writer has written so far; snapshots still queued are not counted
+    @property
+    def bytes_written(self):
+        return self.writer.bytes_written
+
+    def Run(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                self.pending.task_done()
+                break
+            snapshot, iteration, time = item
+            if self.error is None:
+                try:
+                    self.writer.Write(snapshot, iteration, time)
+                except Exception as error:
+                    self.error = error
+            self.free.put(snapshot)
+            self.pending.task_done()
+
+    def Write(self, space, iteration, time):
+        if self.error is not None:
+            raise self.error
+        snapshot = self.free.get()
+        snapshot.CopyFrom(space)
+        self.pending.put((snapshot, iteration, time))
+
+    def Flush(self):
+        self.pending.join()
+        if self.error is not None:
+            raise self.error
+
+    def Close(self, raise_error=True):
+        self.pending.put(None)
+        self.thread.join()
+        self.writer.Close()
+        if raise_error and self.error is not None:
+            raise self.error
+
+
+# Create the result writer for the "output_format" of sim_params ("text" or "binary"), optionally
+# running it on a background thread. A resumed run passes the step it resumes from as before
+def CreateWriter(
+    output_format, dir_path, space, metadata=None, asynchronous=False, queue_size=4, before=None
+):
+    if output_format == "text":
+        writer = TextWriter(dir_path)
+    elif output_format == "binary":
+        writer = BinaryWriter(os.path.join(dir_path, BINARY_FILENAME), space, metadata, before)
+    else:
+        raise ValueError("Unknown output format: {0}".format(output_format))
+    if asynchronous:
+        writer = AsyncWriter(writer, space, queue_size)
+    return writer
+
+
+# Open a binary result file and return its header and a read-only memory map of its frames.
+# frames["p"][k] (and "u", "v", "iteration", "time", "dt") only reads frame k from disk
+def ReadResults(path):
+    with open(path, "rb") as f:
+        header, offset = ReadHeader(f)
+    frame_dtype = FrameDtype(header["rowpts"], header["colpts"], header["dtype"])
+    count = (os.path.getsize(path) - offset) // frame_dtype.itemsize
+    if count == 0:
+        return header, np.zeros(0, dtype=frame_dtype)
+    frames = np.memmap(path, dtype=frame_dtype, mode="r", offset=offset, shape=(count,))
+    return header, frames
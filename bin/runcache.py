@@ -0,0 +1,302 @@
+import glob
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+import checkpoint
+import reduction
+import results
+import utils
+
+
+# Content-addressed cache of finished runs. A run is identified by the SHA-256 of its canonical
+# sim_params, its boundary setup and the solver version (a hash of the solver sources), so that
+# any change to one of them is a different run. Parameters that only control output and
+# monitoring are not part of the key. The final state of a run is stored as a checkpoint in
+# cache_dir/{case}/{run}.npz next to a JSON record, where case is the key without the simulated
+# time, and the snapshots the run wrote are kept in cache_dir/{case}/{run}/. Snapshots are only
+# reused by requests with the same output settings. A request is then served as
+#   hit:     a run of the same case that ends in the same state, i.e. stopped at a steady state
+#            before the requested time, or stopped by time at or after it with the same last step
+#   resumed: the same case cached for a shorter time continues from the end state of that run
+#   miss:    the run is computed and its final state stored
+# The cache holds at most max_bytes; the least recently used runs are evicted first
+SOLVER_MODULES = (
+    "cfd",
+    "utils",
+    "backends",
+    "poisson",
+    "decomposition",
+    "grids",
+    "adi",
+    "timestepping",
+    "steady",
+    "sequencing",
+    "checkpoint",
+)
+# Parameters that do not change the computed fields
+OUTPUT_PARAMETERS = (
+    "output_dir",
+    "file_flag",
+    "interval",
+    "output_format",
+    "async_output",
+    "output_queue_size",
+    "telemetry",
+    "stream",
+    "frame_callback",
+    "stream_interval",
+    "stream_decimate",
+    "stream_queue_size",
+    "checkpoint_interval",
+    "checkpoint_dir",
+    "checkpoint_keep",
+    "cache_dir",
+    "cache_size",
+    "sequence_baseline",
+)
+RECORD_PATTERN = "*.json"
+# Snapshot files of the result writers and the online statistics in an output directory
+SNAPSHOT_PATTERNS = ("PUV*.txt", results.BINARY_FILENAME)
+STATISTICS_PATTERNS = (reduction.STATISTICS_FILENAME,)
+
+
+# Hash of the solver sources, which changes whenever the solver does
+def SolverVersion():
+    digest = hashlib.sha256()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for name in SOLVER_MODULES:
+        with open(os.path.join(directory, name + ".py"), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+# JSON form of a parameter value: numbers as floats, arrays and files by the hash of their contents
+def Canonical(value):
+    if isinstance(value, (bool, str)) or value is None:
+        return value
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return float(value)
+    if isinstance(value, np.ndarray):
+        contents = hashlib.sha256(np.ascontiguousarray(value).tobytes()).hexdigest()
+        return {"array": contents, "shape": list(value.shape), "dtype": str(value.dtype)}
+    if isinstance(value, utils.Boundary):
+        return [value.type, Canonical(value.value)]
+    if isinstance(value, dict):
+        return {str(key): Canonical(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [Canonical(item) for item in value]
+    raise TypeError("Cannot cache a run with a parameter of type {0}".format(type(value).__name__))
+
+
+def Hash(value):
+    text = json.dumps(value, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+# Case and run keys of sim_params with the given boundaries
+def Keys(sim_params, boundary_params):
+    params = {
+        key: value for key, value in sim_params.items() if key not in OUTPUT_PARAMETERS
+    }
+    # A checkpoint the run starts from counts by its contents
+    initial_state = params.get("initial_state", None)
+    if initial_state is not None:
+        with open(initial_state, "rb") as f:
+            params["initial_state"] = hashlib.sha256(f.read()).hexdigest()
+    time = Canonical(params.pop("time"))
+    case = Hash(
+        {
+            "params": Canonical(params),
+            "boundaries": Canonical(boundary_params),
+            "version": SolverVersion(),
+        }
+    )
+    return case, Hash({"case": case, "time": time})
+
+
+# Settings that decide which snapshots a run writes, or None for a run without file output
+def Outputs(sim_params):
+    if sim_params["file_flag"] != 1:
+        return None
+    return Canonical([sim_params["interval"], sim_params.get("output_format", "text")])
+
+
+def SnapshotFiles(dir_path, patterns=SNAPSHOT_PATTERNS):
+    paths = []
+    for pattern in patterns:
+        paths.extend(glob.glob(os.path.join(dir_path, pattern)))
+    return sorted(paths)
+
+
+# Replace the snapshots (or other files matching patterns) in dir_path with the ones of another
+# directory
+def CopySnapshots(source, dir_path, patterns=SNAPSHOT_PATTERNS):
+    for path in SnapshotFiles(dir_path, patterns):
+        os.remove(path)
+    for path in SnapshotFiles(source, patterns):
+        shutil.copy2(path, dir_path)
+
+
+class RunCache:
+    def __init__(self, dir_path, max_bytes=1 << 30):
+        self.dir_path = os.path.abspath(dir_path)
+        self.max_bytes = max_bytes
+        os.makedirs(self.dir_path, exist_ok=True)
+
+    def Paths(self, case, run):
+        base = os.path.join(self.dir_path, case, run)
+        return base + ".npz", base + ".json", base
+
+    # Records of the cached runs of a case
+    def Records(self, case):
+        records = []
+        for path in glob.glob(os.path.join(self.dir_path, case, RECORD_PATTERN)):
+            try:
+                with open(path) as f:
+                    records.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return records
+
+    # ("hit", record) or ("resumed", record) for a cached run that serves time, or (None, None).
+    # A request with file output (outputs) needs a run that wrote the same snapshots
+    def Find(self, case, time, outputs=None):
+        resume = None
+        for record in self.Records(case):
+            if outputs is not None and record.get("outputs") != outputs:
+                continue
+            if record["stop_reason"] == "steady state reached" and record["t"] <= time:
+                return "hit", record
+            if record["stop_reason"] == "simulation time reached":
+                if record["previous_t"] < time <= record["t"]:
+                    return "hit", record
+                if record["t"] < time and (resume is None or record["t"] > resume["t"]):
+                    resume = record
+        if resume is not None:
+            return "resumed", resume
+        return None, None
+
+    # Mark a run as used now
+    def Touch(self, record):
+        for path in self.Paths(record["case"], record["run"])[:2]:
+            os.utime(path)
+
+    # Store the final state of a run with the snapshots and statistics it wrote to output_dir, and
+    # evict the least recently used runs beyond max_bytes
+    def Store(self, case, run, space, fluid, boundary_params, previous_t, outputs, output_dir):
+        state_path, record_path, snapshot_dir = self.Paths(case, run)
+        os.makedirs(snapshot_dir, exist_ok=True)
+        CopySnapshots(output_dir, snapshot_dir)
+        CopySnapshots(output_dir, snapshot_dir, STATISTICS_PATTERNS)
+        checkpoint.WriteCheckpoint(
+            state_path, space, fluid, boundary_params, space.t, space.iteration
+        )
+        record = {
+            "case": case,
+            "run": run,
+            "t": space.t,
+            "previous_t": previous_t,
+            "iteration": space.iteration,
+            "stop_reason": space.stop_reason,
+            "outputs": outputs,
+            "statistics": bool(SnapshotFiles(snapshot_dir, STATISTICS_PATTERNS)),
+        }
+        temporary = record_path + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump(record, f)
+        os.replace(temporary, record_path)
+        self.Evict()
+        return record
+
+    # Cached runs as (last use, size, paths), least recently used first
+    def Entries(self):
+        entries = []
+        for record_path in glob.glob(os.path.join(self.dir_path, "*", RECORD_PATTERN)):
+            snapshot_dir = record_path[: -len(".json")]
+            state_path = snapshot_dir + ".npz"
+            try:
+                size = os.path.getsize(state_path) + os.path.getsize(record_path)
+                files = SnapshotFiles(snapshot_dir, SNAPSHOT_PATTERNS + STATISTICS_PATTERNS)
+                size += sum(os.path.getsize(path) for path in files)
+                used = os.path.getmtime(state_path)
+            except OSError:
+                continue
+            entries.append((used, size, (state_path, record_path, snapshot_dir)))
+        entries.sort()
+        return entries
+
+    def Evict(self):
+        entries = self.Entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, paths in entries:
+            if total <= self.max_bytes:
+                break
+            state_path, record_path, snapshot_dir = paths
+            for path in (record_path, state_path):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            shutil.rmtree(snapshot_dir, ignore_errors=True)
+            total -= size
+
+
+# Run sim_params through the cache in "cache_dir" (at most "cache_size" bytes). run is cfd.run and
+# boundary_params the boundaries it sets up. A hit or a resumed run goes through run resuming from
+# the cached state, so the returned space is set up as for any other run; space.cache tells how the
+# request was served. Both start from the snapshots of the cached run in a wiped output directory: a
+# hit computes no steps and writes nothing more, and a resumed run appends the snapshots after the
+# cached state, so that the output directory ends up as that of a computed run. Online statistics
+# cover the whole run, so a run with "statistics" is only served by a hit that stored them
+def CachedRun(run, sim_params, boundary_params):
+    params = dict(sim_params, cache_dir=None)
+    # A cached state is on the target mesh, so a run continuing from it needs no grid sequencing
+    continued = dict(params, sequence_levels=1)
+    if sim_params.get("resume", False) or sim_params.get("initial_space", None) is not None:
+        print("# Run cache: not used for a run that resumes or starts from another mesh")
+        space = run(params)
+        space.cache = None
+        return space
+    cache = RunCache(sim_params["cache_dir"], sim_params.get("cache_size", 1 << 30))
+    case, key = Keys(sim_params, boundary_params)
+    outputs = Outputs(sim_params)
+    output_dir = os.path.abspath(sim_params.get("output_dir", "results"))
+    kind, record = cache.Find(case, sim_params["time"], outputs)
+    statistics = sim_params.get("statistics", False)
+    if statistics and record is not None:
+        if kind == "resumed" or not record.get("statistics", False):
+            kind, record = None, None
+    if record is not None:
+        state_path, _, snapshot_dir = cache.Paths(record["case"], record["run"])
+        try:
+            cache.Touch(record)
+            utils.MakeResultDirectory(wipe=True, dir_path=output_dir)
+            if outputs is not None:
+                CopySnapshots(snapshot_dir, output_dir)
+            if statistics:
+                CopySnapshots(snapshot_dir, output_dir, STATISTICS_PATTERNS)
+            if kind == "hit":
+                print("# Run cache hit: {0}".format(record["run"]))
+                served = dict(
+                    continued, resume=state_path, time=record["t"], file_flag=0, statistics=False
+                )
+                space = run(served)
+                space.stop_reason = record["stop_reason"]
+                space.cache = kind
+                return space
+            print("# Run cache: resuming from t = {0:.4f}".format(record["t"]))
+            params = dict(continued, resume=state_path)
+        except FileNotFoundError:
+            # Evicted by another process in the meantime
+            kind = None
+    if kind is None:
+        print("# Run cache miss: {0}".format(key))
+    space = run(params)
+    space.cache = kind or "miss"
+    # The time of the step before the last one tells which requested times end in the same state
+    previous_t = space.t - float(space.dt)
+    fluid = utils.Fluid(sim_params["rho"], sim_params["mu"])
+    cache.Store(case, key, space, fluid, boundary_params, previous_t, outputs, output_dir)
+    return space
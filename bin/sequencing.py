@@ -0,0 +1,148 @@
+import os
+import time as clock
+import numpy as np
+import grids
+
+
+# Grid sequencing: a case is first run on coarser meshes, each to a near-steady state, and the
+# final u, v and p of every level, ghost cells included, are interpolated onto the next finer mesh
+# as its initial condition. Every level is a full cfd.run with its own time-step and steady-state
+# check; the coarse levels stop at tolerances sequence_tol_factor times looser than the target
+# mesh. Mesh k levels below the target has (n - 1) / 2**k + 1 points along an axis, so the points
+# of a uniform mesh are nested
+
+
+# Meshes of the levels, coarsest first, stopping before an axis would have fewer than min_points
+def LevelMeshes(rowpts, colpts, levels, min_points=5):
+    meshes = [(rowpts, colpts)]
+    while len(meshes) < levels:
+        rows, cols = meshes[0]
+        rows, cols = (rows - 1) // 2 + 1, (cols - 1) // 2 + 1
+        if rows < min_points or cols < min_points:
+            break
+        meshes.insert(0, (rows, cols))
+    return meshes
+
+
+# Coordinates of the points of a space along x and y, ghost points included
+def PaddedPoints(space):
+    if space.grid is not None:
+        return grids.PaddedCentres(space.grid.x_faces), grids.PaddedCentres(space.grid.y_faces)
+    x = (np.arange(int(space.colpts) + 2) - 1) * float(space.dx)
+    y = (np.arange(int(space.rowpts) + 2) - 1) * float(space.dy)
+    return x, y
+
+
+# Linear interpolation from the points coarse to the points fine as a (fine, coarse) matrix. Fine
+# points beyond the coarse ones take the nearest coarse value
+def InterpolationMatrix(fine, coarse):
+    k = np.clip(np.searchsorted(coarse, fine) - 1, 0, len(coarse) - 2)
+    weight = np.clip((fine - coarse[k]) / (coarse[k + 1] - coarse[k]), 0, 1)
+    matrix = np.zeros((len(fine), len(coarse)))
+    points = np.arange(len(fine))
+    matrix[points, k] = 1 - weight
+    matrix[points, k + 1] = weight
+    return matrix
+
+
+# Fields of the coarse space interpolated onto the fine space, in the (header, fields) form of
+# checkpoint.ReadCheckpoint. cfd.run restores them into its mesh when given an "initial_space"
+def ProlongState(coarse, fine):
+    x_coarse, y_coarse = PaddedPoints(coarse)
+    x_fine, y_fine = PaddedPoints(fine)
+    along_x = InterpolationMatrix(x_fine, x_coarse).T
+    along_y = InterpolationMatrix(y_fine, y_coarse)
+    fields = {name: along_y @ getattr(coarse, name) @ along_x for name in ("u", "v", "p")}
+    header = {"dt": float(coarse.dt), "S_x": float(coarse.S_x), "S_y": float(coarse.S_y)}
+    return header, fields
+
+
+def LevelReport(level, space, wall_time):
+    return {
+        "level": level,
+        "rowpts": int(space.rowpts),
+        "colpts": int(space.colpts),
+        "steps": space.iteration,
+        "time": space.t,
+        "wall_time": wall_time,
+        "stop_reason": space.stop_reason,
+    }
+
+
+# Run sim_params with grid sequencing over its "sequence_levels" levels. run is cfd.run; the coarse
+# levels write to output_dir/level{k} without result files or checkpoints. With "sequence_baseline"
+# the target mesh is also run from rest to measure the cost saved. The final space of the target
+# mesh is returned, with the reports of all levels in space.levels
+def RunSequence(run, sim_params):
+    if sim_params.get("obstacle", None) is not None:
+        raise ValueError("Grid sequencing does not support obstacles")
+    if sim_params.get("resume", False) or sim_params.get("initial_state", None) is not None:
+        raise ValueError("Grid sequencing starts from rest")
+    output_dir = os.path.abspath(sim_params.get("output_dir", "results"))
+    meshes = LevelMeshes(
+        sim_params["rowpts"], sim_params["colpts"], sim_params.get("sequence_levels", 2)
+    )
+    params = dict(sim_params, sequence_levels=1, steady_state=True)
+    # Only the target mesh writes results
+    quiet = dict(
+        file_flag=0, checkpoint_interval=0, stream=None, frame_callback=None, statistics=False
+    )
+    # Near-steady state on the coarse levels
+    factor = sim_params.get("sequence_tol_factor", 10)
+    p_tol = params.get("steady_p_tol", 1e-4)
+    coarse_params = dict(
+        params,
+        steady_u_tol=params.get("steady_u_tol", 1e-5) * factor,
+        steady_p_tol=None if p_tol is None else p_tol * factor,
+        **quiet,
+    )
+
+    levels = []
+    space = None
+    for level, (rows, cols) in enumerate(meshes[:-1]):
+        level_dir = os.path.join(output_dir, "level{0}".format(level))
+        start = clock.perf_counter()
+        space = run(
+            dict(
+                coarse_params,
+                rowpts=rows,
+                colpts=cols,
+                output_dir=level_dir,
+                initial_space=space,
+            )
+        )
+        levels.append(LevelReport(level, space, clock.perf_counter() - start))
+    start = clock.perf_counter()
+    space = run(dict(params, initial_space=space))
+    levels.append(LevelReport(len(meshes) - 1, space, clock.perf_counter() - start))
+    total = sum(report["wall_time"] for report in levels)
+
+    baseline = None
+    if sim_params.get("sequence_baseline", False):
+        start = clock.perf_counter()
+        baseline_dir = os.path.join(output_dir, "baseline")
+        rest = run(dict(params, output_dir=baseline_dir, **quiet))
+        baseline = LevelReport(None, rest, clock.perf_counter() - start)
+
+    print("\n######## Grid sequencing ########")
+    for report in levels:
+        print(
+            "# Level {level}: {colpts} x {rowpts}, {steps} steps to t = {time:.3f} in "
+            "{wall_time:.2f} s, {stop_reason}".format(**report)
+        )
+    print("# Total: {0:.2f} s".format(total))
+    if baseline is not None:
+        print(
+            "# From rest: {steps} steps to t = {time:.3f} in {wall_time:.2f} s, "
+            "{stop_reason}".format(**baseline)
+        )
+        print(
+            "# Saved: {0:.2f} s ({1:.0%}), {2} steps on the target mesh".format(
+                baseline["wall_time"] - total,
+                1 - total / baseline["wall_time"],
+                baseline["steps"] - levels[-1]["steps"],
+            )
+        )
+    space.levels = levels
+    space.baseline = baseline
+    return space
@@ -0,0 +1,76 @@
+import numpy as np
+
+
+# Steady-state detection. Every check compares the interior fields with a copy taken at the previous
+# check and divides the largest change by the time in between, giving the rate of change of u, v and
+# p per unit time. Together with the largest continuity residual du/dx + dv/dy of the current
+# velocity these are compared with the tolerances; a tolerance of None is reported but not required
+class SteadyStateMonitor:
+    def __init__(self, space, u_tol=1e-5, p_tol=1e-4, continuity_tol=None):
+        self.u_tol = u_tol
+        self.p_tol = p_tol
+        self.continuity_tol = continuity_tol
+        shape = (int(space.rowpts), int(space.colpts))
+        self.u_old = np.zeros(shape)
+        self.v_old = np.zeros(shape)
+        self.p_old = np.zeros(shape)
+        self.t_old = None
+        self.u_rate = np.inf
+        self.p_rate = np.inf
+        self.continuity = np.inf
+
+    # Largest change of field since the last check, divided by the elapsed time
+    def Rate(self, field, old, elapsed, scratch):
+        np.subtract(field, old, out=scratch)
+        np.abs(scratch, out=scratch)
+        return float(np.amax(scratch)) / elapsed
+
+    # Largest |du/dx + dv/dy| over the interior, with the central differences of the kernels (with
+    # the spacing of every row and column on a stretched grid)
+    def Continuity(self, space):
+        rows = int(space.rowpts)
+        cols = int(space.colpts)
+        w = space.workspace
+        grid = getattr(space, "grid", None)
+        if grid is None:
+            ddx = 1 / (2 * float(space.dx))
+            ddy = 1 / (2 * float(space.dy))
+        else:
+            ddx = grid.ddx
+            ddy = grid.ddy
+        np.subtract(space.u[1 : rows + 1, 2:], space.u[1 : rows + 1, 0:cols], out=w.t1)
+        w.t1 *= ddx
+        np.subtract(space.v[2:, 1 : cols + 1], space.v[0:rows, 1 : cols + 1], out=w.t2)
+        w.t2 *= ddy
+        w.t1 += w.t2
+        np.abs(w.t1, out=w.t1)
+        return float(np.amax(w.t1))
+
+    # Update the norms at time t and return True once every tolerance is met. The first check only
+    # stores the fields
+    def Check(self, space, t):
+        steady = False
+        if self.t_old is not None and t > self.t_old:
+            elapsed = t - self.t_old
+            scratch = space.workspace.t1
+            self.u_rate = max(
+                self.Rate(space.u_c, self.u_old, elapsed, scratch),
+                self.Rate(space.v_c, self.v_old, elapsed, scratch),
+            )
+            self.p_rate = self.Rate(space.p_c, self.p_old, elapsed, scratch)
+            self.continuity = self.Continuity(space)
+            steady = (
+                self.u_rate < self.u_tol
+                and (self.p_tol is None or self.p_rate < self.p_tol)
+                and (self.continuity_tol is None or self.continuity < self.continuity_tol)
+            )
+        np.copyto(self.u_old, space.u_c)
+        np.copyto(self.v_old, space.v_c)
+        np.copyto(self.p_old, space.p_c)
+        self.t_old = t
+        return steady
+
+    def Report(self):
+        return "du/dt: {0:.3e}\tdp/dt: {1:.3e}\tcontinuity: {2:.3e}".format(
+            self.u_rate, self.p_rate, self.continuity
+        )
@@ -0,0 +1,107 @@
+import queue
+import threading
+import numpy as np
+
+
+# Live streaming of solver frames. cfd.run publishes a decimated copy of p_c, u_c and v_c to a
+# FrameStream every interval steps. The stream is a bounded queue that never blocks the solver:
+# when the consumer falls behind, the oldest queued frame is dropped to make room for the newest.
+# A consumer iterates over the stream in another thread, or in another process when the stream is
+# given a multiprocessing queue, until the run ends
+
+
+# Decimated fields of one time step. x and y are the coordinates of the decimated points, the cell
+# centres of a stretched grid; dx and dy are their spacing, the mean one on a stretched grid
+class Frame:
+    def __init__(self, space, iteration, time, decimate):
+        cut = (slice(None, None, decimate), slice(None, None, decimate))
+        self.iteration = iteration
+        self.time = time
+        self.dt = float(space.dt)
+        grid = getattr(space, "grid", None)
+        if grid is None:
+            self.dx = float(space.dx) * decimate
+            self.dy = float(space.dy) * decimate
+            self.x = np.arange(0, int(space.colpts), decimate) * float(space.dx)
+            self.y = np.arange(0, int(space.rowpts), decimate) * float(space.dy)
+        else:
+            self.x = np.array(grid.x[::decimate])
+            self.y = np.array(grid.y[::decimate])
+            self.dx = float(np.mean(np.diff(self.x))) if self.x.size > 1 else float(space.dx)
+            self.dy = float(np.mean(np.diff(self.y))) if self.y.size > 1 else float(space.dy)
+        self.p = np.array(space.p_c[cut])
+        self.u = np.array(space.u_c[cut])
+        self.v = np.array(space.v_c[cut])
+
+
+class FrameStream:
+    def __init__(self, interval=10, decimate=1, maxsize=2, frame_queue=None):
+        self.interval = interval
+        self.decimate = decimate
+        self.queue = frame_queue if frame_queue is not None else queue.Queue(maxsize)
+        self.published = 0
+        self.dropped = 0
+
+    # Put an item without blocking, dropping the oldest queued item while the queue is full
+    def Put(self, item):
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    # Called by the solver after every step
+    def Publish(self, space, iteration, time):
+        if iteration % self.interval == 0:
+            self.Put(Frame(space, iteration, time, self.decimate))
+            self.published += 1
+
+    # Mark the end of the run
+    def Close(self):
+        self.Put(None)
+
+    def __iter__(self):
+        while True:
+            frame = self.queue.get()
+            if frame is None:
+                return
+            yield frame
+
+
+# Call callback with every frame of stream on a background thread and return the thread
+def StartConsumer(stream, callback):
+    def Consume():
+        for frame in stream:
+            callback(frame)
+
+    thread = threading.Thread(target=Consume, daemon=True)
+    thread.start()
+    return thread
+
+
+# Run cfd.run on a background thread and yield its frames as they arrive. Errors of the run are
+# raised once the stream ends
+def Stream(sim_params, interval=10, decimate=1, maxsize=2):
+    import cfd
+
+    stream = FrameStream(interval, decimate, maxsize)
+    errors = []
+
+    def Run():
+        try:
+            cfd.run(dict(sim_params, stream=stream))
+        except BaseException as error:
+            errors.append(error)
+            stream.Close()
+
+    thread = threading.Thread(target=Run, daemon=True)
+    thread.start()
+    yield from stream
+    thread.join()
+    if errors:
+        raise errors[0]
@@ -0,0 +1,109 @@
+import concurrent.futures
+import contextlib
+import csv
+import itertools
+import json
+import os
+import time as clock
+import traceback
+import numpy as np
+import cfd
+
+
+# Parameter sweeps: every combination of the values in a parameter grid is run as a separate
+# cfd.run case on a process pool. Each case gets its own directory with its console log and a
+# results directory. A manifest of the wall time, step count, final state and status of every
+# case is written as JSON and CSV. A case that raises or diverges is recorded as such without
+# stopping the others
+
+
+# Expand a grid such as {"mu": [0.01, 0.02], "u_in": [1, 2]} into a list of parameter overrides
+def ExpandGrid(grid):
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[n] for n in names))]
+
+
+# Run one case in a worker process and return its manifest entry
+def RunCase(case, sim_params, case_dir):
+    entry = {"case": case, "output_dir": case_dir}
+    os.makedirs(case_dir, exist_ok=True)
+    start = clock.perf_counter()
+    try:
+        with open(os.path.join(case_dir, "log.txt"), "w") as log:
+            with contextlib.redirect_stdout(log):
+                results_dir = os.path.join(case_dir, "results")
+                space = cfd.run(dict(sim_params, output_dir=results_dir))
+        entry["steps"] = space.iteration
+        entry["final_time"] = space.t
+        entry["stop_reason"] = space.stop_reason
+        entry["dt"] = float(space.dt)
+        entry["max_u"] = float(np.amax(np.abs(space.u_c)))
+        entry["max_v"] = float(np.amax(np.abs(space.v_c)))
+        entry["max_p"] = float(np.amax(np.abs(space.p_c)))
+        finite = all(np.all(np.isfinite(field)) for field in (space.u, space.v, space.p))
+        entry["status"] = "completed" if finite else "diverged"
+    except Exception as error:
+        entry["status"] = "failed"
+        entry["error"] = "{0}: {1}".format(type(error).__name__, error)
+        with open(os.path.join(case_dir, "error.txt"), "w") as f:
+            f.write(traceback.format_exc())
+    entry["wall_time"] = clock.perf_counter() - start
+    return entry
+
+
+def WriteManifest(output_dir, entries):
+    with open(os.path.join(output_dir, "manifest.json"), "w") as f:
+        json.dump(entries, f, indent=2)
+    fields = []
+    for entry in entries:
+        fields += [key for key in entry if key not in fields]
+    with open(os.path.join(output_dir, "manifest.csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(entries)
+
+
+# Run sim_params for every combination of the parameter grid with up to workers processes
+# (all cores by default). Case k writes to output_dir/case{k:03d}; the manifest is returned and
+# written to output_dir/manifest.json and output_dir/manifest.csv
+def run(sim_params, grid, workers=None, output_dir="sweep"):
+    output_dir = os.path.abspath(output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    overrides = ExpandGrid(grid)
+
+    print("######## Beginning FlowPy Sweep ########")
+    print("########################################")
+    print("# Cases: {0}".format(len(overrides)))
+    print("# Workers: {0}".format(workers or os.cpu_count()))
+    print("# Output directory: {0}".format(output_dir))
+
+    entries = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for case, override in enumerate(overrides):
+            case_dir = os.path.join(output_dir, "case{0:03d}".format(case))
+            future = pool.submit(RunCase, case, dict(sim_params, **override), case_dir)
+            futures[future] = (case, override, case_dir)
+        for future in concurrent.futures.as_completed(futures):
+            case, override, case_dir = futures[future]
+            try:
+                entry = future.result()
+            except Exception as error:
+                # The worker process itself died
+                entry = {
+                    "case": case,
+                    "output_dir": case_dir,
+                    "status": "failed",
+                    "error": "{0}: {1}".format(type(error).__name__, error),
+                }
+            entry.update(override)
+            entries.append(entry)
+            print(
+                "# Case {0} {1}: {2} ({3}/{4})".format(
+                    case, override, entry["status"], len(entries), len(overrides)
+                )
+            )
+
+    entries.sort(key=lambda entry: entry["case"])
+    WriteManifest(output_dir, entries)
+    return entries
@@ -0,0 +1,169 @@
+import csv
+import json
+import time as clock
+
+
+# Solver telemetry. A profiler times the phases of every time step of cfd.run and emits one record
+# per step with the phase timings, the Poisson iterations and final change, dt and the bytes the
+# result writer has written, to any number of sinks. When telemetry is off, cfd.run uses a
+# NullProfiler whose methods do nothing
+PHASES = ("boundaries", "predictor", "pressure", "corrector", "output")
+
+
+# Keeps every record in memory
+class MemorySink:
+    def __init__(self):
+        self.records = []
+
+    def Write(self, record):
+        self.records.append(record)
+
+    def Close(self):
+        pass
+
+
+class CSVSink:
+    def __init__(self, path):
+        self.file = open(path, "w", newline="")
+        self.writer = None
+
+    def Write(self, record):
+        if self.writer is None:
+            self.writer = csv.DictWriter(self.file, fieldnames=list(record))
+            self.writer.writeheader()
+        self.writer.writerow(record)
+
+    def Close(self):
+        self.file.close()
+
+
+# One JSON object per line
+class JSONLSink:
+    def __init__(self, path):
+        self.file = open(path, "w")
+
+    def Write(self, record):
+        self.file.write(json.dumps(record) + "\n")
+
+    def Close(self):
+        self.file.close()
+
+
+# Passes every record to a function, e.g. to update a progress display
+class CallbackSink:
+    def __init__(self, callback):
+        self.callback = callback
+
+    def Write(self, record):
+        self.callback(record)
+
+    def Close(self):
+        pass
+
+
+class NullProfiler:
+    enabled = False
+
+    def Start(self):
+        pass
+
+    def Mark(self, phase):
+        pass
+
+    def EndStep(self, space, iteration, time, bytes_written):
+        pass
+
+    def Close(self):
+        pass
+
+
+class Profiler:
+    enabled = True
+
+    def __init__(self, sinks):
+        self.sinks = sinks
+        self.totals = dict.fromkeys(PHASES, 0.0)
+        self.steps = 0
+        self.p_iterations = 0
+        self.max_p_iterations = 0
+        self.bytes_written = 0
+        self.started = clock.perf_counter()
+
+    # Start timing a step
+    def Start(self):
+        self.record = dict.fromkeys(PHASES, 0.0)
+        self.last = clock.perf_counter()
+
+    # Add the time since the previous mark to phase
+    def Mark(self, phase):
+        now = clock.perf_counter()
+        self.record[phase] += now - self.last
+        self.last = now
+
+    def EndStep(self, space, iteration, time, bytes_written):
+        record = {"step": iteration, "time": time, "dt": float(space.dt)}
+        record.update(self.record)
+        record["total"] = sum(self.record.values())
+        record["p_iterations"] = int(getattr(space, "p_iterations", 0))
+        record["p_residual"] = float(getattr(space, "p_residual", 0.0))
+        record["bytes_written"] = bytes_written - self.bytes_written
+        for phase in PHASES:
+            self.totals[phase] += self.record[phase]
+        self.steps += 1
+        self.p_iterations += record["p_iterations"]
+        self.max_p_iterations = max(self.max_p_iterations, record["p_iterations"])
+        self.bytes_written = bytes_written
+        for sink in self.sinks:
+            sink.Write(record)
+
+    def Summary(self):
+        wall = clock.perf_counter() - self.started
+        total = sum(self.totals.values())
+        steps = max(self.steps, 1)
+        lines = ["# Telemetry over {0} steps, {1:.2f} s wall time".format(self.steps, wall)]
+        lines.append("# Phase\t\tTime [s]\tPer step [ms]\tShare")
+        for phase in PHASES:
+            lines.append(
+                "# {0:<12}\t{1:.3f}\t\t{2:.3f}\t\t{3:.1%}".format(
+                    phase,
+                    self.totals[phase],
+                    1000 * self.totals[phase] / steps,
+                    self.totals[phase] / total if total > 0 else 0,
+                )
+            )
+        lines.append(
+            "# Poisson iterations: {0:.1f} per step, {1} at most".format(
+                self.p_iterations / steps, self.max_p_iterations
+            )
+        )
+        lines.append("# Bytes written: {0}".format(self.bytes_written))
+        return "\n".join(lines)
+
+    def Close(self):
+        for sink in self.sinks:
+            sink.Close()
+
+
+# Create the profiler for the "telemetry" entry of sim_params: False or None for none, True for an
+# in-memory record, a .csv or .jsonl path, a callback, a sink or a list of sinks
+def CreateProfiler(telemetry):
+    if telemetry is None or telemetry is False:
+        return NullProfiler()
+    if telemetry is True:
+        sinks = [MemorySink()]
+    elif isinstance(telemetry, str):
+        if telemetry.endswith(".csv"):
+            sinks = [CSVSink(telemetry)]
+        elif telemetry.endswith(".jsonl"):
+            sinks = [JSONLSink(telemetry)]
+        else:
+            raise ValueError("Telemetry files must end in .csv or .jsonl: {0}".format(telemetry))
+    elif isinstance(telemetry, (list, tuple)):
+        sinks = list(telemetry)
+    elif hasattr(telemetry, "Write"):
+        sinks = [telemetry]
+    elif callable(telemetry):
+        sinks = [CallbackSink(telemetry)]
+    else:
+        raise ValueError("Unknown telemetry sink: {0!r}".format(telemetry))
+    return Profiler(sinks)
@@ -0,0 +1,106 @@
+import numpy as np
+
+
+def MaxAbs(field):
+    return float(max(np.amax(field), -np.amin(field)))
+
+
+# Adaptive time-step control. The step is the smallest of the convective limit on |u| and |v| and the
+# diffusive limits of the explicit scheme with nu = mu / rho. It may grow by at most a factor growth per
+# step and is kept within [dt_min, dt_max]. After each step the controller checks the velocity field:
+# a step that produces a non-finite value or multiplies the kinetic energy (ghost cells included, so
+# the lid counts from the first step) by more than energy_growth is rejected, the fields are restored
+# and the step is retried with the time-step multiplied by shrink. With diffusion=False the viscous
+# term is implicit and the explicit diffusion limit is left out
+class TimeStepController:
+    def __init__(
+        self,
+        space,
+        CFL,
+        diffusion_number=0.8,
+        growth=1.1,
+        shrink=0.5,
+        dt_min=0.0,
+        dt_max=np.inf,
+        energy_growth=2.0,
+        max_retries=10,
+        diffusion=True,
+    ):
+        self.CFL = CFL
+        self.diffusion_number = diffusion_number
+        self.growth = growth
+        self.shrink = shrink
+        self.dt_min = dt_min
+        self.dt_max = dt_max
+        self.energy_growth = energy_growth
+        self.max_retries = max_retries
+        self.diffusion = diffusion
+        self.u_old = np.zeros_like(space.u)
+        self.v_old = np.zeros_like(space.v)
+        self.p_old = np.zeros_like(space.p)
+        self.energy = 0.0
+        self.dt = None
+        self.retries = 0
+        self.rejected = 0
+
+    # Largest stable time-step of the current fields
+    def Limit(self, space, fluid):
+        dx = float(space.dx)
+        dy = float(space.dy)
+        u_max = MaxAbs(space.u)
+        v_max = MaxAbs(space.v)
+        nu = float(fluid.mu) / float(fluid.rho)
+        limit = np.inf
+        if u_max > 0 or v_max > 0:
+            limit = self.CFL / (u_max / dx + v_max / dy)
+        if nu > 0:
+            # Explicit diffusion, and central advection with explicit diffusion (dt < 2 nu / |u|^2)
+            # on the interior velocities, as the ghost cells of a wall hold twice its velocity
+            if self.diffusion:
+                limit = min(limit, self.diffusion_number / (2 * nu * (1 / dx**2 + 1 / dy**2)))
+            speed = MaxAbs(space.u[1:-1, 1:-1]) ** 2 + MaxAbs(space.v[1:-1, 1:-1]) ** 2
+            if speed > 0:
+                limit = min(limit, self.diffusion_number * 2 * nu / speed)
+        if np.isinf(limit):
+            # Escape condition if the fluid is at rest and inviscid
+            limit = self.CFL * (dx + dy)
+        return limit
+
+    # Set space.dt for the next attempt of a step. A retried step does not grow the time-step
+    def SetTimeStep(self, space, fluid):
+        dt = self.Limit(space, fluid)
+        if self.dt is not None:
+            dt = min(dt, self.dt if self.retries else self.growth * self.dt)
+        dt = min(max(dt, self.dt_min), self.dt_max)
+        self.dt = dt
+        space.dt = dt
+
+    # Keep the fields at the start of a step (after the boundary conditions are applied)
+    def Save(self, space):
+        np.copyto(self.u_old, space.u)
+        np.copyto(self.v_old, space.v)
+        np.copyto(self.p_old, space.p)
+        self.energy = self.KineticEnergy(space)
+
+    def KineticEnergy(self, space):
+        return 0.5 * (np.vdot(space.u, space.u) + np.vdot(space.v, space.v))
+
+    # Accept the step, or restore the fields and shrink the time-step for a retry
+    def Accept(self, space):
+        energy = self.KineticEnergy(space)
+        if np.isfinite(energy) and energy <= self.energy_growth * self.energy:
+            self.retries = 0
+            return True
+        self.retries += 1
+        self.rejected += 1
+        if self.retries > self.max_retries or self.dt <= self.dt_min:
+            raise RuntimeError(
+                "Time-step rejected {0} times, the solution diverges at dt = {1:.3e}".format(
+                    self.retries, self.dt
+                )
+            )
+        np.copyto(space.u, self.u_old)
+        np.copyto(space.v, self.v_old)
+        np.copyto(space.p, self.p_old)
+        self.dt *= self.shrink
+        return False
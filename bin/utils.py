@@ -1,5 +1,7 @@
+import glob
 import numpy as np
 import os
+import grids
 
 
 class Boundary:
@@ -11,33 +13,65 @@ class Boundary:
         self.value = boundary_value
 
 
+# Preallocated scratch arrays reused by the kernels every time step. The change of the pressure
+# iteration is reduced in residual_dtype, which may be wider than the fields
+class Workspace:
+    def __init__(self, rowpts, colpts, batch=(), dtype=np.float64, residual_dtype=None):
+        # Interior sized scratch arrays for the stencil terms
+        self.t1 = np.zeros(batch + (rowpts, colpts), dtype=dtype)
+        self.t2 = np.zeros(batch + (rowpts, colpts), dtype=dtype)
+        self.t3 = np.zeros(batch + (rowpts, colpts), dtype=dtype)
+        self.t4 = np.zeros(batch + (rowpts, colpts), dtype=dtype)
+        # Full sized scratch arrays for the pressure iteration
+        self.p_old = np.zeros(batch + (rowpts + 2, colpts + 2), dtype=dtype)
+        self.p_diff = np.zeros(batch + (rowpts + 2, colpts + 2), dtype=residual_dtype or dtype)
+
+
 class Space:
     def __init__(self):
         pass
 
-    def CreateMesh(self, rowpts, colpts):
+    # With cases given, every field gets a leading dimension of that size so that the kernels
+    # advance that many independent cases on the same mesh at once. dtype sets the precision of the
+    # fields and scratch arrays (e.g. "float32"), residual_dtype that of the pressure convergence check
+    def CreateMesh(self, rowpts, colpts, cases=None, dtype="float64", residual_dtype=None):
         # Domain gridpoints
         self.rowpts = rowpts
         self.colpts = colpts
+        self.batch = () if cases is None else (cases,)
+        self.dtype = np.dtype(dtype)
         # Velocity matrices
-        self.u = np.zeros((self.rowpts + 2, self.colpts + 2))
-        self.v = np.zeros((self.rowpts + 2, self.colpts + 2))
-        self.u_star = np.zeros((self.rowpts + 2, self.colpts + 2))
-        self.v_star = np.zeros((self.rowpts + 2, self.colpts + 2))
-        self.u_next = np.zeros((self.rowpts + 2, self.colpts + 2))
-        self.v_next = np.zeros((self.rowpts + 2, self.colpts + 2))
-        self.u_c = np.zeros((self.rowpts, self.colpts))
-        self.v_c = np.zeros((self.rowpts, self.colpts))
+        self.u = np.zeros(self.batch + (self.rowpts + 2, self.colpts + 2), dtype=self.dtype)
+        self.v = np.zeros(self.batch + (self.rowpts + 2, self.colpts + 2), dtype=self.dtype)
+        self.u_star = np.zeros(self.batch + (self.rowpts + 2, self.colpts + 2), dtype=self.dtype)
+        self.v_star = np.zeros(self.batch + (self.rowpts + 2, self.colpts + 2), dtype=self.dtype)
+        self.u_c = np.zeros(self.batch + (self.rowpts, self.colpts), dtype=self.dtype)
+        self.v_c = np.zeros(self.batch + (self.rowpts, self.colpts), dtype=self.dtype)
         # Pressure matrices
-        self.p = np.zeros((self.rowpts + 2, self.colpts + 2))
-        self.p_c = np.zeros((self.rowpts, self.colpts))
+        self.p = np.zeros(self.batch + (self.rowpts + 2, self.colpts + 2), dtype=self.dtype)
+        self.p_c = np.zeros(self.batch + (self.rowpts, self.colpts), dtype=self.dtype)
+
+        # Scratch arrays for the kernels
+        self.workspace = Workspace(self.rowpts, self.colpts, self.batch, self.dtype, residual_dtype)
 
-        # Set default source term
+        # Set default source term and no obstacle
         self.SetSourceTerm()
+        self.SetObstacle()
+        self.grid = None
 
     def SetDeltas(self, breadth, length):
         self.dx = length / (self.colpts - 1)
         self.dy = breadth / (self.rowpts - 1)
+        self.grid = None
+
+    # Stretched mesh given by the cell faces along x (colpts + 1 values) and y (rowpts + 1 values),
+    # e.g. from grids.Faces. dx and dy are then the smallest distances between points
+    def SetGrid(self, x_faces, y_faces):
+        if len(x_faces) != self.colpts + 1 or len(y_faces) != self.rowpts + 1:
+            raise ValueError("A grid needs colpts + 1 faces along x and rowpts + 1 along y")
+        self.grid = grids.StretchedGrid(x_faces, y_faces, self.dtype)
+        self.dx = self.grid.dx
+        self.dy = self.grid.dy
 
     def SetInitialU(self, U):
         self.u = U * self.u
@@ -52,6 +86,24 @@ class Space:
         self.S_x = S_x
         self.S_y = S_y
 
+    # Solid cells inside the domain, given as a boolean mask of the interior points. They are kept
+    # as the flat indices of the padded fields
+    def SetObstacle(self, mask=None):
+        if mask is None:
+            self.obstacle = None
+            self.obstacle_cells = np.zeros(0, dtype=np.intp)
+            return
+        mask = np.asarray(mask, dtype=bool)
+        if mask.shape != (self.rowpts, self.colpts):
+            raise ValueError(
+                "The obstacle mask must have the shape {0}".format((self.rowpts, self.colpts))
+            )
+        self.obstacle = mask
+        index = np.arange((self.rowpts + 2) * (self.colpts + 2)).reshape(
+            self.rowpts + 2, self.colpts + 2
+        )
+        self.obstacle_cells = index[1:-1, 1:-1][mask]
+
 
 class Fluid:
     def __init__(self, rho, mu):
@@ -62,159 +114,349 @@ class Fluid:
         self.mu = mu
 
 
-# Note: The arguments to the function are all objects of our defined classes
-# Set boundary conditions for horizontal velocity
-def SetUBoundary(space, left, right, top, bottom):
-    if left.type == "D":
-        space.u[:, 0] = left.value
-    elif left.type == "N":
-        space.u[:, 0] = -left.value * space.dx + space.u[:, 1]
+# Boundary conditions are compiled once into a BoundaryPlan and then applied without looking at the
+# boundary types again. Each side of a field sets its ghost cells either to a constant or to
+# coefficient * (interior neighbour) + constant: a Neumann value as a difference over the spacing,
+# a Dirichlet value at the ghost cell ("point") or halfway between the ghost cell and its
+# neighbour ("face"). A side is one slice of ghost cells, so it is applied in one vectorized pass
+SIDES = ("left", "right", "top", "bottom")
+DIRICHLET = {
+    "u": ("point", "point", "face", "face"),
+    "v": ("face", "face", "point", "point"),
+    "p": ("point", "point", "point", "point"),
+}
+
+
+# Everything a plan depends on apart from the mesh and the obstacle. Array values (one value per
+# case or per ghost cell) are identified by the array, which the plan keeps alive
+def BoundaryKey(boundaries):
+    return tuple(
+        (b.type, id(b.value) if isinstance(b.value, np.ndarray) else b.value) for b in boundaries
+    )
+
+
+# View of a field with the mesh flattened into its last axis
+def FlatView(field):
+    flat = field.view()
+    flat.shape = field.shape[:-2] + (-1,)
+    return flat
+
+
+# Cells of irregular geometry, set in one pass from flat index lists: every target gets the sum of
+# its sources weighted by coefficients. All sources are read before any target is written.
+# entries maps a target to its (sources, coefficients)
+class PlanStage:
+    def __init__(self, entries, dtype):
+        width = max([len(sources) for sources, _ in entries.values()], default=0)
+        self.targets = np.array(list(entries), dtype=np.intp)
+        # Terms beyond the number of sources of a target read the target with a zero weight
+        self.sources = (
+            np.array(
+                [s + (t,) * (width - len(s)) for t, (s, _) in entries.items()], dtype=np.intp
+            )
+            .reshape(len(entries), width)
+            .T
+        )
+        self.coefficients = (
+            np.array([c + (0,) * (width - len(c)) for _, c in entries.values()], dtype=dtype)
+            .reshape(len(entries), width)
+            .T
+        )
 
-    if right.type == "D":
-        space.u[:, -1] = right.value
-    elif right.type == "N":
-        space.u[:, -1] = right.value * space.dx + space.u[:, -2]
+    def Apply(self, field):
+        if self.targets.size == 0:
+            return
+        flat = FlatView(field)
+        if len(self.sources) == 0:
+            flat[..., self.targets] = 0
+            return
+        values = flat[..., self.sources[0]] * self.coefficients[0]
+        for sources, coefficients in zip(self.sources[1:], self.coefficients[1:]):
+            values += flat[..., sources] * coefficients
+        flat[..., self.targets] = values
+
+
+# Entries of the obstacle stage: the velocities of solid cells are zero, and the pressure of a
+# solid cell next to the fluid is the mean of its fluid neighbours, so there is no pressure
+# gradient into the obstacle
+def ObstacleEntries(field, obstacle):
+    rows, cols = obstacle.shape
+    index = np.arange((rows + 2) * (cols + 2)).reshape(rows + 2, cols + 2)
+    if field != "p":
+        return {int(cell): ((), ()) for cell in index[1:-1, 1:-1][obstacle]}
+    fluid = np.pad(~obstacle, 1, constant_values=False)
+    entries = {}
+    for i, j in zip(*np.nonzero(obstacle)):
+        sources = tuple(
+            int(index[i + 1 + di, j + 1 + dj])
+            for di, dj in ((0, 1), (0, -1), (1, 0), (-1, 0))
+            if fluid[i + 1 + di, j + 1 + dj]
+        )
+        if sources:
+            entries[int(index[i + 1, j + 1])] = (sources, (1 / len(sources),) * len(sources))
+    return entries
+
+
+# Boundary conditions (left, right, top, bottom) of field ("u", "v" or "p") on fields of the given
+# shape, as one segment per side, followed by a stage for the solid cells of an obstacle. The sides
+# are applied in order, so a later side overwrites the corners of an earlier one. A segment is the
+# ghost cells and interior neighbours of a side, its coefficient (None for a constant) and constant
+class BoundaryPlan:
+    def __init__(self, field, shape, dtype, dx, dy, boundaries, obstacle=None):
+        self.key = (field, shape, np.dtype(dtype), dx, dy, BoundaryKey(boundaries), id(obstacle))
+        self.boundaries = tuple(boundaries)
+        self.obstacle = obstacle
+        rows = shape[-2]
+        cols = shape[-1]
+        # On a stretched grid dx and dy are the (first, last) distances between a ghost point and
+        # its neighbour
+        dx_left, dx_right = dx if isinstance(dx, tuple) else (dx, dx)
+        dy_bottom, dy_top = dy if isinstance(dy, tuple) else (dy, dy)
+        # Ghost cells, neighbours, spacing and sign of a Neumann value of each side
+        sides = (
+            ((Ellipsis, slice(0, rows), 0), (Ellipsis, slice(0, rows), 1), dx_left, -1),
+            (
+                (Ellipsis, slice(0, rows), cols - 1),
+                (Ellipsis, slice(0, rows), cols - 2),
+                dx_right,
+                1,
+            ),
+            (
+                (Ellipsis, rows - 1, slice(0, cols)),
+                (Ellipsis, rows - 2, slice(0, cols)),
+                dy_top,
+                -1,
+            ),
+            ((Ellipsis, 0, slice(0, cols)), (Ellipsis, 1, slice(0, cols)), dy_bottom, 1),
+        )
+        self.segments = []
+        for name, (ghosts, neighbours, delta, sign), boundary, dirichlet in zip(
+            SIDES, sides, boundaries, DIRICHLET[field]
+        ):
+            if boundary.type == "N":
+                segment = (ghosts, neighbours, 1, sign * boundary.value * delta)
+            elif boundary.type == "D" and dirichlet == "face":
+                segment = (ghosts, neighbours, -1, 2 * boundary.value)
+            elif boundary.type == "D":
+                segment = (ghosts, None, None, boundary.value)
+                # A Dirichlet pressure on the right is only imposed in the first interior row
+                if field == "p" and name == "right":
+                    segment = ((Ellipsis, slice(1, 2), cols - 1), None, None, boundary.value)
+            else:
+                raise ValueError("Unknown boundary type: {0}".format(boundary.type))
+            self.segments.append(segment)
+        self.stage = None
+        if obstacle is not None:
+            self.stage = PlanStage(ObstacleEntries(field, obstacle), dtype)
+
+    def Apply(self, field):
+        for ghosts, neighbours, coefficient, constant in self.segments:
+            if coefficient is None:
+                field[ghosts] = constant
+            elif coefficient == 1:
+                np.add(constant, field[neighbours], out=field[ghosts])
+            else:
+                np.subtract(constant, field[neighbours], out=field[ghosts])
+        if self.stage is not None:
+            self.stage.Apply(field)
+
+    # The part of the plan that writes to the rows start to stop - 1 of the padded field, e.g. for
+    # the strip of one worker. Obstacles are not split
+    def Rows(self, start, stop):
+        plan = object.__new__(BoundaryPlan)
+        plan.__dict__.update(self.__dict__)
+        plan.segments = []
+        for ghosts, neighbours, coefficient, constant in self.segments:
+            row = ghosts[1]
+            if isinstance(row, slice):
+                first = max(row.start, start)
+                last = min(row.stop, stop)
+                if first >= last:
+                    continue
+                ghosts = (Ellipsis, slice(first, last), ghosts[2])
+                if neighbours is not None:
+                    neighbours = (Ellipsis, slice(first, last), neighbours[2])
+                # Values given per ghost cell are cut to the same rows
+                if np.ndim(constant) and np.shape(constant)[-1] == row.stop - row.start:
+                    constant = constant[..., first - row.start : last - row.start]
+            elif not start <= row < stop:
+                continue
+            plan.segments.append((ghosts, neighbours, coefficient, constant))
+        return plan
+
+
+# Return the plan of field for the boundaries on space, compiled once and cached on the space
+# until the mesh, the boundaries or the obstacle change
+def GetBoundaryPlan(space, field, left, right, top, bottom):
+    array = getattr(space, field)
+    boundaries = (left, right, top, bottom)
+    obstacle = getattr(space, "obstacle", None)
+    grid = getattr(space, "grid", None)
+    dx = space.dx if grid is None else grid.x_deltas
+    dy = space.dy if grid is None else grid.y_deltas
+    key = (field, array.shape, array.dtype, dx, dy)
+    key += (BoundaryKey(boundaries), id(obstacle))
+    plans = getattr(space, "boundary_plans", None)
+    if plans is None:
+        plans = space.boundary_plans = {}
+    plan = plans.get(field)
+    if plan is None or plan.key != key:
+        plan = BoundaryPlan(field, *key[1:5], boundaries, obstacle)
+        plans[field] = plan
+    return plan
 
-    if top.type == "D":
-        space.u[-1, :] = 2 * top.value - space.u[-2, :]
-    elif top.type == "N":
-        space.u[-1, :] = -top.value * space.dy + space.u[-2, :]
 
-    if bottom.type == "D":
-        space.u[0, :] = 2 * bottom.value - space.u[1, :]
-    elif bottom.type == "N":
-        space.u[0, :] = bottom.value * space.dy + space.u[1, :]
+# Set boundary conditions for horizontal velocity
+def SetUBoundary(space, left, right, top, bottom):
+    GetBoundaryPlan(space, "u", left, right, top, bottom).Apply(space.u)
 
 
 # Set boundary conditions for vertical velocity
 def SetVBoundary(space, left, right, top, bottom):
-    if left.type == "D":
-        space.v[:, 0] = 2 * left.value - space.v[:, 1]
-    elif left.type == "N":
-        space.v[:, 0] = -left.value * space.dx + space.v[:, 1]
+    GetBoundaryPlan(space, "v", left, right, top, bottom).Apply(space.v)
 
-    if right.type == "D":
-        space.v[:, -1] = 2 * right.value - space.v[:, -2]
-    elif right.type == "N":
-        space.v[:, -1] = right.value * space.dx + space.v[:, -2]
 
-    if top.type == "D":
-        space.v[-1, :] = top.value
-    elif top.type == "N":
-        space.v[-1, :] = -top.value * space.dy + space.v[-2, :]
+# Set boundary conditions for pressure
+def SetPBoundary(space, left, right, top, bottom):
+    GetBoundaryPlan(space, "p", left, right, top, bottom).Apply(space.p)
 
-    if bottom.type == "D":
-        space.v[0, :] = bottom.value
-    elif bottom.type == "N":
-        space.v[0, :] = bottom.value * space.dy + space.v[1, :]
 
+# Zero the velocities of the solid cells of the obstacle in the given fields, e.g. the starred
+# velocities after the predictor
+def SetObstacleVelocities(space, *fields):
+    if space.obstacle is not None:
+        for field in fields:
+            FlatView(field)[..., space.obstacle_cells] = 0
 
-# Set boundary conditions for pressure
-def SetPBoundary(space, left, right, top, bottom):
-    if left.type == "D":
-        space.p[:, 0] = left.value
-    elif left.type == "N":
-        space.p[:, 0] = -left.value * space.dx + space.p[:, 1]
-
-    if right.type == "D":
-        space.p[1, -1] = right.value
-    elif right.type == "N":
-        space.p[:, -1] = right.value * space.dx + space.p[:, -2]
-
-    if top.type == "D":
-        space.p[-1, :] = top.value
-    elif top.type == "N":
-        space.p[-1, :] = -top.value * space.dy + space.p[-2, :]
-
-    if bottom.type == "D":
-        space.p[0, :] = bottom.value
-    elif bottom.type == "N":
-        space.p[0, :] = bottom.value * space.dy + space.p[1, :]
-
-
-def SetTimeStep(CFL, space, fluid):
-    with np.errstate(divide="ignore"):
-        dt = CFL / np.sum([np.amax(space.u) / space.dx, np.amax(space.v) / space.dy])
+
+# For a batch of cases CFL may hold one value per case, and space.dt gets the shape (cases, 1, 1).
+# diffusion=False leaves out the diffusion limit of a stretched grid, for an implicit viscous term
+def SetTimeStep(CFL, space, fluid, diffusion=True):
+    if getattr(space, "grid", None) is not None:
+        with np.errstate(divide="ignore"):
+            dt = grids.TimeStep(CFL, space, fluid, diffusion)
+    else:
+        u_max = np.amax(space.u, axis=(-2, -1))
+        v_max = np.amax(space.v, axis=(-2, -1))
+        with np.errstate(divide="ignore"):
+            dt = CFL / (u_max / space.dx + v_max / space.dy)
     # Escape condition if dt is infinity due to zero velocity initially
-    if np.isinf(dt):
-        dt = CFL * (space.dx + space.dy)
-    space.dt = dt
+    dt = np.where(np.isinf(dt), CFL * (space.dx + space.dy), dt)
+    if dt.ndim == 0:
+        space.dt = float(dt)
+    else:
+        space.dt = dt[..., np.newaxis, np.newaxis]
+
 
+# Copy the boundary values of u and v to u_star and v_star
+def SetStarredBoundaries(space):
+    for star, field in ((space.u_star, space.u), (space.v_star, space.v)):
+        star[..., 0, :] = field[..., 0, :]
+        star[..., -1, :] = field[..., -1, :]
+        star[..., :, 0] = field[..., :, 0]
+        star[..., :, -1] = field[..., :, -1]
 
-# The first function is used to get starred velocities from u and v at timestep t
-def GetStarredVelocities(space, fluid):
+
+# The first function is used to get starred velocities from u and v at timestep t.
+# All kernels write into the arrays of the space and its workspace, so no large arrays are allocated per step.
+# With copy_boundaries=False only the interior of u_star and v_star is written
+def GetStarredVelocities(space, fluid, copy_boundaries=True):
     # Save object attributes as local variable with explicity typing for improved readability
     rows = int(space.rowpts)
     cols = int(space.colpts)
-    u = space.u.astype(float, copy=False)
-    v = space.v.astype(float, copy=False)
+    u = space.u
+    v = space.v
+    u_star = space.u_star
+    v_star = space.v_star
     dx = float(space.dx)
     dy = float(space.dy)
-    dt = float(space.dt)
-    S_x = float(space.S_x)
-    S_y = float(space.S_y)
-    rho = float(fluid.rho)
-    mu = float(fluid.mu)
-
-    # Copy u and v to new variables u_star and v_star
-    u_star = u.copy()
-    v_star = v.copy()
-
-    # Calculate derivatives of u and v using the finite difference scheme.
-    # Numpy vectorization saves us from using slower for loops to go over each element in the u and v matrices
-    u1_y = (u[2:, 1 : cols + 1] - u[0:rows, 1 : cols + 1]) / (2 * dy)
-    u1_x = (u[1 : rows + 1, 2:] - u[1 : rows + 1, 0:cols]) / (2 * dx)
-    u2_y = (
-        u[2:, 1 : cols + 1]
-        - 2 * u[1 : rows + 1, 1 : cols + 1]
-        + u[0:rows, 1 : cols + 1]
-    ) / (dy**2)
-    u2_x = (
-        u[1 : rows + 1, 2:]
-        - 2 * u[1 : rows + 1, 1 : cols + 1]
-        + u[1 : rows + 1, 0:cols]
-    ) / (dx**2)
-    v_face = (
-        v[1 : rows + 1, 1 : cols + 1]
-        + v[1 : rows + 1, 0:cols]
-        + v[2:, 1 : cols + 1]
-        + v[2:, 0:cols]
-    ) / 4
-    u_star[1 : rows + 1, 1 : cols + 1] = (
-        u[1 : rows + 1, 1 : cols + 1]
-        - dt * (u[1 : rows + 1, 1 : cols + 1] * u1_x + v_face * u1_y)
-        + (dt * (mu / rho) * (u2_x + u2_y))
-        + (dt * S_x)
-    )
-
-    v1_y = (v[2:, 1 : cols + 1] - v[0:rows, 1 : cols + 1]) / (2 * dy)
-    v1_x = (v[1 : rows + 1, 2:] - v[1 : rows + 1, 0:cols]) / (2 * dx)
-    v2_y = (
-        v[2:, 1 : cols + 1]
-        - 2 * v[1 : rows + 1, 1 : cols + 1]
-        + v[0:rows, 1 : cols + 1]
-    ) / (dy**2)
-    v2_x = (
-        v[1 : rows + 1, 2:]
-        - 2 * v[1 : rows + 1, 1 : cols + 1]
-        + v[1 : rows + 1, 0:cols]
-    ) / (dx**2)
-    u_face = (
-        u[1 : rows + 1, 1 : cols + 1]
-        + u[1 : rows + 1, 2:]
-        + u[0:rows, 1 : cols + 1]
-        + u[0:rows, 2:]
-    ) / 4
-    v_star[1 : rows + 1, 1 : cols + 1] = (
-        v[1 : rows + 1, 1 : cols + 1]
-        - dt * (u_face * v1_x + v[1 : rows + 1, 1 : cols + 1] * v1_y)
-        + (dt * (mu / rho) * (v2_x + v2_y))
-        + (dt * S_y)
-    )
-
-    # Save the calculated starred velocities to the space object
-    space.u_star = u_star.copy()
-    space.v_star = v_star.copy()
+    dt = space.dt
+    S_x = space.S_x
+    S_y = space.S_y
+    rho = fluid.rho
+    mu = fluid.mu
+    w = space.workspace
+
+    # Copy the boundary values of u and v to u_star and v_star
+    if copy_boundaries:
+        SetStarredBoundaries(space)
+
+    # Stencils with the spacing of every row and column of a stretched grid
+    if getattr(space, "grid", None) is not None:
+        grids.StarredVelocities(space, fluid)
+        return
+
+    # Views of the interior and its neighbours
+    u_c = u[..., 1 : rows + 1, 1 : cols + 1]
+    u_e = u[..., 1 : rows + 1, 2:]
+    u_w = u[..., 1 : rows + 1, 0:cols]
+    u_n = u[..., 2:, 1 : cols + 1]
+    u_s = u[..., 0:rows, 1 : cols + 1]
+    v_c = v[..., 1 : rows + 1, 1 : cols + 1]
+    v_e = v[..., 1 : rows + 1, 2:]
+    v_w = v[..., 1 : rows + 1, 0:cols]
+    v_n = v[..., 2:, 1 : cols + 1]
+    v_s = v[..., 0:rows, 1 : cols + 1]
+
+    # Calculate derivatives of u using the finite difference scheme. Numpy vectorization saves us from
+    # using slower for loops, and the out= arguments reuse the workspace arrays
+    # Advection term u * u1_x + v_face * u1_y
+    np.subtract(u_e, u_w, out=w.t1)
+    w.t1 *= u_c
+    w.t1 *= 1 / (2 * dx)
+    np.add(v_c, v_w, out=w.t2)
+    w.t2 += v_n
+    w.t2 += v[..., 2:, 0:cols]
+    w.t2 *= 1 / 4
+    np.subtract(u_n, u_s, out=w.t3)
+    w.t3 *= 1 / (2 * dy)
+    w.t3 *= w.t2
+    w.t1 += w.t3
+    # Diffusion term u2_x + u2_y
+    np.add(u_e, u_w, out=w.t2)
+    np.multiply(u_c, 2, out=w.t4)
+    w.t2 -= w.t4
+    w.t2 *= 1 / dx**2
+    np.add(u_n, u_s, out=w.t3)
+    w.t3 -= w.t4
+    w.t3 *= 1 / dy**2
+    w.t2 += w.t3
+    # u_star = u - dt * advection + dt * (mu / rho) * diffusion + dt * S_x
+    u_star_c = u_star[..., 1 : rows + 1, 1 : cols + 1]
+    w.t1 *= -dt
+    w.t2 *= dt * (mu / rho)
+    np.add(u_c, w.t1, out=u_star_c)
+    u_star_c += w.t2
+    u_star_c += dt * S_x
+
+    # Advection term u_face * v1_x + v * v1_y
+    np.subtract(v_n, v_s, out=w.t1)
+    w.t1 *= v_c
+    w.t1 *= 1 / (2 * dy)
+    np.add(u_c, u_e, out=w.t2)
+    w.t2 += u_s
+    w.t2 += u[..., 0:rows, 2:]
+    w.t2 *= 1 / 4
+    np.subtract(v_e, v_w, out=w.t3)
+    w.t3 *= 1 / (2 * dx)
+    w.t3 *= w.t2
+    w.t1 += w.t3
+    # Diffusion term v2_x + v2_y
+    np.add(v_e, v_w, out=w.t2)
+    np.multiply(v_c, 2, out=w.t4)
+    w.t2 -= w.t4
+    w.t2 *= 1 / dx**2
+    np.add(v_n, v_s, out=w.t3)
+    w.t3 -= w.t4
+    w.t3 *= 1 / dy**2
+    w.t2 += w.t3
+    # v_star = v - dt * advection + dt * (mu / rho) * diffusion + dt * S_y
+    v_star_c = v_star[..., 1 : rows + 1, 1 : cols + 1]
+    w.t1 *= -dt
+    w.t2 *= dt * (mu / rho)
+    np.add(v_c, w.t1, out=v_star_c)
+    v_star_c += w.t2
+    v_star_c += dt * S_y
 
 
 # The second function is used to iteratively solve the pressure Possion equation from the starred velocities
@@ -223,109 +465,174 @@ def SolvePressurePoisson(space, fluid, left, right, top, bottom):
     # Save object attributes as local variable with explicity typing for improved readability
     rows = int(space.rowpts)
     cols = int(space.colpts)
-    u_star = space.u_star.astype(float, copy=False)
-    v_star = space.v_star.astype(float, copy=False)
-    p = space.p.astype(float, copy=False)
+    u_star = space.u_star
+    v_star = space.v_star
+    p = space.p
     dx = float(space.dx)
     dy = float(space.dy)
-    dt = float(space.dt)
-    rho = float(fluid.rho)
+    dt = space.dt
+    rho = fluid.rho
     factor = 1 / (2 / dx**2 + 2 / dy**2)
+    w = space.workspace
 
     # Define initial error and tolerance for convergence (error > tol necessary initially)
-    error = 1
-    tol = 1e-3
+    # (per case for a batch)
+    error = np.ones(space.batch)
+    tol = np.full(space.batch, 1e-3)
+
+    # Evaluate derivative of starred velocities and store the source term rho * factor / dt * (ustar1_x + vstar1_y)
+    source = w.t1
+    stretched = getattr(space, "grid", None) is not None
+    if stretched:
+        grids.JacobiSource(space, fluid, out=source)
+    else:
+        np.subtract(
+            u_star[..., 1 : rows + 1, 2:], u_star[..., 1 : rows + 1, 0:cols], out=source
+        )
+        source *= 1 / (2 * dx)
+        np.subtract(
+            v_star[..., 2:, 1 : cols + 1], v_star[..., 0:rows, 1 : cols + 1], out=w.t2
+        )
+        w.t2 *= 1 / (2 * dy)
+        source += w.t2
+        source *= rho * factor / dt
 
-    # Evaluate derivative of starred velocities
-    ustar1_x = (u_star[1 : rows + 1, 2:] - u_star[1 : rows + 1, 0:cols]) / (2 * dx)
-    vstar1_y = (v_star[2:, 1 : cols + 1] - v_star[0:rows, 1 : cols + 1]) / (2 * dy)
+    # Pressure boundary conditions, compiled once for all iterations
+    boundary_plan = GetBoundaryPlan(space, "p", left, right, top, bottom)
 
-    # Continue iterative solution until error becomes smaller than tolerance
+    # Continue iterative solution until error becomes smaller than tolerance (in every case),
+    # counting the iterations each case needed. A case that has converged keeps its pressure while
+    # the others iterate, so that it ends as it would on its own
     i = 0
-    while error > tol:
+    iterations = np.zeros(space.batch, dtype=int)
+    active = error > tol
+    while np.any(active):
         i += 1
+        iterations += active
 
         # Save current pressure as p_old
-        p_old = p.astype(float, copy=True)
-
-        # Evaluate second derivative of pressure from p_old
-        p2_xy = (p_old[2:, 1 : cols + 1] + p_old[0:rows, 1 : cols + 1]) / dy**2 + (
-            p_old[1 : rows + 1, 2:] + p_old[1 : rows + 1, 0:cols]
-        ) / dx**2
-
-        # Calculate new pressure
-        p[1 : rows + 1, 1 : cols + 1] = (p2_xy) * factor - (rho * factor / dt) * (
-            ustar1_x + vstar1_y
-        )
-
-        # Find maximum error between old and new pressure matrices
-        error = np.amax(abs(p - p_old))
+        np.copyto(w.p_old, p)
+
+        if stretched:
+            grids.JacobiSweep(space, source)
+        else:
+            # Evaluate second derivative of pressure
+            p2_xy = w.t2
+            np.add(p[..., 2:, 1 : cols + 1], p[..., 0:rows, 1 : cols + 1], out=p2_xy)
+            p2_xy *= 1 / dy**2
+            np.add(p[..., 1 : rows + 1, 2:], p[..., 1 : rows + 1, 0:cols], out=w.t3)
+            w.t3 *= 1 / dx**2
+            p2_xy += w.t3
+
+            # Calculate new pressure
+            p2_xy *= factor
+            np.subtract(p2_xy, source, out=p[..., 1 : rows + 1, 1 : cols + 1])
+
+        # Solid cells of an obstacle follow the new pressure of their fluid neighbours, so that only
+        # the change of the fluid is measured
+        if boundary_plan.stage is not None:
+            boundary_plan.stage.Apply(p)
+
+        # Find maximum error between old and new pressure matrices (per case for a batch)
+        np.subtract(p, w.p_old, out=w.p_diff, dtype=w.p_diff.dtype)
+        np.abs(w.p_diff, out=w.p_diff)
+        change = np.amax(w.p_diff, axis=(-2, -1))
 
         # Apply pressure boundary conditions
-        SetPBoundary(space, left, right, top, bottom)
-
-        # Escape condition in case solution does not converge after 500 iterations
-        if i > 500:
-            tol *= 10
+        boundary_plan.Apply(p)
+
+        if np.all(active):
+            error = change
+        else:
+            p[~active] = w.p_old[~active]
+            error = np.where(active, change, error)
+
+        # Escape condition in case solution does not converge after 500 iterations (of a case)
+        tol = np.where(active & (iterations > 500), tol * 10, tol)
+        active = error > tol
+
+    # Record the number of iterations and the final change for reporting
+    if space.batch:
+        space.p_iterations = iterations
+        space.p_residual = error
+    else:
+        space.p_iterations = i
+        space.p_residual = float(error)
 
 
 # The third function is used to calculate the velocities at timestep t+delta_t using the pressure at t+delta_t and starred velocities
 def SolveMomentumEquation(space, fluid):
+    if getattr(space, "grid", None) is not None:
+        grids.CorrectVelocities(space, fluid)
+        return
+
     # Save object attributes as local variable with explicity typing for improved readability
     rows = int(space.rowpts)
     cols = int(space.colpts)
-    u_star = space.u_star.astype(float, copy=False)
-    v_star = space.v_star.astype(float, copy=False)
-    p = space.p.astype(float, copy=False)
+    u_star = space.u_star
+    v_star = space.v_star
+    p = space.p
     dx = float(space.dx)
     dy = float(space.dy)
-    dt = float(space.dt)
-    rho = float(fluid.rho)
-    u = space.u.astype(float, copy=False)
-    v = space.v.astype(float, copy=False)
+    dt = space.dt
+    rho = fluid.rho
+    u = space.u
+    v = space.v
+    w = space.workspace
 
     # Evaluate first derivative of pressure in x direction
-    p1_x = (p[1 : rows + 1, 2:] - p[1 : rows + 1, 0:cols]) / (2 * dx)
+    p1_x = w.t1
+    np.subtract(p[..., 1 : rows + 1, 2:], p[..., 1 : rows + 1, 0:cols], out=p1_x)
+    p1_x *= (dt / rho) / (2 * dx)
     # Calculate u at next timestep
-    u[1 : rows + 1, 1 : cols + 1] = (
-        u_star[1 : rows + 1, 1 : cols + 1] - (dt / rho) * p1_x
+    np.subtract(
+        u_star[..., 1 : rows + 1, 1 : cols + 1], p1_x, out=u[..., 1 : rows + 1, 1 : cols + 1]
     )
 
     # Evaluate first derivative of pressure in y direction
-    p1_y = (p[2:, 1 : cols + 1] - p[0:rows, 1 : cols + 1]) / (2 * dy)
+    p1_y = w.t1
+    np.subtract(p[..., 2:, 1 : cols + 1], p[..., 0:rows, 1 : cols + 1], out=p1_y)
+    p1_y *= (dt / rho) / (2 * dy)
     # Calculate v at next timestep
-    v[1 : rows + 1, 1 : cols + 1] = (
-        v_star[1 : rows + 1, 1 : cols + 1] - (dt / rho) * p1_y
+    np.subtract(
+        v_star[..., 1 : rows + 1, 1 : cols + 1], p1_y, out=v[..., 1 : rows + 1, 1 : cols + 1]
     )
 
 
 def SetCentrePUV(space):
-    space.p_c = space.p[1:-1, 1:-1]
-    space.u_c = space.u[1:-1, 1:-1]
-    space.v_c = space.v[1:-1, 1:-1]
+    space.p_c = space.p[..., 1:-1, 1:-1]
+    space.u_c = space.u[..., 1:-1, 1:-1]
+    space.v_c = space.v[..., 1:-1, 1:-1]
+
+
+# Files the solver writes to a result directory: text and binary snapshots (one file per case for
+# an ensemble) and the online statistics of reduction, with their temporary files
+RESULT_PATTERNS = ("PUV*.txt", "PUV*.bin", "statistics.npz", "statistics.npz.tmp")
 
 
-def MakeResultDirectory(wipe=False):
+# Make the directory that results are written to (by default ./results) and return its path
+def MakeResultDirectory(wipe=False, dir_path=None):
     # Get path to the Result directory
-    cwdir = os.getcwd()
-    dir_path = os.path.join(cwdir, "results")
+    if dir_path is None:
+        dir_path = os.path.join(os.getcwd(), "results")
     # If directory does not exist, make it
     if not os.path.isdir(dir_path):
         os.makedirs(dir_path, exist_ok=True)
     else:
-        # If wipe is True, remove files present in the directory
+        # If wipe is True, remove the results of an earlier run, leaving any other file alone
         if wipe:
-            os.chdir(dir_path)
-            filelist = os.listdir()
-            for file in filelist:
-                os.remove(file)
+            for pattern in RESULT_PATTERNS:
+                for path in glob.glob(os.path.join(glob.escape(dir_path), pattern)):
+                    if os.path.isfile(path):
+                        os.remove(path)
 
-    os.chdir(cwdir)
+    return dir_path
 
 
-def WriteToFile(space, iteration, interval):
+def WriteToFile(space, iteration, interval, dir_path=None):
     if iteration % interval == 0:
-        dir_path = os.path.join(os.getcwd(), "results")
+        if dir_path is None:
+            dir_path = os.path.join(os.getcwd(), "results")
         filename = "PUV{0}.txt".format(iteration)
         path = os.path.join(dir_path, filename)
         with open(path, "w") as f: